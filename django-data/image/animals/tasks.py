@@ -9,6 +9,8 @@ Created on Wed Feb 27 16:38:37 2019
 from celery.utils.log import get_task_logger
 
 from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
 
 from common.constants import NEED_REVISION
 from common.tasks import BaseTask, NotifyAdminTaskMixin
@@ -53,6 +55,12 @@ class BatchDeleteAnimals(SubmissionTaskMixin, NotifyAdminTaskMixin, BaseTask):
                     for sample in samples:
                         sample.delete()
 
+                    # childs will loose their relationship: they need to
+                    # be validated again
+                    Animal.objects.filter(
+                        Q(mother=animal_object) | Q(father=animal_object)
+                    ).update(last_changed=timezone.now())
+
                     logger.debug("Clearing all childs from this animal")
                     animal_object.mother_of.clear()
                     animal_object.father_of.clear()
@@ -76,15 +84,16 @@ class BatchDeleteAnimals(SubmissionTaskMixin, NotifyAdminTaskMixin, BaseTask):
             message = f"You've removed {len(success_ids)} " \
                 f"animals. Rerun validation please!"
 
+        # update validation summary relying on database
         summary_obj, created = ValidationSummary.objects.get_or_create(
             submission=submission_obj, type='animal')
-        summary_obj.reset()
+        summary_obj.recompute()
 
         # after removing animal associated samples, we need to update also
-        # sample all count
+        # sample summary
         summary_obj, created = ValidationSummary.objects.get_or_create(
             submission=submission_obj, type='sample')
-        summary_obj.reset()
+        summary_obj.recompute()
 
         # mark submission with NEED_REVISION and send message
         self.update_submission_status(
@@ -94,10 +103,6 @@ class BatchDeleteAnimals(SubmissionTaskMixin, NotifyAdminTaskMixin, BaseTask):
             construct_message=True
         )
 
-        # TODO: validation summary could be updated relying database, instead
-        # doing validation. Define a method in validation.helpers to update
-        # summary relying only on database
-
         logger.info("batch delete for animals completed")
 
         return 'success'
@@ -115,14 +115,14 @@ class BatchDeleteAnimalsTest(
         # updating validation messages
 
         # calling a WebSocketMixin method
-        # no validation message since no data in validation table
+        # animal 1 has a validation result: counts are recomputed
         self.check_message(
             message=STATUSES.get_value_display(NEED_REVISION),
             notification_message=(
                 "You've removed 0 animals. It wasn't possible to find records "
                 "with these ids: meow. Rerun validation please!"),
             validation_message={
-                'animals': 3, 'samples': 1, 'animal_unkn': 3,
+                'animals': 3, 'samples': 1, 'animal_unkn': 2,
                 'sample_unkn': 1, 'animal_issues': 0, 'sample_issues': 0}
         )
 
@@ -12,7 +12,7 @@ import sys
 
 from django.core.management import BaseCommand
 
-from uid.models import Submission, Animal
+from uid.models import Submission, Animal, Sample
 
 # Get an instance of a logger
 logger = logging.getLogger(__name__)
@@ -45,12 +45,17 @@ class Command(BaseCommand):
         samples_json = []
 
         # a more limited subset
-        for animal in Animal.objects.filter(submission=submission):
-            animals_json += [animal.to_biosample()]
+        animals = Animal.objects.filter(submission=submission).order_by('id')
 
-            # get samples data and add to a list
-            for sample in animal.sample_set.all():
-                samples_json += [sample.to_biosample()]
+        for animal, data in Animal.to_biosample_many(animals):
+            animals_json += [data]
+
+        # get samples data (of the same animals) and add to a list
+        samples = Sample.objects.filter(
+            animal__submission=submission).order_by('animal', 'id')
+
+        for sample, data in Sample.to_biosample_many(samples):
+            samples_json += [data]
 
         # collect all data in a dictionary
         biosamples = {'sample': animals_json + samples_json}
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.24 on 2020-11-02 11:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biosample', '0006_auto_20200529_1757'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submissiondata',
+            name='uploaded_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='submissiondata',
+            name='usi_href',
+            field=models.URLField(blank=True, max_length=255, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.24 on 2020-11-04 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biosample', '0007_submissiondata_uploaded_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='payload_bytes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='upload_time',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='uploaded_bytes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
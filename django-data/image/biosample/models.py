@@ -84,6 +84,12 @@ class Submission(BaseSubmission):
         on_delete=models.CASCADE,
         related_name='usi_submissions')
 
+    # the estimated size of submission data (in bytes) and the time spent
+    # to upload uploaded_bytes to USI. Used to size the next submissions
+    payload_bytes = models.PositiveIntegerField(default=0)
+    uploaded_bytes = models.PositiveIntegerField(default=0)
+    upload_time = models.FloatField(null=True, blank=True)
+
     def __str__(self):
         return "%s <%s> (%s): %s" % (
             self.id,
@@ -113,6 +119,11 @@ class SubmissionData(models.Model):
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey('content_type', 'object_id')
 
+    # track when object was uploaded to USI and the USI sample url, in
+    # order to resume a submission without reading all USI samples
+    uploaded_at = models.DateTimeField(null=True, blank=True)
+    usi_href = models.URLField(max_length=255, null=True, blank=True)
+
     def __str__(self):
         return "%s <%s>: %s" % (
             self.submission.id,
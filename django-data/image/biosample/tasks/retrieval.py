@@ -8,7 +8,6 @@ Created on Tue Jul 16 11:25:03 2019
 
 import os
 import json
-from collections import Counter, defaultdict
 
 from decouple import AutoConfig
 from celery.utils.log import get_task_logger
@@ -17,7 +16,6 @@ import pyUSIrest.usi
 import pyUSIrest.exceptions
 
 from django.conf import settings
-from django.contrib.contenttypes.models import ContentType
 from django.db.models import Count, F
 from django.utils import timezone
 
@@ -27,7 +25,7 @@ from uid.models import Submission
 from common.tasks import BaseTask, NotifyAdminTaskMixin, exclusive_task
 from common.constants import ERROR, NEED_REVISION, SUBMITTED, COMPLETED
 from submissions.tasks import SubmissionTaskMixin
-from validation.models import ValidationResult, ValidationSummary
+from validation.models import ValidationSummary
 
 from ..helpers import get_manager_auth
 from ..models import Submission as USISubmission
@@ -536,39 +534,16 @@ class RetrievalCompleteTask(SubmissionTaskMixin, BaseTask):
         logger.debug("Update validationsummary(%s) for %s" % (
             model, uid_submission))
 
-        model_type = ContentType.objects.get(app_label='uid', model=model)
-
-        # get validation results querysets
-        model_qs = ValidationResult.objects.filter(
-            submission=uid_submission,
-            content_type=model_type,
-            status="Error")
-
-        # ok now prepare messages
-        messages_counter = Counter()
-        messages_ids = defaultdict(list)
-
-        for item in model_qs:
-            for message in item.messages:
-                messages_counter.update([message])
-                messages_ids[message].append(item.content_object.id)
-
         # ok preparing to update summary object
         model_summary = ValidationSummary.objects.get(
             submission=uid_submission, type=model)
-        messages = []
 
-        # create messages. No offending column since is not always possible
-        # to determine a column from USI error. With this, I have a record
-        # in ValidationSummary page, but I don't have a link to batch update
-        # since is not possible to determine and change a column in my
-        # data
-        for message, count in messages_counter.items():
-            messages.append({
-                'message': message,
-                'count': count,
-                'ids': messages_ids[message],
-                'offending_column': ''})
+        # create messages from errors. No offending column since is not
+        # always possible to determine a column from USI error. With this, I
+        # have a record in ValidationSummary page, but I don't have a link
+        # to batch update since is not possible to determine and change a
+        # column in my data
+        messages = model_summary.get_result_messages(status="Error")
 
         model_summary.messages = messages
         model_summary.save()
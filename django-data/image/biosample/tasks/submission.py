@@ -6,30 +6,41 @@ Created on Thu Jul 18 14:14:06 2019
 @author: Paolo Cozzi <cozzi@ibba.cnr.it>
 """
 
+import time
 import redis
+import requests
+import threading
 import traceback
 import pyUSIrest.usi
 import pyUSIrest.exceptions
 
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from celery import chord
 from celery.utils.log import get_task_logger
 
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
-from django.db.models import Count, F
+from django.db import transaction
+from django.db.models import Count, F, Q
 from django.db.models.functions import Least
 from django.utils import timezone
 from django.template.defaultfilters import truncatechars
 
 from common.constants import (
     ERROR, READY, SUBMITTED, COMPLETED, EMAIL_MAX_BODY_SIZE)
+from common.helpers import chunks, get_payload_size
 from common.tasks import BaseTask, NotifyAdminTaskMixin
 from image.celery import app as celery_app
 from submissions.tasks import SubmissionTaskMixin
+from uid.models import Animal, Sample
+
+from validation.models import ValidationResult
 
 from ..helpers import get_auth
 from ..models import (
-    Submission as USISubmission, SubmissionData as USISubmissionData)
+    Account, Submission as USISubmission,
+    SubmissionData as USISubmissionData)
 
 # Get an instance of a logger
 logger = get_task_logger(__name__)
@@ -37,6 +48,30 @@ logger = get_task_logger(__name__)
 # how many sample for submission
 MAX_SAMPLES = 100
 
+# the maximum size (in bytes) of the data in a submission
+MAX_PAYLOAD_BYTES = 2 * 1024 ** 2
+
+# the time (in seconds) a submission should take to be uploaded. Used with
+# USI throughput observed in previous submissions to limit their size
+UPLOAD_TIME = 300
+
+# how many previous submissions are used to estimate USI throughput
+UPLOAD_HISTORY = 20
+
+# how many submission data are read and updated at once when adding
+# samples to a USI submission
+SUBMISSION_DATA_BATCH_SIZE = 100
+
+# how many samples are uploaded concurrently to USI
+USI_WORKERS = 4
+
+# how many times a request is tried again after USI connection errors
+USI_RETRIES = 3
+
+# the time (in seconds) before trying a request again. Is doubled after
+# each failed attempt
+USI_BACKOFF = 1
+
 
 class SubmissionError(Exception):
     """Exception call for Error with submissions"""
@@ -67,6 +102,14 @@ class SubmissionHelper():
 
         # here I will store samples already submitted
         self.submitted_samples = {}
+        self.samples_read = False
+
+        # the USI url of samples already submitted, by alias (tracked in
+        # submission data, see add_samples)
+        self.usi_hrefs = {}
+
+        # read USI samples once from concurrent uploads
+        self.lock = threading.Lock()
 
         # get a submission object
         self.submission_obj = USISubmission.objects.get(
@@ -152,6 +195,11 @@ class SubmissionHelper():
         if not self.recover_submission():
             self.create_submission()
 
+        # concurrent requests to USI share the same connection pool (see
+        # upload_samples)
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=USI_WORKERS)
+        self.usi_submission.session.mount("https://", adapter)
+
         return self.usi_submission
 
     def recover_submission(self):
@@ -177,8 +225,11 @@ class SubmissionHelper():
                    self.usi_submission_name,
                    self.usi_submission.status))
 
-        # read already submitted samples
-        self.read_samples()
+        # read already submitted samples, unless uploads were tracked in
+        # submission data (see add_samples)
+        if not self.submission_obj.submission_data.filter(
+                uploaded_at__isnull=False).exists():
+            self.read_samples()
 
         return True
 
@@ -216,61 +267,357 @@ class SubmissionHelper():
 
         logger.debug("Got %s samples" % (i+1))
 
+        self.samples_read = True
+
         return self.submitted_samples
 
-    def create_or_update_sample(self, model):
+    def read_samples_once(self):
+        """Read samples in a USI submission document, if not already done.
+        Could be called by concurrent uploads"""
+
+        with self.lock:
+            if not self.samples_read:
+                self.read_samples()
+
+    def get_sample(self, alias):
+        """Get a USI sample already submitted, using the url tracked in
+        submission data if samples weren't read
+
+        Args:
+            alias (str): the sample alias
+
+        Returns:
+            pyUSIrest.usi.Sample: a USI sample or None
+        """
+
+        if alias in self.submitted_samples:
+            return self.submitted_samples[alias]
+
+        if alias in self.usi_hrefs:
+            sample = pyUSIrest.usi.Sample.read_url(
+                self.auth, self.usi_hrefs[alias])
+            self.submitted_samples[alias] = sample
+
+            return sample
+
+        return None
+
+    def patch_sample(self, sample, data):
+        """Patch a USI sample with the to_biosample() data of a model"""
+
+        logger.info("Patching %s" % (sample.alias))
+
+        sample.session = self.usi_submission.session
+        sample.patch(data)
+
+    def create_or_update_sample(self, model, data=None):
         """Add or patch a sample into USI submission document. Can be
-        animal or sample
+        animal or sample. Status is updated but not saved (see
+        :py:meth:`add_samples`)
 
         Args:
             model (:py:class:`uid.mixins.BioSampleMixin`): An animal or
-                sample object"""
+                sample object
+            data (dict): the to_biosample() dictionary of model (if already
+                computed, see BioSampleMixin.to_biosample_many)"""
 
         # alias is used to reference the same objects
         alias = model.biosample_alias
 
+        if data is None:
+            data = model.to_biosample()
+
         # check in my submitted samples
-        if alias in self.submitted_samples:
-            # patch sample
-            logger.info("Patching %s" % (alias))
+        sample = self.get_sample(alias)
 
-            # get usi sample
-            sample = self.submitted_samples[alias]
-            sample.patch(model.to_biosample())
+        if sample is not None:
+            self.patch_sample(sample, data)
 
         else:
-            sample = self.usi_submission.create_sample(
-                model.to_biosample())
+            try:
+                sample = self.usi_submission.create_sample(data)
+
+            except pyUSIrest.exceptions.USIDataError:
+                # sample could be submitted without tracking it (ie. by
+                # a task killed while uploading): read all USI samples
+                self.read_samples_once()
+                sample = self.submitted_samples.get(alias)
 
+                if sample is None:
+                    raise
+
+                self.patch_sample(sample, data)
+
+            sample.session = self.usi_submission.session
             self.submitted_samples[alias] = sample
 
+        # track USI url in submission data (see add_samples)
+        self.usi_hrefs[alias] = sample._links['self']['href']
+
         # update sample status
         model.status = SUBMITTED
         model.last_submitted = timezone.now()
-        model.save()
+
+    def get_submission_models(self):
+        """
+        Iterate over sample data (animal/sample) in batches. Animals and
+        samples of each batch are read with a query for each type, and
+        objects to submit are serialized with their related objects
+
+        Yields:
+            list: a list of (submission_data, model, data) tuples in
+            submission data order. data is the to_biosample() dictionary of
+            model or None if model is not in READY state
+        """
+
+        data_qs = self.submission_obj.submission_data.order_by('id')
+
+        for chunk in chunks(data_qs.iterator(), SUBMISSION_DATA_BATCH_SIZE):
+            # group objects by content type
+            object_ids = defaultdict(set)
+
+            for submission_data in chunk:
+                object_ids[submission_data.content_type_id].add(
+                    submission_data.object_id)
+
+            models = {}
+
+            for content_type_id, ids in object_ids.items():
+                model_class = ContentType.objects.get_for_id(
+                    content_type_id).model_class()
+                queryset = model_class.objects.filter(id__in=ids)
+
+                for model, data in model_class.to_biosample_many(
+                        queryset.filter(status=READY)):
+                    models[(content_type_id, model.id)] = (model, data)
+
+                for model in queryset.exclude(status=READY):
+                    models[(content_type_id, model.id)] = (model, None)
+
+            items = []
+
+            for submission_data in chunk:
+                key = (
+                    submission_data.content_type_id, submission_data.object_id)
+
+                if key in models:
+                    items.append((submission_data, ) + models[key])
+
+            yield items
+
+    def upload_sample(self, model, data):
+        """Call :py:meth:`create_or_update_sample` and try again after
+        USI connection errors, waiting more after each attempt"""
+
+        for attempt in range(USI_RETRIES + 1):
+            try:
+                return self.create_or_update_sample(model, data)
+
+            except pyUSIrest.exceptions.USIConnectionError as exc:
+                if attempt == USI_RETRIES:
+                    raise
+
+                delay = USI_BACKOFF * 2 ** attempt
+
+                logger.warning(
+                    "Error while uploading %s: %s. Retrying in %s s" % (
+                        model.biosample_alias, exc, delay))
+
+                time.sleep(delay)
+
+    def upload_samples(self, items, uploaded, on_upload=None):
+        """
+        Upload many samples concurrently, with at most
+        :py:const:`USI_WORKERS` requests at the same time. A sample is
+        uploaded after the samples it references by alias (ie. parents
+        are uploaded before their children)
+
+        Args:
+            items (list): a list of (model, data) tuples
+            uploaded (list): models successfully uploaded are appended
+                to this list, even if this method raises an exception
+            on_upload (callable): called (in this thread) with each
+                model as soon as its upload completes
+        """
+
+        # the first error received. Raised after all requests end
+        error = None
+
+        # track upload by alias
+        futures = {}
+        models = {}
+        pending = set()
+
+        def collect(done):
+            nonlocal error
+
+            for future in done:
+                pending.discard(future)
+
+                try:
+                    future.result()
+
+                except Exception as exc:
+                    if error is None:
+                        error = exc
+
+                    continue
+
+                model = models[future]
+                uploaded.append(model)
+
+                if on_upload is not None:
+                    on_upload(model)
+
+        with ThreadPoolExecutor(max_workers=USI_WORKERS) as executor:
+            for model, data in items:
+                # track uploads completed so far
+                collect([future for future in pending if future.done()])
+
+                aliases = [
+                    relationship['alias'] for relationship in
+                    data.get('sampleRelationships', [])
+                    if 'alias' in relationship]
+
+                # wait for referenced samples in this batch (and for the
+                # same sample, which will be patched)
+                aliases.append(model.biosample_alias)
+
+                waiting = set(
+                    futures[alias] for alias in aliases if alias in futures)
+
+                while waiting & pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+
+                future = executor.submit(self.upload_sample, model, data)
+                futures[model.biosample_alias] = future
+                models[future] = model
+                pending.add(future)
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+
+        if error is not None:
+            raise error
 
     def add_samples(self):
         """Iterate over sample data (animal/sample) and call
-        create_or_update_sample (if model is in READY state)"""
+        create_or_update_sample (if model is in READY state). Samples are
+        uploaded concurrently, and statuses are written for each batch of
+        sample data. Upload time is tracked in submission object"""
+
+        # the time spent uploading samples
+        upload_time = 0
+        uploaded_bytes = 0
+
+        for chunk in self.get_submission_models():
+            items = []
+            uploaded = []
+
+            # submission data by alias, in order to track uploads
+            submission_data_by_alias = defaultdict(list)
+
+            for submission_data, model, data in chunk:
+                if model.status != READY:
+                    logger.debug(
+                        "Ignoring %s %s: current status is %s" % (
+                            model._meta.verbose_name,
+                            model,
+                            model.get_status_display()))
+                    continue
+
+                alias = model.biosample_alias
+                submission_data_by_alias[alias].append(submission_data)
+
+                # uploaded by a previous task: patch sample only if changed
+                if submission_data.uploaded_at:
+                    self.usi_hrefs[alias] = submission_data.usi_href
+
+                    if (model.last_changed is None or
+                            model.last_changed <= submission_data.uploaded_at):
+                        logger.debug(
+                            "Ignoring %s %s: already in submission %s" % (
+                                model._meta.verbose_name,
+                                model,
+                                self.usi_submission_name))
+
+                        model.status = SUBMITTED
+                        model.last_submitted = submission_data.uploaded_at
+                        uploaded.append(model)
+                        continue
 
-        # iterate over sample data
-        for submission_data in self.submission_obj.submission_data\
-                .order_by('id'):
-            # get model for simplicity
-            model = submission_data.content_object
-
-            if model.status == READY:
                 logger.debug("Adding %s %s to submission %s" % (
                     model._meta.verbose_name,
                     model,
                     self.usi_submission_name))
-                self.create_or_update_sample(model)
+                items.append((model, data))
 
-            else:
-                logger.debug("Ignoring %s %s: current status is %s" % (
-                    model._meta.verbose_name,
-                    model,
-                    model.get_status_display()))
+            # track each sample added to USI as soon as possible: a new
+            # task will ignore it, even if this one is killed
+            def on_upload(model):
+                self.track_upload(
+                    model, submission_data_by_alias[model.biosample_alias])
+
+            start = time.perf_counter()
+
+            try:
+                self.upload_samples(items, uploaded, on_upload)
+
+            finally:
+                self.mark_uploaded(uploaded)
+
+            upload_time += time.perf_counter() - start
+            uploaded_bytes += sum(
+                get_payload_size(data) for model, data in items)
+
+        # track timings (see SplitSubmissionHelper.get_max_payload_bytes)
+        if uploaded_bytes > 0:
+            self.submission_obj.upload_time = upload_time
+            self.submission_obj.uploaded_bytes = uploaded_bytes
+            self.submission_obj.save()
+
+    def track_upload(self, model, submission_data_list):
+        """
+        Track an uploaded model in its submission data (upload time and
+        USI url)
+
+        Args:
+            model (:py:class:`uid.mixins.BioSampleMixin`): An uploaded
+                animal or sample object
+            submission_data_list (list): the
+                :py:class:`biosample.models.SubmissionData` objects of model
+        """
+
+        usi_href = self.usi_hrefs.get(model.biosample_alias)
+
+        for submission_data in submission_data_list:
+            submission_data.uploaded_at = model.last_submitted
+            submission_data.usi_href = usi_href
+
+        USISubmissionData.objects.filter(
+            pk__in=[
+                submission_data.pk for submission_data in submission_data_list]
+        ).update(uploaded_at=model.last_submitted, usi_href=usi_href)
+
+    def mark_uploaded(self, models):
+        """
+        Write status and last_submitted of uploaded models, with a
+        query for each model type
+
+        Args:
+            models (list): a list of uploaded Animal/Sample objects
+        """
+
+        submitted = defaultdict(list)
+
+        for model in models:
+            submitted[model.__class__].append(model)
+
+        for model_class, models in submitted.items():
+            model_class.objects.bulk_update(
+                models, ['status', 'last_submitted'])
 
     def mark_submission(self, status, message):
         self.submission_obj.status = status
@@ -346,7 +693,9 @@ class SubmitTask(NotifyAdminTaskMixin, BaseTask):
 class SplitSubmissionHelper():
     """
     helper class to split py:class`uid.models.Submission` data in
-    bacthes limited in sizes"""
+    bacthes limited in sizes. Batches are limited by the number of samples
+    and by the estimated size of data. Batches are planned in memory, then
+    submission data are written with few queries"""
 
     def __init__(self, uid_submission):
         self.counter = 0
@@ -354,8 +703,26 @@ class SplitSubmissionHelper():
         self.usi_submission = None
         self.submission_ids = []
 
-    def process_data(self):
-        """Add animal and its samples to a submission"""
+        # the submission data to be written by batch (see write_data)
+        self.batches = {}
+
+        # the estimated size of data by batch, and the size limit of each
+        # batch (see get_max_payload_bytes)
+        self.payload_bytes = {}
+        self.max_payload_bytes = MAX_PAYLOAD_BYTES
+        self.payload_sizes = {}
+
+        # (content_type_id, object_id) already processed or in an opened
+        # submission
+        self.processed = set()
+        self.opened_data = None
+        self.content_types = None
+
+        # opened submissions which will be submitted again
+        self.reopened_ids = []
+
+    def get_models(self):
+        """Iterate over animals and their samples in submission order"""
 
         # here we try to submit first animal without parents, then animal
         # with parent with lowest foreign keys, supposing that when uploadimg
@@ -363,24 +730,141 @@ class SplitSubmissionHelper():
         # the postgres LEAST is a function that will return the column with
         # the lowest value, then we have to order explicitely with F in
         # order to apply the NULLS FIRST condition (animal without parents)
-        for animal in self.uid_submission.animal_set.annotate(
-                least=Least('father_id', 'mother_id')).order_by(
-                    F('least').asc(nulls_first=True), F('id')):
+        animal_qs = self.uid_submission.animal_set.annotate(
+            least=Least('father_id', 'mother_id')).order_by(
+                F('least').asc(nulls_first=True), F('id'))
 
-            # ignore not READY models
-            self.process_model(animal)
+        # get all the samples of these animals with one query
+        samples = defaultdict(list)
 
-            # Add their specimen
-            for sample in animal.sample_set.all():
-                # ignore not READY models
-                self.process_model(sample)
+        for sample in Sample.objects.filter(
+                animal__submission=self.uid_submission).order_by('id'):
+            samples[sample.animal_id].append(sample)
 
-            # end of cicle for animal
+        for animal in animal_qs:
+            yield animal
+
+            # Add their specimen
+            for sample in samples[animal.id]:
+                yield sample
 
         # are there orphaned samples (a submission with only samples)?
-        for sample in self.uid_submission.sample_set.all():
+        for sample in self.uid_submission.sample_set.order_by('id'):
+            yield sample
+
+    def get_opened_data(self):
+        """
+        Get the animals and samples already in opened submissions, with a
+        single query
+
+        Returns:
+            dict: a dictionary of submission ids by (content_type_id,
+            object_id)
+        """
+
+        opened_data = defaultdict(list)
+
+        data_qs = USISubmissionData.objects.filter(
+            content_type__in=self.content_types.values()).exclude(
+                submission__status__in=[COMPLETED]).values_list(
+                    'content_type_id', 'object_id', 'submission_id')
+
+        for content_type_id, object_id, submission_id in data_qs:
+            opened_data[(content_type_id, object_id)].append(submission_id)
+
+        return opened_data
+
+    def get_payload_sizes(self):
+        """
+        Estimate the size of READY animals and samples (see
+        :py:func:`common.helpers.get_payload_size`). Sizes are tracked in
+        validation results, objects without a size are serialized with a
+        query for each type
+
+        Returns:
+            dict: object sizes by (content_type_id, object_id)
+        """
+
+        sizes = {}
+
+        for model_class, queryset in [
+                (Animal, Animal.objects.filter(
+                    submission=self.uid_submission)),
+                (Sample, Sample.objects.filter(
+                    Q(submission=self.uid_submission) |
+                    Q(animal__submission=self.uid_submission)))]:
+
+            content_type_id = self.content_types[model_class].id
+            queryset = queryset.filter(status=READY)
+
+            # sizes computed while validating data
+            results_qs = ValidationResult.objects.filter(
+                content_type_id=content_type_id,
+                object_id__in=queryset.values('id'),
+                payload_bytes__isnull=False).values_list(
+                    'object_id', 'payload_bytes')
+
+            for object_id, payload_bytes in results_qs.iterator():
+                sizes[(content_type_id, object_id)] = payload_bytes
+
+            # objects validated before tracking sizes
+            missing = queryset.exclude(id__in=results_qs.values('object_id'))
+
+            for model, data in model_class.to_biosample_many(missing):
+                sizes[(content_type_id, model.id)] = get_payload_size(data)
+
+        return sizes
+
+    def get_max_payload_bytes(self):
+        """
+        Get the maximum size of data in a submission, in order to upload
+        a submission in :py:const:`UPLOAD_TIME` seconds with the USI
+        throughput observed in previous submissions of the same team.
+        Throughput is measured while uploading :py:const:`USI_WORKERS`
+        samples concurrently, so it's valid only with the same number of
+        workers
+
+        Returns:
+            int: the maximum size in bytes
+        """
+
+        teams = Account.objects.filter(
+            user=self.uid_submission.owner).values('team')
+
+        history = list(USISubmission.objects.filter(
+            uid_submission__owner__biosample_account__team__in=teams,
+            upload_time__gt=0,
+            uploaded_bytes__gt=0).order_by('-id').values_list(
+                'uploaded_bytes', 'upload_time')[:UPLOAD_HISTORY])
+
+        if not history:
+            return MAX_PAYLOAD_BYTES
+
+        throughput = (
+            sum(uploaded_bytes for uploaded_bytes, _ in history) /
+            sum(upload_time for _, upload_time in history))
+
+        logger.debug("USI throughput is %.1f bytes/s" % (throughput))
+
+        return int(min(MAX_PAYLOAD_BYTES, throughput * UPLOAD_TIME))
+
+    def process_data(self):
+        """Add animal and its samples to a submission"""
+
+        self.content_types = ContentType.objects.get_for_models(
+            Animal, Sample)
+        self.opened_data = self.get_opened_data()
+        self.payload_sizes = self.get_payload_sizes()
+        self.max_payload_bytes = self.get_max_payload_bytes()
+
+        logger.debug("Splitting data in submissions of %s bytes" % (
+            self.max_payload_bytes))
+
+        for model in self.get_models():
             # ignore not READY models
-            self.process_model(sample)
+            self.process_model(model)
+
+        self.write_data()
 
     def process_model(self, model):
         """Test for a model in a biosample submission. Ignore a model if
@@ -405,52 +889,37 @@ class SplitSubmissionHelper():
         # track object pks
         self.usi_submission.refresh_from_db()
         self.submission_ids.append(self.usi_submission.id)
+        self.batches[self.usi_submission.id] = []
+        self.payload_bytes[self.usi_submission.id] = 0
 
         logger.debug("Created submission %s" % (self.usi_submission))
 
         # reset couter object
         self.counter = 0
 
-    def model_in_submission(self, model):
+    def model_in_submission(self, model, key):
         """
         Check if :py:class:`uid.mixins.BioSampleMixin` is already in an
-        opened submission"""
+        opened submission (see :py:meth:`get_opened_data`)"""
 
-        logger.debug("Searching %s %s in submissions" % (
-            model._meta.verbose_name,
-            model))
+        submission_ids = self.opened_data.get(key, [])
 
-        # get content type
-        ct = ContentType.objects.get_for_model(model)
+        if len(submission_ids) == 1:
+            usi_submission_id = submission_ids[0]
 
-        # define a queryset
-        data_qs = USISubmissionData.objects.filter(
-            content_type=ct,
-            object_id=model.id)
-
-        # exclude opened submission
-        data_qs = data_qs.exclude(submission__status__in=[COMPLETED])
-
-        if data_qs.count() == 1:
-            usi_submission = data_qs.first().submission
-
-            logger.debug("Found %s %s in %s" % (
+            logger.debug("Found %s %s in submission %s" % (
                 model._meta.verbose_name,
                 model,
-                usi_submission))
+                usi_submission_id))
 
             # mark this batch to be called like it was created
-            if usi_submission.id not in self.submission_ids:
-                self.submission_ids.append(usi_submission.id)
-
-                logger.debug(
-                    "Reset status for submission %s" % (usi_submission))
-                usi_submission.status = READY
-                usi_submission.save()
+            if usi_submission_id not in self.submission_ids:
+                self.submission_ids.append(usi_submission_id)
+                self.reopened_ids.append(usi_submission_id)
 
             return True
 
-        elif data_qs.count() >= 1:
+        elif len(submission_ids) > 1:
             raise SubmissionError(
                 "More than one submission opened for %s %s" % (
                     model._meta.verbose_name,
@@ -458,51 +927,80 @@ class SplitSubmissionHelper():
 
         else:
             # no sample in data. I could append model into submission
-            logger.debug("No %s %s in submission data" % (
-                model._meta.verbose_name,
-                model))
             return False
 
     def add_to_submission_data(self, model):
         """Add a :py:class:`uid.mixins.BioSampleMixin` to a
-        :py:class:`biosample.models.Submission` object, or create a new
+        :py:class:`biosample.models.Submission` batch, or create a new
         one if there are more samples than required"""
 
         # get model type (animal or sample)
         model_type = model._meta.verbose_name
+        key = (self.content_types[model.__class__].id, model.id)
 
-        # check if model is already in an opened submission
-        if self.model_in_submission(model):
+        # check if model is already processed or in an opened submission
+        if key in self.processed or self.model_in_submission(model, key):
             logger.debug("Ignoring %s %s: already in a submission" % (
                 model_type,
                 model))
             return
 
+        self.processed.add(key)
+
         # Create a new submission if necessary
         if self.usi_submission is None:
             self.create_submission()
 
+        size = self.payload_sizes.get(key, 0)
+        payload_bytes = self.payload_bytes[self.usi_submission.id]
+
         # every time I split data in chunks I need to call the
         # submission task. Do it only on animals, to prevent
         # to put samples in a different submission
-        if model_type == 'animal' and self.counter >= MAX_SAMPLES:
+        if model_type == 'animal' and (
+                self.counter >= MAX_SAMPLES or (
+                    self.counter > 0 and
+                    payload_bytes + size > self.max_payload_bytes)):
             self.create_submission()
 
-        logger.info("Appending %s %s to %s" % (
+        logger.debug("Appending %s %s to %s" % (
             model._meta.verbose_name,
             model,
             self.usi_submission))
 
-        # add object to submission data and updating counter
-        USISubmissionData.objects.create(
-            submission=self.usi_submission,
-            content_object=model)
+        # submission data will be written by write_data
+        self.batches[self.usi_submission.id].append(
+            USISubmissionData(
+                submission=self.usi_submission,
+                content_type_id=key[0],
+                object_id=key[1]))
 
         self.counter += 1
+        self.payload_bytes[self.usi_submission.id] += size
+
+    def write_data(self):
+        """Write all submission data and update submission counters"""
+
+        with transaction.atomic():
+            if self.reopened_ids:
+                logger.debug(
+                    "Reset status for submissions %s" % (self.reopened_ids))
+
+                USISubmission.objects.filter(
+                    id__in=self.reopened_ids).update(
+                        status=READY, updated_at=timezone.now())
+
+            for usi_submission_id, data in self.batches.items():
+                USISubmissionData.objects.bulk_create(data)
+
+                # Raise internal counter
+                USISubmission.objects.filter(id=usi_submission_id).update(
+                    samples_count=F('samples_count') + len(data),
+                    payload_bytes=F('payload_bytes') + self.payload_bytes[
+                        usi_submission_id])
 
-        # Raise internal counter
-        self.usi_submission.samples_count = F('samples_count') + 1
-        self.usi_submission.save()
+                logger.info("Appended %s objects to submission %s" % (
+                    len(data), usi_submission_id))
 
 
 class SplitSubmissionTask(SubmissionTaskMixin, NotifyAdminTaskMixin, BaseTask):
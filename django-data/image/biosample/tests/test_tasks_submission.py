@@ -6,22 +6,62 @@ Created on Wed Jul 17 10:51:40 2019
 @author: Paolo Cozzi <cozzi@ibba.cnr.it>
 """
 
+import time
+import threading
+
 from pyUSIrest.exceptions import USIConnectionError, TokenExpiredError
 
-from unittest.mock import patch, PropertyMock, Mock, call
+from unittest.mock import patch, PropertyMock, Mock, call, ANY
 
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
 from django.test import TestCase
 from django.core import mail
+from django.utils import timezone
 
 from common.constants import (
     READY, COMPLETED, ERROR, SUBMITTED, WAITING, STATUSES)
-from uid.models import Submission as UIDSubmission
+from uid.models import Animal, Sample, Submission as UIDSubmission
+from validation.models import ValidationResult
 
 from .common import TaskFailureMixin, RedisMixin, BaseMixin
 from ..models import Submission as USISubmission, SubmissionData
 from ..tasks.submission import (
-    SubmissionHelper, SplitSubmissionTask, SubmitTask, SubmissionError,
-    SubmissionCompleteTask)
+    SubmissionHelper, SplitSubmissionHelper, SplitSubmissionTask, SubmitTask,
+    SubmissionError, SubmissionCompleteTask, MAX_PAYLOAD_BYTES)
+
+
+# the url of a USI sample
+SAMPLE_HREF = (
+    "https://submission-test.ebi.ac.uk/api/samples/"
+    "c8c86558-8d3a-4ac5-8638-7aa354291d61")
+
+
+class StubUSISubmission():
+    """A USI submission which waits before creating samples, like a remote
+    server, and which could fail the first requests"""
+
+    def __init__(self, latency=0.05, errors=0):
+        self.latency = latency
+        self.errors = errors
+        self.calls = 0
+        self.created = []
+        self.session = Mock()
+        self.lock = threading.Lock()
+
+    def create_sample(self, data):
+        with self.lock:
+            self.calls += 1
+
+            if self.calls <= self.errors:
+                raise USIConnectionError("Problems with API endpoints")
+
+        time.sleep(self.latency)
+
+        with self.lock:
+            self.created.append(data)
+
+        return Mock(_links={'self': {'href': SAMPLE_HREF}})
 
 
 class SubmissionFeaturesMixin(BaseMixin):
@@ -131,6 +171,98 @@ class SplitSubmissionTaskTestCase(SplitSubmissionMixin, TestCase):
 
         self.assertEqual(names, reference)
 
+    # ovverride MAX_SAMPLES in order to split data
+    @patch('biosample.tasks.submission.MAX_SAMPLES', 2)
+    def test_split_submission_counts(self):
+        """Test samples counter after splitting submission data"""
+
+        self.my_task.run(submission_id=self.submission_id)
+
+        for usi_submission in USISubmission.objects.all():
+            self.assertEqual(
+                usi_submission.samples_count,
+                usi_submission.submission_data.count())
+
+    # split data relying on data size
+    @patch('biosample.tasks.submission.MAX_PAYLOAD_BYTES', 1)
+    def test_split_submission_payload(self):
+        """Test splitting submission data by size"""
+
+        res = self.my_task.run(submission_id=self.submission_id)
+        self.assertEqual(res, "success")
+
+        # an animal for each submission. Sample is with its animal
+        usi_submissions_qs = USISubmission.objects.order_by('id')
+        self.assertEqual(usi_submissions_qs.count(), 3)
+
+        self.assertEqual(
+            [usi_submission.samples_count for usi_submission in
+             usi_submissions_qs],
+            [1, 1, 2])
+
+        for usi_submission in usi_submissions_qs:
+            self.assertGreater(usi_submission.payload_bytes, 0)
+
+    def test_max_payload_bytes(self):
+        """Test submission size relying on previous submissions"""
+
+        helper = SplitSubmissionHelper(self.submission_obj)
+
+        # no previous submissions
+        self.assertEqual(helper.get_max_payload_bytes(), MAX_PAYLOAD_BYTES)
+
+        # 100 bytes/s for 300 s
+        USISubmission.objects.create(
+            uid_submission=self.submission_obj,
+            uploaded_bytes=1000,
+            upload_time=10)
+
+        with patch('biosample.tasks.submission.UPLOAD_TIME', 300):
+            self.assertEqual(helper.get_max_payload_bytes(), 30000)
+
+        # submissions of other teams are ignored
+        uid_submission = UIDSubmission.objects.get(pk=self.submission_id)
+        uid_submission.pk = None
+        uid_submission.owner = get_user_model().objects.create_user(
+            username="other", password="other")
+        uid_submission.save()
+
+        USISubmission.objects.create(
+            uid_submission=uid_submission,
+            uploaded_bytes=1,
+            upload_time=10)
+
+        with patch('biosample.tasks.submission.UPLOAD_TIME', 300):
+            self.assertEqual(helper.get_max_payload_bytes(), 30000)
+
+    def test_payload_sizes(self):
+        """Test reading data sizes tracked while validating data"""
+
+        helper = SplitSubmissionHelper(self.submission_obj)
+        helper.content_types = ContentType.objects.get_for_models(
+            Animal, Sample)
+
+        n_of_models = 0
+
+        for model_class, content_type in helper.content_types.items():
+            for model in model_class.objects.filter(
+                    submission=self.submission_obj, status=READY):
+                ValidationResult.objects.update_or_create(
+                    content_type=content_type,
+                    object_id=model.id,
+                    defaults={
+                        'submission': self.submission_obj,
+                        'payload_bytes': 100})
+                n_of_models += 1
+
+        # data are not serialized again
+        with patch('biosample.tasks.submission.get_payload_size') as my_size:
+            sizes = helper.get_payload_sizes()
+
+        self.assertFalse(my_size.called)
+        self.assertEqual(len(sizes), n_of_models)
+        self.assertEqual(set(sizes.values()), {100})
+
     # ovverride MAX_SAMPLES in order to split data
     @patch('biosample.tasks.submission.MAX_SAMPLES', 2)
     def test_split_submission_partial(self):
@@ -301,6 +433,21 @@ class SubmissionHelperTestCase(RedisMixin, SubmissionFeaturesMixin, TestCase):
         self.assertTrue(self.my_root.get_submission_by_name.called)
         self.assertTrue(self.my_submission.propertymock.called)
 
+    @patch.object(SubmissionHelper, "read_samples")
+    def test_recover_submission_checkpoint(self, my_helper):
+        """Testing submission recover with uploads tracked in submission
+        data"""
+
+        self.submission_helper.usi_submission_name = "test-submission"
+
+        self.usi_submission.submission_data.update(
+            uploaded_at=timezone.now(), usi_href=SAMPLE_HREF)
+
+        self.assertTrue(self.submission_helper.recover_submission())
+
+        # no need to read USI samples
+        self.assertFalse(my_helper.called)
+
     def test_recover_submission_error(self):
         """Testing submission recover for a closed submission"""
 
@@ -410,7 +557,8 @@ class SubmissionHelperTestCase(RedisMixin, SubmissionFeaturesMixin, TestCase):
         # creating mock samples
         my_samples = [
             Mock(**{'alias': 'IMAGEA000000001',
-                    'title': 'a 4-year old pig organic fed'}),
+                    'title': 'a 4-year old pig organic fed',
+                    '_links': {'self': {'href': SAMPLE_HREF}}}),
         ]
 
         # Ok but now get samples return an iterator object
@@ -452,13 +600,15 @@ class SubmissionHelperTestCase(RedisMixin, SubmissionFeaturesMixin, TestCase):
         # assert create sample in biosample called once
         my_create.assert_called_once()
 
+    # upload samples sequentially, in order to test calls order
+    @patch('biosample.tasks.submission.USI_WORKERS', 1)
     @patch.object(SubmissionHelper, "create_or_update_sample")
     def test_add_samples(self, my_create):
         """Test adding samples in correct order"""
 
         # getting submission data an mock called arguments
         data = list(self.usi_submission.submission_data.order_by('id'))
-        data = [call(el.content_object) for el in data]
+        data = [call(el.content_object, ANY) for el in data]
 
         # calling method
         self.submission_helper.add_samples()
@@ -467,6 +617,7 @@ class SubmissionHelperTestCase(RedisMixin, SubmissionFeaturesMixin, TestCase):
         self.assertEqual(my_create.call_count, 2)
         self.assertEqual(my_create.call_args_list, data)
 
+    @patch('biosample.tasks.submission.USI_WORKERS', 1)
     @patch.object(SubmissionHelper, "create_or_update_sample")
     def test_add_samples_order(self, my_create):
         """Test adding samples in different order"""
@@ -482,7 +633,7 @@ class SubmissionHelperTestCase(RedisMixin, SubmissionFeaturesMixin, TestCase):
 
         # getting submission data an mock called arguments
         data = list(self.usi_submission.submission_data.order_by('id'))
-        data = [call(el.content_object) for el in data]
+        data = [call(el.content_object, ANY) for el in data]
 
         # calling method
         self.submission_helper.add_samples()
@@ -491,6 +642,208 @@ class SubmissionHelperTestCase(RedisMixin, SubmissionFeaturesMixin, TestCase):
         self.assertEqual(my_create.call_count, 2)
         self.assertEqual(my_create.call_args_list, data)
 
+    def test_add_samples_status(self):
+        """Test statuses are written after adding samples"""
+
+        # get a biosample submission
+        self.submission_helper.usi_submission = self.my_submission
+        self.my_submission.create_sample.return_value._links = {
+            'self': {'href': SAMPLE_HREF}}
+
+        self.submission_helper.add_samples()
+
+        self.assertEqual(self.my_submission.create_sample.call_count, 2)
+
+        for submission_data in self.usi_submission.submission_data.all():
+            model = submission_data.content_object
+            self.assertEqual(model.status, SUBMITTED)
+            self.assertIsNotNone(model.last_submitted)
+
+            # uploads are tracked in submission data
+            self.assertEqual(submission_data.uploaded_at, model.last_submitted)
+            self.assertEqual(submission_data.usi_href, SAMPLE_HREF)
+
+        # upload time is tracked
+        self.usi_submission.refresh_from_db()
+        self.assertIsNotNone(self.usi_submission.upload_time)
+        self.assertGreater(self.usi_submission.uploaded_bytes, 0)
+
+    def test_add_samples_resume(self):
+        """Test adding samples already uploaded by a previous task"""
+
+        self.submission_helper.usi_submission = self.my_submission
+
+        self.usi_submission.submission_data.update(
+            uploaded_at=timezone.now(), usi_href=SAMPLE_HREF)
+
+        self.submission_helper.add_samples()
+
+        # no samples uploaded
+        self.assertFalse(self.my_submission.create_sample.called)
+
+        for submission_data in self.usi_submission.submission_data.all():
+            model = submission_data.content_object
+            self.assertEqual(model.status, SUBMITTED)
+            self.assertEqual(model.last_submitted, submission_data.uploaded_at)
+
+    @patch('pyUSIrest.usi.Sample.read_url')
+    def test_add_samples_resume_changed(self, my_read):
+        """Test patching samples changed after a previous task"""
+
+        self.submission_helper.usi_submission = self.my_submission
+        my_read.return_value._links = {'self': {'href': SAMPLE_HREF}}
+
+        self.usi_submission.submission_data.update(
+            uploaded_at=timezone.now(), usi_href=SAMPLE_HREF)
+
+        # change the first object after upload
+        submission_data = self.usi_submission.submission_data.order_by(
+            'id').first()
+        model = submission_data.content_object
+        model.last_changed = timezone.now()
+        model.save()
+
+        self.submission_helper.add_samples()
+
+        # changed sample is patched
+        self.assertFalse(self.my_submission.create_sample.called)
+        my_read.assert_called_once_with(
+            self.submission_helper.auth, SAMPLE_HREF)
+        self.assertTrue(my_read.return_value.patch.called)
+
+        model.refresh_from_db()
+        self.assertEqual(model.status, SUBMITTED)
+
+    @patch('biosample.tasks.submission.USI_WORKERS', 1)
+    def test_add_samples_interrupted(self):
+        """Test resuming a batch interrupted while uploading samples"""
+
+        self.submission_helper.usi_submission = self.my_submission
+
+        # the first sample is uploaded, then the task is killed: statuses
+        # are not written
+        self.my_submission.create_sample.side_effect = [
+            Mock(_links={'self': {'href': SAMPLE_HREF}}),
+            SystemExit("killed")]
+
+        with patch.object(SubmissionHelper, "mark_uploaded"):
+            self.assertRaises(SystemExit, self.submission_helper.add_samples)
+
+        first, second = self.usi_submission.submission_data.order_by('id')
+
+        # the first upload is tracked anyway
+        self.assertIsNotNone(first.uploaded_at)
+        self.assertEqual(first.usi_href, SAMPLE_HREF)
+        self.assertEqual(first.content_object.status, READY)
+        self.assertIsNone(second.uploaded_at)
+
+        # a new task upload only the second sample
+        self.my_submission.create_sample.reset_mock()
+        self.my_submission.create_sample.side_effect = None
+        self.my_submission.create_sample.return_value = Mock(
+            _links={'self': {'href': SAMPLE_HREF}})
+
+        submission_helper = SubmissionHelper(self.usi_submission_id)
+        submission_helper.usi_submission = self.my_submission
+        submission_helper.add_samples()
+
+        self.my_submission.create_sample.assert_called_once()
+
+        for submission_data in self.usi_submission.submission_data.all():
+            self.assertEqual(submission_data.content_object.status, SUBMITTED)
+
+    def upload_samples(self, n_of_samples=8):
+        """Upload mock samples to a stub USI submission. Return uploaded
+        models and elapsed time"""
+
+        self.submission_helper.usi_submission = StubUSISubmission()
+
+        items = [
+            (Mock(biosample_alias="IMAGEA%09d" % (i)),
+             {'sampleRelationships': []})
+            for i in range(n_of_samples)]
+
+        uploaded = []
+
+        start = time.perf_counter()
+        self.submission_helper.upload_samples(items, uploaded)
+        elapsed = time.perf_counter() - start
+
+        return uploaded, elapsed
+
+    def test_upload_samples_concurrent(self):
+        """Test uploading samples concurrently"""
+
+        with patch('biosample.tasks.submission.USI_WORKERS', 1):
+            uploaded, sequential = self.upload_samples()
+
+        self.assertEqual(len(uploaded), 8)
+
+        with patch('biosample.tasks.submission.USI_WORKERS', 4):
+            uploaded, concurrent = self.upload_samples()
+
+        self.assertEqual(len(uploaded), 8)
+
+        # requests wait for the same time
+        self.assertLess(concurrent, sequential / 2)
+
+    def test_upload_samples_parents(self):
+        """Test parents are uploaded before children"""
+
+        usi_submission = StubUSISubmission()
+        self.submission_helper.usi_submission = usi_submission
+
+        parent = Mock(biosample_alias="IMAGEA000000001")
+        child = Mock(biosample_alias="IMAGEA000000002")
+
+        items = [
+            (parent, {'sampleRelationships': []}),
+            (child, {'sampleRelationships': [{
+                'alias': "IMAGEA000000001",
+                'relationshipNature': "child of"}]})]
+
+        uploaded = []
+        self.submission_helper.upload_samples(items, uploaded)
+
+        self.assertEqual(uploaded, [parent, child])
+        self.assertEqual(
+            usi_submission.created,
+            [item[1] for item in items])
+
+    @patch('biosample.tasks.submission.USI_BACKOFF', 0)
+    def test_upload_samples_retry(self):
+        """Test uploading samples after USI connection errors"""
+
+        usi_submission = StubUSISubmission(errors=1)
+        self.submission_helper.usi_submission = usi_submission
+
+        model = Mock(biosample_alias="IMAGEA000000001")
+        uploaded = []
+
+        self.submission_helper.upload_samples(
+            [(model, {'sampleRelationships': []})], uploaded)
+
+        self.assertEqual(uploaded, [model])
+        self.assertEqual(usi_submission.calls, 2)
+        self.assertEqual(model.status, SUBMITTED)
+
+    @patch('biosample.tasks.submission.USI_BACKOFF', 0)
+    def test_upload_samples_issues(self):
+        """Test uploading samples with persistent USI errors"""
+
+        self.submission_helper.usi_submission = StubUSISubmission(errors=10)
+
+        uploaded = []
+
+        self.assertRaises(
+            USIConnectionError,
+            self.submission_helper.upload_samples,
+            [(Mock(biosample_alias="IMAGEA000000001"),
+              {'sampleRelationships': []})],
+            uploaded)
+
+        self.assertEqual(uploaded, [])
+
     def test_mark_submission(self):
         """test adding status message to submission"""
 
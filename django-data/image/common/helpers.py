@@ -9,6 +9,7 @@ Created on Wed Mar 27 12:50:16 2019
 import re
 import logging
 import datetime
+import itertools
 import websockets
 import time
 import json
@@ -159,6 +160,37 @@ def format_attribute(value, terms=None, library_uri=OBO_URL, units=None):
     return [result]
 
 
+def chunks(iterable, size):
+    """Split an iterable in lists of at most ``size`` elements. Items are
+    read lazily, so this could be used with queryset iterators or file
+    handles without loading all data in memory
+
+    Args:
+        iterable (iterable): the items to split
+        size (int): the maximum length of each chunk
+
+    Yields:
+        list: a list of items
+    """
+
+    iterator = iter(iterable)
+
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+
+        if not chunk:
+            return
+
+        yield chunk
+
+
+def get_payload_size(data):
+    """Estimate the size (in bytes) of a to_biosample() dictionary sent
+    to USI"""
+
+    return len(json.dumps(data, default=str))
+
+
 def get_admin_emails():
     """Return admin email from image.settings"""
 
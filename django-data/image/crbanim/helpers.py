@@ -10,16 +10,19 @@ import io
 import csv
 import urllib
 import logging
+import itertools
 import pycountry
 
 from collections import defaultdict, namedtuple
 
+from django.db import transaction
 from django.utils.dateparse import parse_date
 
 from common.constants import LOADED, ERROR, MISSING, SAMPLE_STORAGE
-from common.helpers import image_timedelta
+from common.helpers import chunks, image_timedelta
 from uid.helpers import (
-    FileDataSourceMixin, get_or_create_obj, update_or_create_obj)
+    FileDataSourceMixin, get_or_create_obj, get_lookup_key,
+    bulk_get_or_create_objs, bulk_update_or_create_objs)
 from uid.models import (
     DictSpecie, DictSex, DictCountry, DictBreed, Animal, Sample,
     DictUberon, Publication)
@@ -30,6 +33,9 @@ from validation.models import ValidationSummary
 # Get an instance of a logger
 logger = logging.getLogger(__name__)
 
+# the number of records processed in a single transaction
+BATCH_SIZE = 1000
+
 
 # A class to deal with cryoweb import errors
 class CRBAnimImportError(Exception):
@@ -56,12 +62,17 @@ class CRBAnimReader(FileDataSourceMixin):
         ]
 
     def __init__(self):
-        self.data = None
         self.header = None
         self.dialect = None
         self.items = None
         self.filename = None
 
+        # a namedtuple class used to model each record
+        self.Data = None
+
+        # the index of sex column (need to be fixed while reading)
+        self.sex_idx = None
+
     @classmethod
     def get_dialect(cls, chunk):
         """Determine dialect of a CSV from a chunk"""
@@ -98,12 +109,13 @@ class CRBAnimReader(FileDataSourceMixin):
             return False, not_found
 
     def read_file(self, filename):
-        """Read crb anim files and set tit to class attribute"""
+        """Read crb anim file header and evaluate column data. Records
+        are not stored in memory: they will be read again from file
+        when iterating over :py:attr:`data`"""
 
         with open(filename, newline='') as handle:
             # initialize data
             self.filename = filename
-            self.data = []
 
             # get dialect
             chunk = handle.read(2048)
@@ -112,58 +124,77 @@ class CRBAnimReader(FileDataSourceMixin):
             # restart filename from the beginning
             handle.seek(0)
 
-            # read csv file
+            # read csv header
             reader = csv.reader(handle, self.dialect)
             self.header = next(reader)
 
-            # find sex index column
-            sex_idx = self.header.index('sex')
+        # find sex index column
+        self.sex_idx = self.header.index('sex')
+
+        # create a namedtuple object
+        self.Data = namedtuple("Data", self.header)
 
-            # create a namedtuple object
-            Data = namedtuple("Data", self.header)
+        self.items = self.eval_columns()
 
-            # add records to data
-            for record in reader:
-                # replace all "\\N" occurences in a list
-                record = [None if col in ["\\N", ""]
-                          else col for col in record]
+    def process_line(self, line):
+        """Convert a CSV line into a Data record"""
 
-                # 'unknown' sex should be replaced with 'record of unknown sex'
-                if record[sex_idx].lower() == 'unknown':
-                    logger.debug(
-                        "Changing '%s' with '%s'" % (
-                            record[sex_idx], 'record of unknown sex'))
-                    record[sex_idx] = 'record of unknown sex'
+        # replace all "\\N" occurences in a list
+        record = [None if col in ["\\N", ""] else col for col in line]
 
-                record = Data._make(record)
-                self.data.append(record)
+        # 'unknown' sex should be replaced with 'record of unknown sex'
+        if record[self.sex_idx].lower() == 'unknown':
+            logger.debug(
+                "Changing '%s' with '%s'" % (
+                    record[self.sex_idx], 'record of unknown sex'))
+            record[self.sex_idx] = 'record of unknown sex'
 
-        self.items = self.eval_columns()
+        return self.Data._make(record)
+
+    def get_records(self):
+        """Iterate over file records lazily. File is opened (and read)
+        each time this method is called"""
+
+        with open(self.filename, newline='') as handle:
+            reader = csv.reader(handle, self.dialect)
+
+            # skip header
+            next(reader)
+
+            for line in reader:
+                yield self.process_line(line)
+
+    @property
+    def data(self):
+        """A new iterator over file records"""
+
+        return self.get_records()
 
     def eval_columns(self):
-        """define a set from column data"""
+        """define a set from column data in a single pass"""
 
-        # target_columns = ['sex', 'species_latin_name', 'breed_name']
-        target_columns = self.header
+        # one set for each column, in the same order of header
+        columns = [set() for column in self.header]
 
-        items = defaultdict(list)
+        for record in self.data:
+            for idx, value in enumerate(record):
+                columns[idx].add(value)
 
-        for line in self.data:
-            for column in target_columns:
-                idx = self.header.index(column)
-                items[column].append(line[idx])
+        # now get a dictionary of sets
+        items = defaultdict(set)
 
-        # now get a set of object
-        for column in target_columns:
-            items[column] = set(items[column])
+        for column, values in zip(self.header, columns):
+            items[column] = values
 
         return items
 
     def print_line(self, num):
         """print a record with its column names"""
 
+        record = next(itertools.islice(self.data, num, None))
+
         for i, column in enumerate(self.header):
-            logger.debug("%s: %s" % (column, self.data[num][i]))
+            logger.debug("%s: %s" % (column, record[i]))
 
     def filter_by_column_values(self, column, values, ignorecase=False):
         if ignorecase is True:
@@ -227,79 +258,129 @@ class CRBAnimReader(FileDataSourceMixin):
         return self.check_items(item_set, DictCountry, column)
 
 
-def fill_uid_breed(record, language):
-    """Fill DictBreed from a crbanim record"""
+class TermResolver():
+    """Resolve and cache dictionary terms (species, countries, sexes)
+    which are shared among CRBAnim records"""
 
-    # get a DictSpecie object. Species are in latin names, but I can
-    # find also a common name in translation tables
-    specie = DictSpecie.get_specie_check_synonyms(
-            species_label=record.species_latin_name,
-            language=language)
+    def __init__(self, language):
+        self.language = language
+
+        # DictSpecie objects by CRBAnim species label
+        self.species = {}
+
+        # DictCountry objects by alpha_2 code
+        self.countries = {}
+
+        # DictSex objects by lowercase label
+        self.sexes = {
+            sex.label.lower(): sex for sex in DictSex.objects.all()}
+
+    def get_specie(self, species_label):
+        # get a DictSpecie object. Species are in latin names, but I can
+        # find also a common name in translation tables
+        if species_label not in self.species:
+            self.species[species_label] = (
+                DictSpecie.get_specie_check_synonyms(
+                    species_label=species_label,
+                    language=self.language))
+
+        return self.species[species_label]
+
+    def get_country(self, country_of_origin):
+        # get country for breeds. Ideally will be the same of submission,
+        # however, it could be possible to store data from other contries
+        if country_of_origin not in self.countries:
+            # get country name using pycountries
+            country_name = pycountry.countries.get(
+                alpha_2=country_of_origin).name
+
+            self.countries[country_of_origin] = DictCountry.objects.get(
+                label=country_name)
+
+        return self.countries[country_of_origin]
+
+    def get_sex(self, label):
+        try:
+            return self.sexes[label.lower()]
+
+        except KeyError:
+            raise DictSex.DoesNotExist(
+                "DictSex matching query does not exist: %s" % (label))
+
+
+def get_breed_lookup(record, resolver):
+    """Return a DictBreed lookup from a crbanim record"""
+
+    return {
+        'supplied_breed': record.breed_name,
+        'specie': resolver.get_specie(record.species_latin_name),
+        'country': resolver.get_country(record.country_of_origin),
+    }
 
-    # get country name using pycountries
-    country_name = pycountry.countries.get(
-        alpha_2=record.country_of_origin).name
 
-    # get country for breeds. Ideally will be the same of submission,
-    # however, it could be possible to store data from other contries
-    country = DictCountry.objects.get(label=country_name)
+def fill_uid_breeds(records, resolver):
+    """Fill DictBreed from a list of crbanim records. Return a dictionary
+    of DictBreed objects (see :py:func:`uid.helpers.get_lookup_key`)"""
 
-    breed = get_or_create_obj(
-        DictBreed,
-        supplied_breed=record.breed_name,
-        specie=specie,
-        country=country)
+    lookups = [get_breed_lookup(record, resolver) for record in records]
 
-    # return a DictBreed object
-    return breed
+    return bulk_get_or_create_objs(DictBreed, lookups)
 
 
-def fill_uid_animal(record, breed, submission, animals):
-    """Helper function to fill animal data in UID animal table"""
+def fill_uid_animals(records, breeds, submission, animals, resolver):
+    """Helper function to fill animal data in UID animal table from a list
+    of crbanim records. Animals are tracked in ``animals`` dictionary"""
 
     # HINT: does CRBAnim models mother and father?
 
-    # check if such animal is already beed updated
-    if record.animal_ID in animals:
-        logger.debug(
-            "Ignoring %s: already created or updated" % (record.animal_ID))
+    # the animal records to create or update
+    animal_records = []
 
-        # return an animal object
-        animal = animals[record.animal_ID]
+    # I could have the same animal again and again: I will change
+    # animal once
+    seen = set()
 
-    else:
-        # determine sex. Check for values
-        sex = DictSex.objects.get(label__iexact=record.sex)
+    for record in records:
+        # check if such animal is already beed updated
+        if record.animal_ID in animals or record.animal_ID in seen:
+            logger.debug(
+                "Ignoring %s: already created or updated" % (
+                    record.animal_ID))
+            continue
+
+        breed = breeds[get_lookup_key(get_breed_lookup(record, resolver))]
 
         # there's no birth_location for animal in CRBAnim
         accuracy = MISSING
 
+        lookup = {
+            'name': record.animal_ID,
+            'breed': breed,
+            'owner': submission.owner,
+        }
+
         # create a new object. Using defaults to avoid collisions when
         # updating data
         # HINT: CRBanim has less attribute than cryoweb
         defaults = {
             # HINT: is a duplication of name. Can this be non-mandatory?
             'alternative_id': record.animal_ID,
-            'sex': sex,
+            'sex': resolver.get_sex(record.sex),
             'birth_date': record.animal_birth_date,
             'birth_location_accuracy': accuracy,
         }
 
-        # I could have the same animal again and again. by tracking it in a
-        # dictionary, I will change animal once
-        animal = update_or_create_obj(
-            Animal,
-            name=record.animal_ID,
-            breed=breed,
-            owner=submission.owner,
-            submission=submission,
-            defaults=defaults)
+        animal_records.append((lookup, defaults))
+        seen.add(record.animal_ID)
+
+    instances = bulk_update_or_create_objs(
+        Animal, animal_records, submission)
 
-        # track this animal in dictionary
-        animals[record.animal_ID] = animal
+    # track animals in dictionary: I need them to relate samples
+    for lookup, defaults in animal_records:
+        animals[lookup['name']] = instances[get_lookup_key(lookup)]
 
-    # I need to track animal to relate the sample
-    return animal
+    return animals
 
 
 def find_storage_type(record):
@@ -331,8 +412,8 @@ def sanitize_url(url):
     return urllib.parse.quote(url, ':/#?=')
 
 
-def fill_uid_sample(record, animal, submission):
-    """Helper function to fill animal data in UID sample table"""
+def get_organism_part_label(record):
+    """Determine the organism part label of a crbanim record"""
 
     # name and animal name come from parameters
     organism_part_label = None
@@ -346,72 +427,100 @@ def fill_uid_sample(record, animal, submission):
     else:
         organism_part_label = sample_type_name
 
-    # get a organism part. Organism parts need to be in lowercases
-    organism_part = get_or_create_obj(
+    return organism_part_label
+
+
+def fill_uid_samples(records, animals, submission):
+    """Helper function to fill sample data in UID sample table from a list
+    of crbanim records"""
+
+    # get organism parts. Organism parts need to be in lowercases
+    organism_parts = bulk_get_or_create_objs(
         DictUberon,
-        label=organism_part_label
-    )
-
-    # calculate animal age at collection
-    animal_birth_date = parse_date(record.animal_birth_date)
-    sampling_date = parse_date(record.sampling_date)
-    animal_age_at_collection, time_units = image_timedelta(
-        sampling_date, animal_birth_date)
-
-    # get a publication (if present)
-    publication = None
-
-    if record.sample_bibliographic_references:
-        publication = get_or_create_obj(
-            Publication,
-            doi=record.sample_bibliographic_references)
-
-    # create a new object. Using defaults to avoid collisions when
-    # updating data
-    defaults = {
-        # HINT: is a duplication of name. Can this be non-mandatory?
-        'alternative_id': record.sample_identifier,
-        'collection_date': record.sampling_date,
-        'protocol': record.sampling_protocol_url,
-        'organism_part': organism_part,
-        # 'description': v_vessel.comment,
-        'storage': find_storage_type(record),
-        'availability': sanitize_url(record.sample_availability),
-        'animal_age_at_collection': animal_age_at_collection,
-        'animal_age_at_collection_units': time_units,
-        'publication': publication,
-    }
+        [{'label': get_organism_part_label(record)} for record in records])
+
+    # get publications (if present)
+    publications = bulk_get_or_create_objs(
+        Publication,
+        [{'doi': record.sample_bibliographic_references}
+         for record in records if record.sample_bibliographic_references])
+
+    sample_records = []
 
-    sample = update_or_create_obj(
-        Sample,
-        name=record.sample_identifier,
-        animal=animal,
-        owner=submission.owner,
-        submission=submission,
-        defaults=defaults)
+    for record in records:
+        organism_part = organism_parts[
+            (get_organism_part_label(record),)]
 
-    return sample
+        # calculate animal age at collection
+        animal_birth_date = parse_date(record.animal_birth_date)
+        sampling_date = parse_date(record.sampling_date)
+        animal_age_at_collection, time_units = image_timedelta(
+            sampling_date, animal_birth_date)
 
+        # get a publication (if present)
+        publication = None
+
+        if record.sample_bibliographic_references:
+            publication = publications[
+                (record.sample_bibliographic_references,)]
+
+        lookup = {
+            'name': record.sample_identifier,
+            'animal': animals[record.animal_ID],
+            'owner': submission.owner,
+        }
+
+        # create a new object. Using defaults to avoid collisions when
+        # updating data
+        defaults = {
+            # HINT: is a duplication of name. Can this be non-mandatory?
+            'alternative_id': record.sample_identifier,
+            'collection_date': record.sampling_date,
+            'protocol': record.sampling_protocol_url,
+            'organism_part': organism_part,
+            # 'description': v_vessel.comment,
+            'storage': find_storage_type(record),
+            'availability': sanitize_url(record.sample_availability),
+            'animal_age_at_collection': animal_age_at_collection,
+            'animal_age_at_collection_units': time_units,
+            'publication': publication,
+        }
+
+        sample_records.append((lookup, defaults))
+
+    return bulk_update_or_create_objs(Sample, sample_records, submission)
+
+
+def process_records(records, submission, animals, resolver):
+    """Process a chunk of crbanim records in a single transaction"""
 
-def process_record(record, submission, animals, language):
     # Peter mail 26/02/19 18:30: I agree that it sounds like we will
     # need to create sameAs BioSamples for the IMAGE project, and it makes
     # sense that the inject tool is able to do this.  It may be that we
     # tackle these cases after getting the main part of the inject tool
     # functioning and hold or ignore these existing BioSamples for now.
     # HINT: record with a biosample id should be ignored, for the moment
-    if record.EBI_Biosample_identifier is not None:
-        logger.warning("Ignoring %s: already in biosample!" % str(record))
+    selected = []
+
+    for record in records:
+        if record.EBI_Biosample_identifier is not None:
+            logger.warning("Ignoring %s: already in biosample!" % str(record))
+            continue
+
+        selected.append(record)
+
+    if not selected:
         return
 
-    # filling breeds
-    breed = fill_uid_breed(record, language)
+    with transaction.atomic():
+        # filling breeds
+        breeds = fill_uid_breeds(selected, resolver)
 
-    # fill animal
-    animal = fill_uid_animal(record, breed, submission, animals)
+        # fill animals
+        fill_uid_animals(selected, breeds, submission, animals, resolver)
 
-    # fill sample
-    fill_uid_sample(record, animal, submission)
+        # fill samples
+        fill_uid_samples(selected, animals, submission)
 
 
 def check_UID(submission, reader):
@@ -443,7 +552,7 @@ def check_UID(submission, reader):
             "check for '%s' in your dataset" % (not_found))
 
 
-def upload_crbanim(submission):
+def upload_crbanim(submission, batch_size=BATCH_SIZE):
     # debug
     logger.info("Importing from CRB-Anim file")
 
@@ -463,11 +572,15 @@ def upload_crbanim(submission):
         # HINT: no traslations implemented, at the moment
         language = submission.gene_bank_country.label
 
+        # resolve dictionary terms once
+        resolver = TermResolver(language)
+
         # a dictionary in which store animal data
         animals = {}
 
-        for record in reader.data:
-            process_record(record, submission, animals, language)
+        # records are read lazily from file and processed in chunks
+        for records in chunks(reader.data, batch_size):
+            process_records(records, submission, animals, resolver)
 
         # after processing records, initilize validationsummary objects
         # create a validation summary object and set all_count
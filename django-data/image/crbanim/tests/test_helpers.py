@@ -7,6 +7,7 @@ Created on Fri Feb 22 15:49:18 2019
 """
 
 import os
+import types
 import logging
 
 from unittest.mock import patch
@@ -15,6 +16,7 @@ from collections import namedtuple
 from django.test import TestCase
 
 from common.tests import WebSocketMixin
+from uid.helpers import get_lookup_key
 from uid.models import (
     DictSex, DictBreed, Animal,
     Sample, DictUberon, DictCountry, Submission)
@@ -22,8 +24,9 @@ from uid.tests.mixins import (
     DataSourceMixinTestCase, FileReaderMixinTestCase)
 
 from ..helpers import (
-    logger, CRBAnimReader, upload_crbanim, fill_uid_breed,
-    fill_uid_animal, fill_uid_sample, find_storage_type, sanitize_url)
+    logger, CRBAnimReader, upload_crbanim, TermResolver, fill_uid_breeds,
+    fill_uid_animals, fill_uid_samples, get_breed_lookup, find_storage_type,
+    sanitize_url)
 from .common import BaseTestCase
 
 
@@ -119,6 +122,28 @@ class CRBAnimReaderTestCase(
 
         self.assertEqual(reference, self.reader.header)
 
+    def test_data_is_lazy(self):
+        """Records are read from file each time data is accessed"""
+
+        self.assertIsInstance(self.reader.data, types.GeneratorType)
+
+        # I can iterate over data more than once
+        self.assertEqual(len(list(self.reader.data)), 3)
+        self.assertEqual(len(list(self.reader.data)), 3)
+
+    def test_eval_columns(self):
+        """Test distinct values for each column"""
+
+        self.assertEqual(
+            self.reader.items['sex'],
+            set(['Female', 'Male', 'record of unknown sex']))
+        self.assertEqual(
+            self.reader.items['animal_ID'],
+            set(['ANIMAL:::1', 'ANIMAL:::2']))
+        self.assertEqual(
+            self.reader.items['EBI_Biosample_identifier'],
+            set([None, 'FAKEA359353362']))
+
     def test_debug_row(self):
         """Assert a function is callable"""
 
@@ -220,24 +245,32 @@ class ProcessRecordTestCase(DataSourceMixinTestCase, BaseTestCase, TestCase):
         # set a country
         self.country = DictCountry.objects.get(label="United Kingdom")
 
-        # fill object to test inserts. Fill breed
-        self.breed = fill_uid_breed(self.record, self.country)
+        # resolve terms using country language
+        self.resolver = TermResolver(self.country.label)
+
+        # fill object to test inserts. Fill breeds
+        breeds = fill_uid_breeds(self.data, self.resolver)
+        self.breed = breeds[
+            get_lookup_key(get_breed_lookup(self.record, self.resolver))]
 
         # filling animal and samples
-        self.animal = fill_uid_animal(
-            self.record,
-            self.breed,
+        self.animals = fill_uid_animals(
+            self.data,
+            breeds,
             self.submission,
-            {})
+            {},
+            self.resolver)
+        self.animal = self.animals[self.record.animal_ID]
 
         # testing samples
-        self.sample = fill_uid_sample(
-            self.record,
-            self.animal,
+        self.samples = fill_uid_samples(
+            self.data,
+            self.animals,
             self.submission)
+        self.sample = Sample.objects.get(name=self.record.sample_identifier)
 
     def test_fill_uid_breed(self):
-        """testing fill_uid_breed"""
+        """testing fill_uid_breeds"""
 
         # testing output
         self.assertIsInstance(self.breed, DictBreed)
@@ -257,9 +290,14 @@ class ProcessRecordTestCase(DataSourceMixinTestCase, BaseTestCase, TestCase):
         sex = DictSex.objects.get(label__iexact=self.record.sex)
         self.assertEqual(self.animal.sex, sex)
 
+        # the same animal is created once, even in different records
+        self.assertEqual(len(self.animals), 1)
+        self.assertEqual(Animal.objects.count(), 1)
+
     def test_fill_uid_samples(self):
         # testing sample
         self.assertIsInstance(self.sample, Sample)
+        self.assertEqual(len(self.samples), 2)
 
         # testing sample attributes
         organism_part = DictUberon.objects.get(
@@ -272,28 +310,19 @@ class ProcessRecordTestCase(DataSourceMixinTestCase, BaseTestCase, TestCase):
 
         # get a new record
         record = self.data[1]
-
-        # fill breeds
-        breed = fill_uid_breed(record, self.country)
-
-        # filling animal and samples
-        animal = fill_uid_animal(
-            record,
-            breed,
-            self.submission,
-            {})
-
-        # testing samples
-        sample = fill_uid_sample(
-            record,
-            animal,
-            self.submission)
+        sample = Sample.objects.get(name=record.sample_identifier)
 
         # testing sample attributes
         organism_part = DictUberon.objects.get(
             label__iexact="uterus")
         self.assertEqual(sample.organism_part, organism_part)
 
+    def test_unknown_sex(self):
+        """An unknown sex term raises DoesNotExist"""
+
+        self.assertRaises(
+            DictSex.DoesNotExist, self.resolver.get_sex, "meow")
+
     def test_find_storage_type(self):
         """Asserting storage type conversion"""
 
@@ -351,6 +380,13 @@ class UploadCRBAnimTestCase(CRBAnimMixin, BaseTestCase, TestCase):
         self.check_errors(my_check, message, notification_message)
 
 
+class BatchUploadCRBAnimTestCase(CRBAnimMixin, BaseTestCase, TestCase):
+    """Upload crbanim data processing one record at a time"""
+
+    upload_method = staticmethod(
+        lambda submission: upload_crbanim(submission, batch_size=1))
+
+
 class ReloadCRBAnimTestCase(CRBAnimMixin, BaseTestCase, TestCase):
 
     """Simulate a crbanim reload case. Load data as in
@@ -10,30 +10,45 @@ Created on Mon May 14 10:28:39 2018
 
 import logging
 import os
-import shlex
-import subprocess
+import re
 
+import psycopg2
 from decouple import AutoConfig
+from psycopg2.extras import execute_values
 
 from django.conf import settings
+from django.db import connections
 
 from common.constants import LOADED, ERROR, MISSING, UNKNOWN
-from common.helpers import image_timedelta
-from uid.helpers import get_or_create_obj, update_or_create_obj
+from common.helpers import chunks, image_timedelta
+from uid.helpers import (
+    get_or_create_obj, get_lookup_key, bulk_update_or_create_objs)
 from uid.models import (
     Animal, DictBreed, DictCountry, DictSex, DictSpecie, Sample,
     Submission, DictUberon)
 from language.helpers import check_species_synonyms
+from language.models import SpecieSynonym
 from submissions.helpers import send_message
 from validation.helpers import construct_validation_message
 from validation.models import ValidationSummary
 
 from .models import db_has_data as cryoweb_has_data
-from .models import VAnimal, VBreedsSpecies, VVessels
+from .models import (
+    VAnimal, VBreedsSpecies, VProtocols, VVessels, TEMPLATE_SCHEMA,
+    INSERT_ONLY_USER, get_search_path)
 
 # Get an instance of a logger
 logger = logging.getLogger(__name__)
 
+# the number of cryoweb records read and written into UID with bulk queries
+BATCH_SIZE = 1000
+
+# the buffer size used to read dump files and to execute statements
+BUFFER_SIZE = 1024 * 1024
+
+# report cryoweb dump loading every PROGRESS_STEP bytes
+PROGRESS_STEP = 50 * 1024 * 1024
+
 
 # --- check functions
 
@@ -115,11 +130,280 @@ class CryoWebImportError(Exception):
 
 
 # --- Upload data into cryoweb database
+
+
+class CopyDataReader():
+    """A file-like object which reads the data of a ``COPY ... FROM stdin``
+    block from a :py:class:`CryowebDumpLoader`, until the end-of-data marker.
+    This is the file object required by ``cursor.copy_expert``
+
+    Args:
+        loader (CryowebDumpLoader): the dump loader instance
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.done = False
+
+    def readline(self, size=-1):
+        """Read a data line. Returns an empty string at the end of block"""
+
+        if self.done:
+            return ""
+
+        line = self.loader.readline()
+
+        if line == "":
+            raise CryoWebImportError("Unterminated COPY block in dump file")
+
+        if line.rstrip("\r\n") == "\\.":
+            self.done = True
+            return ""
+
+        self.loader.rows += 1
+
+        return line
+
+    def read(self, size=-1):
+        """Read data lines up to ``size`` characters (or all the block)"""
+
+        lines, length = [], 0
+
+        while size < 0 or length < size:
+            line = self.readline()
+
+            if line == "":
+                break
+
+            lines.append(line)
+            length += len(line)
+
+        return "".join(lines)
+
+
+class CryowebDumpLoader():
+    """Load a *data-only* cryoweb dump into the cryoweb database through
+    a psycopg2 connection. The dump file is read line by line with a fixed
+    size buffer: SQL statements are sent to the database in batches, while
+    ``COPY`` blocks are streamed with ``copy_expert``. The amount of bytes
+    read and rows loaded is written in the submission message and sent
+    through websocket while loading::
+
+        loader = CryowebDumpLoader(submission)
+        loader.load()
+
+    Args:
+        submission (uid.models.Submission): the submission object
+        buffer_size (int): the size of read buffer and of statement batches
+        progress_step (int): report progress every ``progress_step`` bytes
+    """
+
+    # to detect the start of a COPY block
+    copy_pattern = re.compile(r"^COPY .* FROM stdin;\s*$")
+
+    # statements which set search path are ignored: data are loaded using
+    # the cryoweb search path (see cryoweb.models.staging_schema)
+    search_path_pattern = re.compile(
+        r"^(SET search_path|SELECT pg_catalog.set_config\('search_path')")
+
+    # pg_dump could qualify tables and sequences with the template schema
+    qualified_pattern = re.compile(
+        r"^(INSERT INTO |COPY |SELECT pg_catalog.setval\(')%s\." % (
+            TEMPLATE_SCHEMA))
+
+    def __init__(
+            self, submission, buffer_size=BUFFER_SIZE,
+            progress_step=PROGRESS_STEP):
+
+        self.submission = submission
+        self.buffer_size = buffer_size
+        self.progress_step = progress_step
+
+        # this is the full path in docker container
+        self.fullpath = submission.get_uploaded_file_path()
+        self.total_bytes = os.path.getsize(self.fullpath)
+
+        # track loading
+        self.bytes_read = 0
+        self.rows = 0
+        self.last_report = 0
+
+        # the file handle
+        self.handle = None
+
+        # statements to be executed
+        self.pending = []
+        self.pending_size = 0
+
+    def get_connection(self):
+        """Return a psycopg2 connection to the cryoweb database with the
+        insert only user"""
+
+        # define a decouple config object
+        config_dir = os.path.join(settings.BASE_DIR, 'image')
+        config = AutoConfig(search_path=config_dir)
+
+        database = settings.DATABASES['cryoweb']
+
+        connection = psycopg2.connect(
+            dbname=database['NAME'],
+            user=INSERT_ONLY_USER,
+            password=config('CRYOWEB_INSERT_ONLY_PW'),
+            host=database['HOST'],
+            port=database['PORT'],
+            options="-c search_path={0}".format(
+                get_search_path().replace(" ", "")))
+
+        return connection
+
+    def readline(self):
+        """Read a line from dump file and track bytes read"""
+
+        line = self.handle.readline()
+        self.bytes_read += len(line)
+
+        if self.bytes_read - self.last_report >= self.progress_step:
+            self.report_progress()
+
+        return line.decode('utf8')
+
+    def get_progress_message(self):
+        """Return a message with bytes read and rows loaded"""
+
+        percent = 100
+        if self.total_bytes > 0:
+            percent = int(self.bytes_read / self.total_bytes * 100)
+
+        return (
+            "Loading CryoWeb dump: {bytes_read} of {total_bytes} bytes read "
+            "({percent}%), {rows} rows loaded".format(
+                bytes_read=self.bytes_read,
+                total_bytes=self.total_bytes,
+                percent=percent,
+                rows=self.rows))
+
+    def report_progress(self):
+        """Update submission message and send it through websocket"""
+
+        self.last_report = self.bytes_read
+
+        message = self.get_progress_message()
+        logger.info(message)
+
+        self.submission.message = message
+        self.submission.save(update_fields=['message', 'updated_at'])
+
+        # send async message
+        send_message(self.submission)
+
+    def fix_statement(self, statement):
+        """Remove template schema from statement, or return None if
+        statement need to be ignored"""
+
+        if self.search_path_pattern.match(statement):
+            logger.debug("Ignoring: %s" % statement.strip())
+            return None
+
+        return self.qualified_pattern.sub(r"\1", statement)
+
+    def execute_pending(self, cursor):
+        """Execute all the pending statements"""
+
+        if not self.pending:
+            return
+
+        cursor.execute("".join(self.pending))
+
+        self.pending = []
+        self.pending_size = 0
+
+    def load_copy(self, cursor, statement):
+        """Stream a COPY data block into database"""
+
+        # pending statements need to be executed before COPY
+        self.execute_pending(cursor)
+
+        statement = self.fix_statement(statement)
+
+        logger.debug("Executing: %s" % statement.strip())
+
+        cursor.copy_expert(
+            statement, CopyDataReader(self), size=self.buffer_size)
+
+    def load_statements(self, cursor):
+        """Read dump file and load data in database using cursor"""
+
+        # the statement under construction and the number of single quotes
+        # in it: a statement can span multiple lines if a string contains
+        # newlines
+        statement, quotes = [], 0
+
+        while True:
+            line = self.readline()
+
+            # end of file
+            if line == "":
+                break
+
+            if not statement:
+                # skip comments and empty lines between statements
+                if line.strip() == "" or line.startswith("--"):
+                    continue
+
+                if self.copy_pattern.match(line):
+                    self.load_copy(cursor, line)
+                    continue
+
+            statement.append(line)
+            quotes += line.count("'")
+
+            # a statement ends with a semicolon outside a string
+            if quotes % 2 == 0 and line.rstrip().endswith(";"):
+                statement = self.fix_statement("".join(statement))
+
+                if statement:
+                    if statement.startswith("INSERT"):
+                        self.rows += 1
+
+                    self.pending.append(statement)
+                    self.pending_size += len(statement)
+
+                if self.pending_size >= self.buffer_size:
+                    self.execute_pending(cursor)
+
+                statement, quotes = [], 0
+
+        if statement:
+            raise CryoWebImportError("Unterminated statement in dump file")
+
+        self.execute_pending(cursor)
+
+    def load(self):
+        """Load the whole dump file in a single transaction"""
+
+        connection = self.get_connection()
+        self.handle = open(self.fullpath, 'rb', buffering=self.buffer_size)
+
+        try:
+            # commit on success, rollback on errors
+            with connection:
+                with connection.cursor() as cursor:
+                    self.load_statements(cursor)
+
+        finally:
+            self.handle.close()
+            connection.close()
+
+        logger.info(self.get_progress_message())
+
+        return self.rows
+
+
 def upload_cryoweb(submission_id):
     """Imports backup into the cryoweb db
 
-    This function uses the container's installation of psql to import a backup
-    file into the "cryoweb" database. The imported backup file is
+    This function streams a backup file into the "cryoweb" database using
+    a :py:class:`CryowebDumpLoader` instance. The imported backup file is
     the last inserted into the image's table uid_submission.
 
     :submission_id: the submission primary key
@@ -128,10 +412,6 @@ def upload_cryoweb(submission_id):
     # define some useful variables
     database_name = settings.DATABASES['cryoweb']['NAME']
 
-    # define a decouple config object
-    config_dir = os.path.join(settings.BASE_DIR, 'image')
-    config = AutoConfig(search_path=config_dir)
-
     # get a submission object
     submission = Submission.objects.get(pk=submission_id)
 
@@ -154,28 +434,9 @@ def upload_cryoweb(submission_id):
 
         raise CryoWebImportError("Cryoweb has data!")
 
-    # this is the full path in docker container
-    fullpath = submission.get_uploaded_file_path()
-
-    # define command line
-    cmd_line = (
-        "/usr/bin/psql -U {user} -h db {database} -v ON_ERROR_STOP=1".format(
-            database=database_name, user='cryoweb_insert_only'))
-
-    cmds = shlex.split(cmd_line)
-
-    logger.debug("Executing: %s" % " ".join(cmds))
-
     try:
-        result = subprocess.run(
-            cmds,
-            stdin=open(fullpath),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            check=True,
-            env={'PGPASSWORD': config('CRYOWEB_INSERT_ONLY_PW')},
-            encoding='utf8'
-            )
+        loader = CryowebDumpLoader(submission)
+        loader.load()
 
     except Exception as exc:
         # save a message in database
@@ -194,13 +455,6 @@ def upload_cryoweb(submission_id):
 
         return False
 
-    n_of_statements = len(result.stdout.split("\n"))
-    logger.debug("%s statement executed" % n_of_statements)
-
-    if len(result.stderr) > 0:
-        for line in result.stderr.split("\n"):
-            logger.error(line)
-
     logger.info("{filename} uploaded into {database}".format(
         filename=submission.uploaded_file.name, database=database_name))
 
@@ -240,111 +494,298 @@ def fill_uid_breeds(submission):
     logger.info("fill_uid_breeds() completed")
 
 
-def get_animal_specie_and_breed(v_animal, language):
-    # get specie translated by dictionary
-    specie = DictSpecie.get_by_synonym(
-        synonym=v_animal.ext_species,
-        language=language)
+class BreedResolver():
+    """Resolve cryoweb breeds into UID species and breeds during an import.
+    All the required dictionary tables are read once when the object is
+    instantiated, so the resolver need to be created after
+    :py:func:`fill_uid_breeds`::
+
+        resolver = BreedResolver(language="Germany")
+        specie, breed = resolver.resolve(v_animal.db_breed)
+
+        # log cache statistics
+        resolver.log_statistics()
+
+    Args:
+        language (str): the submission language (a DictCountry label)
+    """
+
+    # the default language for species synonyms
+    default_language = "United Kingdom"
+
+    def __init__(self, language):
+        self.language = language
+
+        # track cached (hits) and resolved (misses) breeds
+        self.hits = 0
+        self.misses = 0
+
+        # db_breed -> (specie, breed)
+        self.__cache = {}
+
+        # read all cryoweb breeds. db_breed should be unique in this view
+        self.breeds_species = {
+            entry.db_breed: entry for entry in VBreedsSpecies.objects.all()}
+
+        # read species synonyms in my language or default one, by removing
+        # spaces like DictSpecie.get_by_synonym does
+        self.synonyms = {}
+
+        queryset = SpecieSynonym.objects.filter(
+            language__label__in=[language, self.default_language],
+            dictspecie__isnull=False).select_related(
+                'dictspecie', 'language')
+
+        for synonym in queryset:
+            key = (synonym.word.replace(" ", ""), synonym.language.label)
+            self.synonyms[key] = synonym.dictspecie
+
+        # read countries by label
+        self.countries = {
+            country.label: country for country in DictCountry.objects.all()}
+
+        # read breeds defined in cryoweb. A breed could be specie/country
+        # specific
+        self.dictbreeds = {}
+
+        queryset = DictBreed.objects.filter(
+            supplied_breed__in=[
+                entry.efabis_mcname for entry in
+                self.breeds_species.values()]).select_related(
+                    'specie', 'country')
+
+        for breed in queryset:
+            key = (breed.supplied_breed, breed.specie_id, breed.country_id)
+            self.dictbreeds[key] = breed
+
+    def get_specie(self, synonym):
+        """Get a DictSpecie object by synonym in my language or in the
+        default one"""
+
+        # now remove spaces from synonym
+        synonym = synonym.replace(" ", "")
+
+        for language in [self.language, self.default_language]:
+            if (synonym, language) in self.synonyms:
+                return self.synonyms[(synonym, language)]
+
+        raise DictSpecie.DoesNotExist(
+            "Can't find a specie for synonym '%s'" % (synonym))
+
+    def get_country(self, label):
+        """Get a DictCountry object by label"""
+
+        try:
+            return self.countries[label]
+
+        except KeyError:
+            raise DictCountry.DoesNotExist(
+                "Can't find country '%s'" % (label))
+
+    def resolve(self, db_breed):
+        """Get specie and breed from a cryoweb db_breed
+
+        Args:
+            db_breed (int): the cryoweb breed id
+
+        Returns:
+            tuple: a (DictSpecie, DictBreed) tuple
+        """
+
+        if db_breed in self.__cache:
+            self.hits += 1
+            return self.__cache[db_breed]
+
+        self.misses += 1
+
+        # get breed name and country through VBreedsSpecies model
+        try:
+            entry = self.breeds_species[db_breed]
+
+        except KeyError:
+            raise VBreedsSpecies.DoesNotExist(
+                "Can't find breed '%s' in cryoweb" % (db_breed))
+
+        # get specie translated by dictionary
+        specie = self.get_specie(entry.ext_species)
+
+        logger.debug("Selected specie is %s" % (specie))
+
+        # get a country object
+        country = self.get_country(entry.efabis_country)
+
+        try:
+            breed = self.dictbreeds[
+                (entry.efabis_mcname, specie.id, country.id)]
+
+        except KeyError:
+            raise DictBreed.DoesNotExist(
+                "Can't find breed '%s' for '%s' in '%s'" % (
+                    entry.efabis_mcname, specie.label, country.label))
 
-    logger.debug("Selected specie is %s" % (specie))
+        logger.debug("Selected breed is %s" % (breed))
 
-    # get breed name and country through VBreedsSpecies model
-    efabis_mcname = v_animal.efabis_mcname
-    efabis_country = v_animal.efabis_country
+        self.__cache[db_breed] = (specie, breed)
 
-    # get a country object
-    country = DictCountry.objects.get(label=efabis_country)
+        return specie, breed
 
-    # a breed could be specie/country specific
-    breed = DictBreed.objects.get(
-        supplied_breed=efabis_mcname,
-        specie=specie,
-        country=country)
+    def log_statistics(self):
+        """Log cache hits and misses"""
 
-    logger.debug("Selected breed is %s" % (breed))
+        logger.info(
+            "Breeds resolved: %s hits, %s misses" % (self.hits, self.misses))
 
-    return specie, breed
 
+def get_animal_sex(v_animal, male, female):
+    """Return a DictSex object from cryoweb sex"""
 
-def fill_uid_animals(submission):
-    """Helper function to fill animal data in UID animal table"""
+    # determine sex. Check for values
+    if v_animal.ext_sex == 'm':
+        return male
+
+    elif v_animal.ext_sex == 'f':
+        return female
+
+    else:
+        raise CryoWebImportError(
+            "Unknown sex '%s' for '%s'" % (v_animal.ext_sex, v_animal))
+
+
+def update_animal_parents(parents, batch_size=BATCH_SIZE):
+    """Set father and mother of UID animals with bulk UPDATE statements
+
+    Args:
+        parents (list): a list of ``(animal_id, father_id, mother_id)``
+            tuples. Unknown parents are ``None``
+        batch_size (int): the number of animals updated by each statement
+    """
+
+    # parents ids need to be casted, since a column with only NULL values
+    # will be interpreted as text
+    statement = (
+        "UPDATE {table} SET father_id = parents.father_id, "
+        "mother_id = parents.mother_id "
+        "FROM (VALUES %s) AS parents (id, father_id, mother_id) "
+        "WHERE {table}.id = parents.id").format(
+            table=Animal._meta.db_table)
+
+    with connections["default"].cursor() as cursor:
+        execute_values(
+            cursor,
+            statement,
+            parents,
+            template="(%s, %s::integer, %s::integer)",
+            page_size=batch_size)
+
+    logger.debug("Set parents for %s animals" % (len(parents)))
+
+
+def fill_uid_animals(submission, resolver=None, batch_size=BATCH_SIZE):
+    """Helper function to fill animal data in UID animal table. Animals are
+    loaded in two steps: first all cryoweb animals are read in chunks of
+    ``batch_size`` records and written without parents, then father and
+    mother are set by joining ``db_sire`` and ``db_dam`` with the inserted
+    animals. In such way parents are resolved whatever the order of
+    animals in the cryoweb dump. Species and breeds are resolved with a
+    :py:class:`BreedResolver` instance (a new one is created if not
+    provided)"""
 
     # debug
     logger.info("called fill_uid_animals()")
 
-    # get submission language
-    language = submission.gene_bank_country.label
+    if not resolver:
+        # get submission language
+        resolver = BreedResolver(
+            language=submission.gene_bank_country.label)
 
     # get male and female DictSex objects from database
     male = DictSex.objects.get(label="male")
     female = DictSex.objects.get(label="female")
 
+    # track UID animals by cryoweb db_animal
+    db_animals = {}
+
+    # track db_animal of the UID animals belonging to this submission (others
+    # animals are ignored by bulk_update_or_create_objs)
+    in_submission = set()
+
+    queryset = VAnimal.objects.order_by('db_animal')
+
+    # count processed animals
+    n_of_animals = 0
+
     # cycle over animals
-    for v_animal in VAnimal.objects.all():
-        # getting specie and breed
-        specie, breed = get_animal_specie_and_breed(v_animal, language)
-
-        # get name for this animal and for mother and father
-        logger.debug("Getting %s as my name" % (v_animal.ext_animal))
-
-        logger.debug("Getting %s as father" % (v_animal.ext_sire))
-
-        # get father or None
-        father = Animal.objects.filter(
-            name=v_animal.ext_sire,
-            breed=breed,
-            owner=submission.owner).first()
-
-        logger.debug("Getting %s as mother" % (v_animal.ext_dam))
-
-        # get mother or None
-        mother = Animal.objects.filter(
-            name=v_animal.ext_dam,
-            breed=breed,
-            owner=submission.owner).first()
-
-        # determine sex. Check for values
-        if v_animal.ext_sex == 'm':
-            sex = male
-
-        elif v_animal.ext_sex == 'f':
-            sex = female
-
-        else:
-            raise CryoWebImportError(
-                "Unknown sex '%s' for '%s'" % (v_animal.ext_sex, v_animal))
-
-        # checking accuracy
-        accuracy = MISSING
-
-        # HINT: this will is not sufficent for validation, since we need also
-        # birth location as a Text to have valid birth location. Cryoweb
-        # with coordinates will always fail validation
-        if v_animal.latitude and v_animal.longitude:
-            accuracy = UNKNOWN
-
-        # create a new object. Using defaults to avoid collisions when
-        # updating data
-        defaults = {
-            'alternative_id': v_animal.db_animal,
-            'sex': sex,
-            'father': father,
-            'mother': mother,
-            'birth_date': v_animal.birth_dt,
-            'birth_location_latitude': v_animal.latitude,
-            'birth_location_longitude': v_animal.longitude,
-            'birth_location_accuracy': accuracy,
-            'description': v_animal.comment,
-        }
-
-        # Upate or create animal obj
-        update_or_create_obj(
-            Animal,
-            name=v_animal.ext_animal,
-            breed=breed,
-            owner=submission.owner,
-            submission=submission,
-            defaults=defaults)
+    for chunk in chunks(queryset.iterator(chunk_size=batch_size), batch_size):
+        records = []
+
+        for v_animal in chunk:
+            # getting specie and breed
+            specie, breed = resolver.resolve(v_animal.db_breed)
+
+            sex = get_animal_sex(v_animal, male, female)
+
+            # checking accuracy
+            accuracy = MISSING
+
+            # HINT: this will is not sufficent for validation, since we need
+            # also birth location as a Text to have valid birth location.
+            # Cryoweb with coordinates will always fail validation
+            if v_animal.latitude and v_animal.longitude:
+                accuracy = UNKNOWN
+
+            lookup = {
+                'name': v_animal.ext_animal,
+                'breed': breed,
+                'owner': submission.owner,
+            }
+
+            # Using defaults to avoid collisions when updating data. Parents
+            # will be set after all animals are inserted
+            defaults = {
+                'alternative_id': v_animal.db_animal,
+                'sex': sex,
+                'birth_date': v_animal.birth_dt,
+                'birth_location_latitude': v_animal.latitude,
+                'birth_location_longitude': v_animal.longitude,
+                'birth_location_accuracy': accuracy,
+                'description': v_animal.comment,
+            }
+
+            records.append((lookup, defaults))
+
+        # Upate or create animal objects
+        instances = bulk_update_or_create_objs(
+            Animal, records, submission, batch_size)
+
+        # track the UID animals by their cryoweb ids
+        for lookup, defaults in records:
+            db_animal = defaults['alternative_id']
+            instance = instances[get_lookup_key(lookup)]
+            db_animals[db_animal] = instance.pk
+
+            if instance.submission_id == submission.id:
+                in_submission.add(db_animal)
+
+        n_of_animals += len(chunk)
+        logger.info("%s animals processed" % (n_of_animals))
+
+    # now set father and mother (or None) using cryoweb ids
+    logger.info("Setting animal parents")
+
+    parents = []
+
+    for db_animal, db_sire, db_dam in queryset.values_list(
+            'db_animal', 'db_sire', 'db_dam').iterator(chunk_size=batch_size):
+
+        if db_animal not in in_submission:
+            continue
+
+        parents.append((
+            db_animals[db_animal],
+            db_animals.get(db_sire),
+            db_animals.get(db_dam)))
+
+    update_animal_parents(parents, batch_size)
 
     # create a validation summary object and set all_count
     validation_summary = get_or_create_obj(
@@ -359,61 +800,95 @@ def fill_uid_animals(submission):
     logger.info("fill_uid_animals() completed")
 
 
-def fill_uid_samples(submission):
-    """Helper function to fill animal data in UID animal table"""
+def fill_uid_samples(submission, resolver=None, batch_size=BATCH_SIZE):
+    """Helper function to fill sample data in UID sample table. Cryoweb
+    vessels are read in chunks of ``batch_size`` records, which are then
+    written with bulk queries. Species and breeds are resolved with a
+    :py:class:`BreedResolver` instance (a new one is created if not
+    provided)"""
 
     # debug
     logger.info("called fill_uid_samples()")
 
-    # get submission language
-    language = submission.gene_bank_country.label
-
-    for v_vessel in VVessels.objects.all():
-        # get name for this sample
-        name = v_vessel.ext_vessel
-
-        # get the animal of this sample
-        v_animal = v_vessel.get_animal()
-
-        # getting specie and breed
-        specie, breed = get_animal_specie_and_breed(v_animal, language)
-
-        # get animal object using name
-        animal = Animal.objects.get(
-            name=v_animal.ext_animal,
-            breed=breed,
-            owner=submission.owner)
-
-        # get a organism part. Organism parts need to be in lowercases
-        organism_part = get_or_create_obj(
-            DictUberon,
-            label=v_vessel.get_organism_part().lower()
-        )
-
-        # derive animal age at collection. THis function deals with NULL valies
-        animal_age_at_collection, time_units = image_timedelta(
-            v_vessel.production_dt, v_animal.birth_dt)
-
-        # create a new object. Using defaults to avoid collisions when
-        # updating data
-        defaults = {
-            'alternative_id': v_vessel.db_vessel,
-            'collection_date': v_vessel.production_dt,
-            # 'protocol': v_vessel.get_protocol_name(),
-            'organism_part': organism_part,
-            'description': v_vessel.comment,
-            'animal_age_at_collection': animal_age_at_collection,
-            'animal_age_at_collection_units': time_units,
-            # 'storage': v_vessel.ext_vessel_type,
-        }
-
-        update_or_create_obj(
-            Sample,
-            name=name,
-            animal=animal,
-            owner=submission.owner,
-            submission=submission,
-            defaults=defaults)
+    if not resolver:
+        # get submission language
+        resolver = BreedResolver(
+            language=submission.gene_bank_country.label)
+
+    # organism parts by protocol id. Organism parts need to be in lowercases
+    protocols = {
+        protocol_id: material_type.lower() for protocol_id, material_type in
+        VProtocols.objects.values_list('protocol_id', 'ext_material_type')}
+
+    # track organism parts by label
+    organism_parts = {}
+
+    queryset = VVessels.objects.order_by('db_vessel')
+
+    for chunk in chunks(queryset.iterator(chunk_size=batch_size), batch_size):
+        # get the animals of this samples with a single query
+        v_animals = VAnimal.objects.in_bulk(
+            [v_vessel.db_animal for v_vessel in chunk],
+            field_name='db_animal')
+
+        # get UID animals by name and breed
+        animals = {
+            (animal.name, animal.breed_id): animal for animal in
+            Animal.objects.filter(
+                owner=submission.owner,
+                name__in=[
+                    v_animal.ext_animal for v_animal in v_animals.values()])}
+
+        records = []
+
+        for v_vessel in chunk:
+            # get the animal of this sample
+            v_animal = v_animals[v_vessel.db_animal]
+
+            # getting specie and breed
+            specie, breed = resolver.resolve(v_animal.db_breed)
+
+            # get animal object using name
+            try:
+                animal = animals[(v_animal.ext_animal, breed.id)]
+
+            except KeyError:
+                raise Animal.DoesNotExist(
+                    "Animal matching query does not exist: %s" % (v_animal))
+
+            # get a organism part
+            label = protocols[v_vessel.ext_protocol_id]
+
+            if label not in organism_parts:
+                organism_parts[label] = get_or_create_obj(
+                    DictUberon, label=label)
+
+            # derive animal age at collection. THis function deals with NULL
+            # values
+            animal_age_at_collection, time_units = image_timedelta(
+                v_vessel.production_dt, v_animal.birth_dt)
+
+            lookup = {
+                'name': v_vessel.ext_vessel,
+                'animal': animal,
+                'owner': submission.owner,
+            }
+
+            # Using defaults to avoid collisions when updating data
+            defaults = {
+                'alternative_id': v_vessel.db_vessel,
+                'collection_date': v_vessel.production_dt,
+                # 'protocol': v_vessel.get_protocol_name(),
+                'organism_part': organism_parts[label],
+                'description': v_vessel.comment,
+                'animal_age_at_collection': animal_age_at_collection,
+                'animal_age_at_collection_units': time_units,
+                # 'storage': v_vessel.ext_vessel_type,
+            }
+
+            records.append((lookup, defaults))
+
+        bulk_update_or_create_objs(Sample, records, submission, batch_size)
 
     # create a validation summary object and set all_count
     validation_summary = get_or_create_obj(
@@ -444,11 +919,16 @@ def cryoweb_import(submission):
         # BREEDS
         fill_uid_breeds(submission)
 
+        # read dictionary tables once for animals and samples
+        resolver = BreedResolver(language=submission.gene_bank_country.label)
+
         # ANIMALS
-        fill_uid_animals(submission)
+        fill_uid_animals(submission, resolver)
 
         # SAMPLES
-        fill_uid_samples(submission)
+        fill_uid_samples(submission, resolver)
+
+        resolver.log_statistics()
 
     except Exception as exc:
         # save a message in database
@@ -10,12 +10,26 @@
 from __future__ import unicode_literals
 
 import logging
+import threading
 
-from django.db import connections, models
+from contextlib import contextmanager
+
+from django.db import connections, models, transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
 
 # Get an instance of a logger
 logger = logging.getLogger(__name__)
 
+# the schema with cryoweb tables, used as a template for staging schemas
+TEMPLATE_SCHEMA = "apiis_admin"
+
+# the user which load cryoweb dumps
+INSERT_ONLY_USER = "cryoweb_insert_only"
+
+# track the staging schema used by the current thread
+_staging = threading.local()
+
 
 # Adding a classmethod to Category if you want to enable truncate
 # https://books.agiliq.com/projects/django-orm-cookbook/en/latest/truncate.html
@@ -1138,3 +1152,182 @@ def db_has_data():
 
     else:
         return False
+
+
+# --- Staging schemas
+
+
+def get_staging_schema_name(submission_id):
+    """Return the name of the staging schema of a submission"""
+
+    return "staging_{0:d}".format(submission_id)
+
+
+def get_current_schema():
+    """Return the staging schema used by the current thread (or None)"""
+
+    return getattr(_staging, "schema", None)
+
+
+def get_search_path():
+    """Return the search path for the cryoweb database. If a staging schema
+    is used, tables and views are read from staging schema while functions
+    are read from template schema"""
+
+    schema = get_current_schema()
+
+    if schema:
+        return "{0}, {1}".format(schema, TEMPLATE_SCHEMA)
+
+    return TEMPLATE_SCHEMA
+
+
+def set_search_path(connection):
+    """Set search path to a cryoweb database connection"""
+
+    with connection.cursor() as cursor:
+        statement = "SET search_path TO {0}".format(get_search_path())
+        logger.debug(statement)
+        cursor.execute(statement)
+
+
+@receiver(connection_created)
+def setup_cryoweb_connection(sender, connection, **kwargs):
+    """Restore the staging schema if cryoweb connection is re-opened"""
+
+    if connection.alias == "cryoweb" and get_current_schema():
+        set_search_path(connection)
+
+
+def create_staging_schema(schema):
+    """Create a staging schema by cloning cryoweb tables, sequences and
+    views from the template schema. Privileges to load data are assigned to
+    the insert only user"""
+
+    logger.info("Creating staging schema %s" % (schema))
+
+    connection = connections["cryoweb"]
+    quote_name = connection.ops.quote_name
+    schema = quote_name(schema)
+
+    with transaction.atomic(using="cryoweb"):
+        with connection.cursor() as cursor:
+            # remove a staging schema left by a failed import
+            cursor.execute("DROP SCHEMA IF EXISTS {0} CASCADE".format(schema))
+            cursor.execute("CREATE SCHEMA {0}".format(schema))
+
+            cursor.execute(
+                "SELECT sequence_name FROM information_schema.sequences "
+                "WHERE sequence_schema = %s", [TEMPLATE_SCHEMA])
+
+            for (name, ) in cursor.fetchall():
+                cursor.execute("CREATE SEQUENCE {0}.{1}".format(
+                    schema, quote_name(name)))
+
+            cursor.execute(
+                "SELECT tablename FROM pg_tables WHERE schemaname = %s",
+                [TEMPLATE_SCHEMA])
+
+            for (name, ) in cursor.fetchall():
+                cursor.execute(
+                    "CREATE TABLE {0}.{1} (LIKE {2}.{1} INCLUDING ALL)".format(
+                        schema, quote_name(name), TEMPLATE_SCHEMA))
+
+            # cloned defaults still call template sequences: use the
+            # sequences of staging schema instead
+            cursor.execute(
+                "SELECT c.relname, a.attname, s.relname FROM pg_depend d "
+                "JOIN pg_attrdef ad ON ad.oid = d.objid "
+                "JOIN pg_class c ON c.oid = ad.adrelid "
+                "JOIN pg_attribute a ON a.attrelid = ad.adrelid "
+                "AND a.attnum = ad.adnum "
+                "JOIN pg_class s ON s.oid = d.refobjid AND s.relkind = 'S' "
+                "JOIN pg_namespace n ON n.oid = c.relnamespace "
+                "JOIN pg_namespace sn ON sn.oid = s.relnamespace "
+                "WHERE d.classid = 'pg_attrdef'::regclass "
+                "AND n.nspname = %s AND sn.nspname = %s",
+                [TEMPLATE_SCHEMA, TEMPLATE_SCHEMA])
+
+            for table, column, sequence in cursor.fetchall():
+                sequence = "{0}.{1}".format(schema, quote_name(sequence))
+
+                cursor.execute(
+                    "ALTER TABLE {0}.{1} ALTER COLUMN {2} "
+                    "SET DEFAULT nextval(%s::regclass)".format(
+                        schema, quote_name(table), quote_name(column)),
+                    [sequence])
+
+            # get view definitions with unqualified table names. Views are
+            # sorted by creation order, to deal with dependencies
+            cursor.execute(
+                "SET LOCAL search_path TO {0}".format(TEMPLATE_SCHEMA))
+
+            cursor.execute(
+                "SELECT c.relname, pg_get_viewdef(c.oid) FROM pg_class c "
+                "JOIN pg_namespace n ON n.oid = c.relnamespace "
+                "WHERE n.nspname = %s AND c.relkind = 'v' ORDER BY c.oid",
+                [TEMPLATE_SCHEMA])
+
+            views = cursor.fetchall()
+
+            # now unqualified names will be resolved in staging schema
+            cursor.execute("SET LOCAL search_path TO {0}, {1}".format(
+                schema, TEMPLATE_SCHEMA))
+
+            for name, definition in views:
+                cursor.execute("CREATE VIEW {0}.{1} AS {2}".format(
+                    schema, quote_name(name), definition))
+
+            # allow data loading
+            cursor.execute("GRANT USAGE ON SCHEMA {0} TO {1}".format(
+                schema, INSERT_ONLY_USER))
+            cursor.execute(
+                "GRANT SELECT, INSERT ON ALL TABLES IN SCHEMA {0} "
+                "TO {1}".format(schema, INSERT_ONLY_USER))
+            cursor.execute(
+                "GRANT USAGE, SELECT, UPDATE ON ALL SEQUENCES IN SCHEMA {0} "
+                "TO {1}".format(schema, INSERT_ONLY_USER))
+
+
+def drop_staging_schema(schema):
+    """Drop a staging schema with all its data"""
+
+    logger.info("Dropping staging schema %s" % (schema))
+
+    connection = connections["cryoweb"]
+
+    with connection.cursor() as cursor:
+        cursor.execute("DROP SCHEMA IF EXISTS {0} CASCADE".format(
+            connection.ops.quote_name(schema)))
+
+
+@contextmanager
+def staging_schema(submission_id):
+    """Load cryoweb data in a per-submission schema, which is dropped at
+    the end. Cryoweb models will read data from this schema, so different
+    cryoweb imports could be done at the same time in different workers::
+
+        with staging_schema(submission.id):
+            upload_cryoweb(submission.id)
+            cryoweb_import(submission)
+
+    Args:
+        submission_id (int): the submission primary key
+    """
+
+    schema = get_staging_schema_name(submission_id)
+    connection = connections["cryoweb"]
+
+    create_staging_schema(schema)
+
+    _staging.schema = schema
+    set_search_path(connection)
+
+    try:
+        yield schema
+
+    finally:
+        _staging.schema = None
+        set_search_path(connection)
+
+        drop_staging_schema(schema)
@@ -13,29 +13,26 @@ http://docs.celeryproject.org/en/latest/tutorials/task-cookbook.html
 
 from celery.utils.log import get_task_logger
 
-from common.tasks import BaseTask, exclusive_task
+from common.tasks import BaseTask
 from image.celery import app as celery_app
 from submissions.tasks import ImportGenericTaskMixin
 
 from .helpers import cryoweb_import, upload_cryoweb
-from .models import truncate_database
+from .models import staging_schema
 
 # get a logger for tasks
 logger = get_task_logger(__name__)
 
 
-# clean cryoweb database after calling decorated function
-def clean_cryoweb_database(f):
+# load data in a staging schema, which is dropped after calling decorated
+# function
+def use_staging_schema(f):
     logger.debug("Decorating %s" % (f))
 
-    def wrap(*args, **kwargs):
-        result = f(*args, **kwargs)
-
-        # cleaning up database without knowing if load is successful or not
-        logger.info("Cleaning up cryoweb database")
-        truncate_database()
-
-        return result
+    def wrap(self, submission_obj, *args, **kwargs):
+        # dropping schema without knowing if load is successful or not
+        with staging_schema(submission_obj.id):
+            return f(self, submission_obj, *args, **kwargs)
 
     wrap.__doc__ = f.__doc__
     wrap.__name__ = f.__name__
@@ -46,10 +43,11 @@ def clean_cryoweb_database(f):
 
 class ImportCryowebTask(ImportGenericTaskMixin, BaseTask):
     """
-    An exclusive task wich upload a *data-only* cryoweb dump in cryoweb
-    database and then fill up :ref:`UID <The Unified Internal Database>`
-    tables. After data import (wich could be successful or not) cryoweb
-    helper database is cleanded and restored in the original status::
+    A task wich upload a *data-only* cryoweb dump in a staging schema of
+    cryoweb database and then fill up :ref:`UID <The Unified Internal
+    Database>` tables. Each submission has its own staging schema, which
+    is dropped after data import (wich could be successful or not), so
+    different imports could run at the same time::
 
         from cryoweb.tasks import ImportCryowebTask
 
@@ -68,15 +66,8 @@ class ImportCryowebTask(ImportGenericTaskMixin, BaseTask):
     description = """Import Cryoweb data from Cryoweb dump"""
     action = "cryoweb import"
 
-    # decorate function in order to cleanup cryoweb database after data import
-    @exclusive_task(
-            task_name="Import Cryoweb",
-            lock_id="ImportFromCryoWeb",
-            blocking=True)
-    def run(self, submission_id):
-        return super().run(submission_id)
-
-    @clean_cryoweb_database
+    # decorate function in order to load data in a staging schema
+    @use_staging_schema
     def import_data_from_file(self, submission_obj):
         """Call the custom import method"""
 
@@ -11,6 +11,7 @@ from unittest.mock import patch
 
 from django.conf import settings
 from django.core.management import call_command
+from django.db import connections
 from django.test import TestCase
 from django.test.testcases import TransactionTestCase
 
@@ -24,8 +25,11 @@ from uid.tests import DataSourceMixinTestCase
 
 from ..helpers import (
     upload_cryoweb, check_species, CryoWebImportError, cryoweb_import,
-    check_UID, check_countries)
-from ..models import db_has_data, truncate_database, BreedsSpecies
+    check_UID, check_countries, fill_uid_breeds, fill_uid_animals,
+    fill_uid_samples, BreedResolver, CryowebDumpLoader)
+from ..models import (
+    db_has_data, truncate_database, BreedsSpecies, VAnimal, VBreedsSpecies,
+    staging_schema, get_current_schema)
 
 
 class CryoWebMixin():
@@ -337,8 +341,24 @@ class UploadCryoweb(
 
         self.check_message(message, notification_message)
 
-    # mock subprocess.run and raise Exception. Read it and update submission
-    # message using helpers.upload_cryoweb
+    def test_upload_progress(self):
+        """Test loading progress messages"""
+
+        loader = CryowebDumpLoader(self.submission, progress_step=1024)
+        rows = loader.load()
+
+        self.assertTrue(db_has_data())
+        self.assertGreater(rows, 0)
+        self.assertEqual(loader.bytes_read, loader.total_bytes)
+
+        # reload submission
+        self.submission = Submission.objects.get(pk=1)
+
+        self.assertIn("Loading CryoWeb dump", self.submission.message)
+        self.assertGreater(self.send_msg_ws.call_count, 0)
+
+    # mock psycopg2.connect and raise Exception. Read it and update
+    # submission message using helpers.upload_cryoweb
     def test_upload_cryoweb_errors(self):
         """Testing errors in uploading cryoweb data"""
 
@@ -346,8 +366,8 @@ class UploadCryoweb(
         if db_has_data():
             truncate_database()
 
-        with patch('subprocess.run') as runMock:
-            runMock.side_effect = Exception("Test upload failed")
+        with patch('psycopg2.connect') as connectMock:
+            connectMock.side_effect = Exception("Test upload failed")
             self.assertFalse(upload_cryoweb(self.submission.id))
 
             # reload submission
@@ -371,6 +391,70 @@ class UploadCryoweb(
             self.check_message(message, notification_message)
 
 
+class StagingSchemaTest(CryoWebMixin, TestCase):
+    """Test loading data in a per-submission schema"""
+
+    # change fixtures in order to upload data to different databases
+    fixtures = {
+        'cryoweb': [],
+        'default': [
+            'uid/dictcountry',
+            'uid/dictrole',
+            'uid/organization',
+            'uid/submission',
+            'uid/user',
+        ]
+    }
+
+    def test_staging_schema(self):
+        self.assertFalse(db_has_data())
+
+        with staging_schema(self.submission.id) as schema:
+            self.assertEqual(schema, "staging_1")
+            self.assertEqual(get_current_schema(), schema)
+
+            # staging schema is empty
+            self.assertFalse(db_has_data())
+
+            # cryoweb models will write in staging schema
+            call_command(
+                'loaddata',
+                'cryoweb/cryoweb',
+                **{'verbosity': 0, 'database': 'cryoweb'})
+
+            self.assertTrue(db_has_data())
+
+            # views read data from staging schema
+            self.assertEqual(VAnimal.objects.count(), 3)
+
+            # column defaults don't use template sequences
+            with connections["cryoweb"].cursor() as cursor:
+                cursor.execute(
+                    "SELECT count(*) FROM information_schema.columns "
+                    "WHERE table_schema = %s AND column_default LIKE %s",
+                    [schema, "%apiis_admin.%"])
+                self.assertEqual(cursor.fetchone()[0], 0)
+
+        # staging schema was dropped, template schema is untouched
+        self.assertIsNone(get_current_schema())
+        self.assertFalse(db_has_data())
+
+    def test_staging_schema_errors(self):
+        """Staging schema is dropped even in case of errors"""
+
+        with self.assertRaisesRegex(Exception, "Test message"):
+            with staging_schema(self.submission.id):
+                call_command(
+                    'loaddata',
+                    'cryoweb/cryoweb',
+                    **{'verbosity': 0, 'database': 'cryoweb'})
+
+                raise Exception("Test message")
+
+        self.assertIsNone(get_current_schema())
+        self.assertFalse(db_has_data())
+
+
 class CryowebImport(
         ImportMixin, WebSocketMixin, CryoWebMixin, TestCase):
     def test_database_name(self):
@@ -403,6 +487,117 @@ class CryowebImport(
         self.check_message(message, notification_message)
 
 
+class BreedResolverTest(CryoWebMixin, TestCase):
+    def setUp(self):
+        # calling my base class setup
+        super().setUp()
+
+        # breeds need to be defined before creating resolver
+        fill_uid_breeds(self.submission)
+
+        self.resolver = BreedResolver(
+            language=self.submission.gene_bank_country.label)
+
+    def test_resolve(self):
+        specie, breed = self.resolver.resolve(317)
+
+        self.assertEqual(specie.label, "Ovis aries")
+        self.assertEqual(breed.supplied_breed, "Ostfriesisches Milchschaf")
+        self.assertEqual(breed.country.label, "Germany")
+        self.assertEqual(breed.specie, specie)
+
+        self.assertEqual(self.resolver.hits, 0)
+        self.assertEqual(self.resolver.misses, 1)
+
+        # get the same breed from cache
+        self.assertEqual(self.resolver.resolve(317), (specie, breed))
+
+        self.assertEqual(self.resolver.hits, 1)
+        self.assertEqual(self.resolver.misses, 1)
+
+        with self.assertLogs('cryoweb.helpers', level="INFO") as cm:
+            self.resolver.log_statistics()
+
+        self.assertIn("1 hits, 1 misses", cm.output[0])
+
+    def test_resolve_without_queries(self):
+        with self.assertNumQueries(0, using='default'):
+            self.resolver.resolve(317)
+            self.resolver.resolve(358)
+
+    def test_unknown_breed(self):
+        self.assertRaisesRegex(
+            VBreedsSpecies.DoesNotExist,
+            "Can't find breed",
+            self.resolver.resolve,
+            -1)
+
+
+class CryowebBatchImport(CryoWebMixin, TestCase):
+    """Import cryoweb data using one record for each bulk query"""
+
+    def test_fill_uid(self):
+        fill_uid_breeds(self.submission)
+        fill_uid_animals(self.submission, batch_size=1)
+        fill_uid_samples(self.submission, batch_size=1)
+
+        queryset = Animal.objects.all()
+        self.assertEqual(len(queryset), 3, msg="check animal load")
+
+        queryset = Sample.objects.all()
+        self.assertEqual(len(queryset), 1, msg="check sample load")
+
+        # parents are resolved using cryoweb ids
+        sample = queryset.first()
+        animal = sample.animal
+        v_animal = VAnimal.objects.get(db_animal=animal.alternative_id)
+
+        self.assertEqual(animal.father.name, v_animal.ext_sire)
+        self.assertEqual(animal.mother.name, v_animal.ext_dam)
+        self.assertEqual(animal.submission, self.submission)
+
+        # animals without parents in cryoweb have no parents in UID
+        for parent in [animal.father, animal.mother]:
+            self.assertIsNone(parent.father)
+            self.assertIsNone(parent.mother)
+
+        # calling fill again doesn't create new objects
+        fill_uid_animals(self.submission, batch_size=2)
+        fill_uid_samples(self.submission, batch_size=2)
+
+        self.assertEqual(Animal.objects.count(), 3)
+        self.assertEqual(Sample.objects.count(), 1)
+
+    def test_reversed_pedigree(self):
+        """Parents are resolved even if they come after their children"""
+
+        fill_uid_breeds(self.submission)
+
+        # read children before parents
+        order_by = VAnimal.objects.order_by
+
+        with patch.object(
+                VAnimal.objects,
+                'order_by',
+                side_effect=lambda *args: order_by('-db_animal')):
+            fill_uid_animals(self.submission, batch_size=1)
+
+        for animal in Animal.objects.all():
+            v_animal = VAnimal.objects.get(db_animal=animal.alternative_id)
+
+            if v_animal.get_sire():
+                self.assertEqual(animal.father.name, v_animal.ext_sire)
+
+            if v_animal.get_dam():
+                self.assertEqual(animal.mother.name, v_animal.ext_dam)
+
+        # the last animal has parents
+        self.assertEqual(
+            Animal.objects.filter(
+                father__isnull=False, mother__isnull=False).count(),
+            1)
+
+
 class CryowebReload(
         ImportMixin, WebSocketMixin, CryoWebMixin, TestCase):
     """Simulate a cryoweb reload case. Load data as in CryowebImport, then
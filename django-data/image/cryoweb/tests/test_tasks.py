@@ -34,9 +34,6 @@ class ImportCryowebTest(TestCase):
         # define my task
         self.my_task = ImportCryowebTask()
 
-        # change lock_id (useful when running test during cron)
-        self.my_task.lock_id = "test-ImportCryowebTask"
-
         # mocking annotate with zooma function
         self.mock_annotateall_patcher = patch('submissions.tasks.AnnotateAll')
         self.mock_annotateall = self.mock_annotateall_patcher.start()
@@ -48,12 +45,12 @@ class ImportCryowebTest(TestCase):
         # calling base methods
         super().tearDown()
 
-    # patching upload_cryoweb and truncate database
-    @patch("cryoweb.tasks.truncate_database")
+    # patching upload_cryoweb and staging schema
+    @patch("cryoweb.tasks.staging_schema")
     @patch("cryoweb.tasks.cryoweb_import", return_value=True)
     @patch("cryoweb.tasks.upload_cryoweb", return_value=True)
     def test_import_from_cryoweb(
-            self, my_upload, my_import, my_truncate):
+            self, my_upload, my_import, my_staging):
         """Testing cryoweb import"""
 
         # NOTE that I'm calling the function directly, without delay
@@ -67,8 +64,9 @@ class ImportCryowebTest(TestCase):
         self.assertTrue(my_upload.called)
         self.assertTrue(my_import.called)
 
-        # ensure that database is truncated
-        self.assertTrue(my_truncate.called)
+        # ensure that staging schema is used and dropped
+        my_staging.assert_called_with(1)
+        self.assertTrue(my_staging.return_value.__exit__.called)
 
         # assering zooma called
         self.assertTrue(self.mock_annotateall.called)
@@ -76,10 +74,10 @@ class ImportCryowebTest(TestCase):
     @patch('submissions.helpers.send_message_to_websocket')
     @patch('asyncio.get_event_loop')
     @patch("cryoweb.helpers.cryoweb_has_data", return_value=True)
-    @patch("cryoweb.tasks.truncate_database")
+    @patch("cryoweb.tasks.staging_schema")
     def test_import_has_data(
             self,
-            my_truncate,
+            my_staging,
             my_has_data,
             asyncio_mock,
             send_message_to_websocket_mock):
@@ -97,8 +95,9 @@ class ImportCryowebTest(TestCase):
 
         self.assertTrue(my_has_data.called)
 
-        # When I got an exception, task escapes without cleaning database
-        self.assertFalse(my_truncate.called)
+        # When I got an exception, staging schema is dropped anyway
+        my_staging.assert_called_with(1)
+        self.assertTrue(my_staging.return_value.__exit__.called)
 
         # asserting mocked asyncio
         self.assertEqual(asyncio_mock.call_count, 1)
@@ -112,11 +111,11 @@ class ImportCryowebTest(TestCase):
         # assering zooma not called
         self.assertFalse(self.mock_annotateall.called)
 
-    @patch("cryoweb.tasks.truncate_database")
+    @patch("cryoweb.tasks.staging_schema")
     @patch("cryoweb.tasks.cryoweb_import")
     @patch("cryoweb.tasks.upload_cryoweb", return_value=False)
     def test_error_in_uploading(
-            self, my_upload, my_import, my_truncate):
+            self, my_upload, my_import, my_staging):
         """Testing error in importing data into cryoweb"""
 
         res = self.my_task.run(submission_id=1)
@@ -128,17 +127,18 @@ class ImportCryowebTest(TestCase):
         self.assertTrue(my_upload.called)
         self.assertFalse(my_import.called)
 
-        # ensure that database is truncated
-        self.assertTrue(my_truncate.called)
+        # ensure that staging schema is used and dropped
+        my_staging.assert_called_with(1)
+        self.assertTrue(my_staging.return_value.__exit__.called)
 
         # assering zooma not called
         self.assertFalse(self.mock_annotateall.called)
 
-    @patch("cryoweb.tasks.truncate_database")
+    @patch("cryoweb.tasks.staging_schema")
     @patch("cryoweb.tasks.cryoweb_import", return_value=False)
     @patch("cryoweb.tasks.upload_cryoweb", return_value=True)
     def test_error_in_uploading2(
-            self, my_upload, my_import, my_truncate):
+            self, my_upload, my_import, my_staging):
         """Testing error in importing data from cryoweb to UID"""
 
         res = self.my_task.run(submission_id=1)
@@ -150,33 +150,9 @@ class ImportCryowebTest(TestCase):
         self.assertTrue(my_upload.called)
         self.assertTrue(my_import.called)
 
-        # ensure that database is truncated
-        self.assertTrue(my_truncate.called)
-
-        # assering zooma not called
-        self.assertFalse(self.mock_annotateall.called)
-
-    # Test a non blocking instance
-    @patch("redis.lock.Lock.acquire", return_value=False)
-    @patch("cryoweb.helpers.cryoweb_import")
-    @patch("cryoweb.helpers.upload_cryoweb", return_value=True)
-    @patch("cryoweb.models.db_has_data", return_value=False)
-    @patch("cryoweb.models.truncate_database")
-    def test_import_from_cryoweb_nb(
-            self, my_truncate, my_has_data, my_upload, my_import, my_lock):
-
-        # NOTE that I'm calling the function directly, without delay
-        # (AsyncResult). I've patched the time consuming task
-        res = self.my_task.run(submission_id=1)
-
-        # assert database is locked
-        self.assertEqual(res, "Import Cryoweb already running!")
-
-        # assert that methods were not called
-        self.assertFalse(my_truncate.called)
-        self.assertFalse(my_upload.called)
-        self.assertFalse(my_import.called)
-        self.assertTrue(my_lock.called)
+        # ensure that staging schema is used and dropped
+        my_staging.assert_called_with(1)
+        self.assertTrue(my_staging.return_value.__exit__.called)
 
         # assering zooma not called
         self.assertFalse(self.mock_annotateall.called)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 12 11:20:34 2020
+
+@author: Paolo Cozzi <cozzi@ibba.cnr.it>
+
+Backends used by ExcelTemplateReader to read excel files. Each backend
+returns sheet rows as lists of values, with the header as the first row.
+Empty rows are skipped by all backends
+
+"""
+
+import xlrd
+import logging
+import zipfile
+import datetime
+
+try:
+    import openpyxl
+    from openpyxl.utils.datetime import from_excel
+
+except ImportError:
+    openpyxl = None
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+
+def is_empty(row):
+    """Return True if all values in row are empty strings"""
+
+    return all(value == "" for value in row)
+
+
+class XlrdBackend():
+    """Read excel files using xlrd. Sheets are loaded on demand, however
+    a whole sheet is loaded in memory when requested"""
+
+    def __init__(self, filename):
+        self.book = xlrd.open_workbook(filename, on_demand=True)
+
+    def sheet_names(self):
+        return self.book.sheet_names()
+
+    def get_rows(self, sheet_name):
+        """Iterate over sheet rows, header included. Empty rows are
+        skipped"""
+
+        sheet = self.book.sheet_by_name(sheet_name)
+
+        for i in range(sheet.nrows):
+            row = sheet.row_values(i)
+
+            if is_empty(row):
+                continue
+
+            yield row
+
+    def to_date(self, value):
+        # fix date objects using datetime, as described here:
+        # https://stackoverflow.com/a/13962976/4385116
+        return datetime.datetime(
+            *xlrd.xldate_as_tuple(
+                value,
+                self.book.datemode
+            )
+        ).date()
+
+    def close(self):
+        self.book.release_resources()
+
+
+class OpenpyxlBackend():
+    """Read xlsx files using openpyxl in read-only mode: rows are read
+    from file while iterating, without loading the whole workbook"""
+
+    def __init__(self, filename):
+        self.book = openpyxl.load_workbook(
+            filename, read_only=True, data_only=True)
+
+    def sheet_names(self):
+        return self.book.sheetnames
+
+    def get_rows(self, sheet_name):
+        """Iterate over sheet rows, header included. Empty rows are
+        skipped"""
+
+        sheet = self.book[sheet_name]
+
+        # the number of columns, determined by header
+        ncols = None
+
+        for row in sheet.iter_rows(values_only=True):
+            # empty cells are None in openpyxl, while xlrd returns
+            # empty strings. Date cells are returned as datetime objects
+            row = [
+                "" if value is None else
+                value.date() if isinstance(value, datetime.datetime) else
+                value for value in row]
+
+            # in read-only mode, empty rows with a format could be returned
+            if is_empty(row):
+                continue
+
+            if ncols is None:
+                ncols = len(row)
+
+            # rows could be shorter than header
+            elif len(row) < ncols:
+                row += [""] * (ncols - len(row))
+
+            yield row
+
+    def to_date(self, value):
+        # date cells are already converted by get_rows
+        if isinstance(value, datetime.date):
+            return value
+
+        return from_excel(value).date()
+
+    def close(self):
+        self.book.close()
+
+
+def get_backend(filename):
+    """Return the backend used to read filename. xlsx files (which are zip
+    archives) are read with openpyxl, if installed"""
+
+    if openpyxl is not None and zipfile.is_zipfile(filename):
+        logger.debug("Reading %s with openpyxl" % (filename))
+        return OpenpyxlBackend(filename)
+
+    logger.debug("Reading %s with xlrd" % (filename))
+    return XlrdBackend(filename)
@@ -6,9 +6,7 @@ Created on Fri Jul  5 16:31:45 2019
 @author: Paolo Cozzi <cozzi@ibba.cnr.it>
 """
 
-import xlrd
 import logging
-import datetime
 
 from collections import defaultdict, namedtuple
 
@@ -16,6 +14,7 @@ from common.constants import ACCURACIES
 from uid.helpers import FileDataSourceMixin
 from uid.models import DictSex, DictCountry
 
+from .backends import get_backend
 from .exceptions import ExcelImportError
 
 # Get an instance of a logger
@@ -71,18 +70,71 @@ TEMPLATE_COLUMNS = {
 }
 
 
+def clean_value(value):
+    """Clean an excel value: empty values are replaced with None, strings
+    are stripped and integer floats are treated as integers"""
+
+    if value == "":
+        return None
+
+    value_type = type(value)
+
+    if value_type is str:
+        return value.strip()
+
+    elif value_type is float and value.is_integer():
+        return int(value)
+
+    return value
+
+
 class ExcelTemplateReader(FileDataSourceMixin):
     """A class to read template excel files"""
 
     def __init__(self):
-        # read xls file and track it
-        self.book = None
+        # the backend used to read excel file
+        self.backend = None
         self.sheet_names = []
 
+        # records indexed by key, parsed once (see get_index)
+        self.indexes = {}
+
     def read_file(self, filename):
         # read xls file and track it
-        self.book = xlrd.open_workbook(filename)
-        self.sheet_names = self.book.sheet_names()
+        self.backend = get_backend(filename)
+        self.sheet_names = self.backend.sheet_names()
+
+        # reset indexes
+        self.indexes = {}
+
+    def close(self):
+        """Release resources of the excel file"""
+
+        if self.backend:
+            self.backend.close()
+
+    def get_date_converter(self):
+        """Return a function which cleans a value and converts it into a
+        date object relying on backend"""
+
+        to_date = self.backend.to_date
+
+        def convert(value):
+            value = clean_value(value)
+
+            # date written as text are returned as they are
+            if not value or type(value) is str:
+                return value
+
+            # forcing a date object
+            return to_date(value)
+
+        return convert
+
+    def get_header(self, sheet_name):
+        """Read only the header of a sheet"""
+
+        return next(self.backend.get_rows(sheet_name), [])
 
     def check_sheets(self):
         """Test for the minimal sheets required to upload data"""
@@ -110,11 +162,8 @@ class ExcelTemplateReader(FileDataSourceMixin):
         not_found = defaultdict(list)
 
         for sheet_name in TEMPLATE_COLUMNS.keys():
-            # get a sheet from xls workbook
-            sheet = self.book.sheet_by_name(sheet_name)
-
             # get header from sheet
-            header = sheet.row_values(0)
+            header = self.get_header(sheet_name)
 
             for column in TEMPLATE_COLUMNS[sheet_name]:
                 if column not in header:
@@ -137,10 +186,10 @@ class ExcelTemplateReader(FileDataSourceMixin):
         """Generic functions to iterate on excel records"""
 
         # this is the sheet I need
-        sheet = self.book.sheet_by_name(sheet_name)
+        rows = self.backend.get_rows(sheet_name)
 
         # now get columns to create a collection objects
-        header = sheet.row_values(0)
+        header = next(rows, [])
 
         column_idxs = {}
 
@@ -163,48 +212,19 @@ class ExcelTemplateReader(FileDataSourceMixin):
         # create a namedtuple object
         Record = namedtuple(sheet_name.capitalize(), columns)
 
-        # iterate over record, mind the header column
-        for i in range(1, sheet.nrows):
-            # get a row from excel file
-            row = sheet.row_values(i)
-
-            # get the data I need
-            data = [row[column_idxs[column]] for column in columns]
-
-            # replace all empty  occurences in a list
-            data = [None if col in [""]
-                    else col for col in data]
-
-            # stripping columns
-            data = [col.strip() if type(col) is str
-                    else col for col in data]
-
-            # treat integers as integers
-            data = [int(col) if type(col) is float and col.is_integer()
-                    else col for col in data]
-
-            # fix date fields. Search for 'date' in column names
-            date_idxs = [column_idxs[column] for column in columns if
-                         'date' in column]
-
-            # fix date objects using datetime, as described here:
-            # https://stackoverflow.com/a/13962976/4385116
-            for idx in date_idxs:
-                if not data[idx]:
-                    continue
-
-                # forcing a date object
-                data[idx] = datetime.datetime(
-                    *xlrd.xldate_as_tuple(
-                        data[idx],
-                        self.book.datemode
-                    )
-                ).date()
+        # compile a conversion plan once: a list of (row index, converter)
+        # in the same order of Record columns. Search for 'date' in column
+        # names to fix date fields
+        date_converter = self.get_date_converter()
 
-            # get a new object
-            record = Record._make(data)
+        plan = [
+            (idx, date_converter if 'date' in column else clean_value)
+            for column, idx in column_idxs.items()]
 
-            yield record
+        # iterate over record, header was already read
+        for row in rows:
+            # get a new object
+            yield Record._make([convert(row[idx]) for idx, convert in plan])
 
     def get_breed_records(self):
         """Iterate among breeds record"""
@@ -227,13 +247,50 @@ class ExcelTemplateReader(FileDataSourceMixin):
         sheet_name = "sample"
         return self.get_sheet_records(sheet_name)
 
+    def get_index(self, name, records, key):
+        """Index records by key. Records are read and indexed once: the
+        same index is returned by subsequent calls with the same name
+
+        Args:
+            name (str): the index name
+            records (iterable): the records to index
+            key (callable): a function returning the key of a record
+
+        Returns:
+            dict: a dictionary of ``key -> list of records``
+        """
+
+        if name not in self.indexes:
+            index = defaultdict(list)
+
+            for record in records:
+                index[key(record)].append(record)
+
+            self.indexes[name] = dict(index)
+
+        return self.indexes[name]
+
+    def get_animal_index(self):
+        """Index animal records by animal_id_in_data_source"""
+
+        return self.get_index(
+            "animal",
+            self.get_animal_records(),
+            lambda animal: animal.animal_id_in_data_source)
+
+    def get_breed_index(self):
+        """Index breed records by (supplied_breed, species)"""
+
+        return self.get_index(
+            "breed",
+            self.get_breed_records(),
+            lambda breed: (breed.supplied_breed, breed.species))
+
     def get_animal_from_sample(self, sample):
         """get an animal record from a sample record"""
 
-        animals = [
-            animal for animal in self.get_animal_records() if
-            animal.animal_id_in_data_source == sample.animal_id_in_data_source
-        ]
+        animals = self.get_animal_index().get(
+            sample.animal_id_in_data_source, [])
 
         # animal is supposed to be unique
         if len(animals) != 1:
@@ -247,10 +304,8 @@ class ExcelTemplateReader(FileDataSourceMixin):
     def get_breed_from_animal(self, record):
         """Get a breed record from an animal record"""
 
-        breeds = [
-            breed for breed in self.get_breed_records()
-            if breed.supplied_breed == record.breed and
-            breed.species == record.species]
+        breeds = self.get_breed_index().get(
+            (record.breed, record.species), [])
 
         # breed is supposed to be unique, from UID constraints. However
         # I could place the same breed name for two countries. In that case,
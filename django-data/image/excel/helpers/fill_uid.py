@@ -442,6 +442,10 @@ def upload_template(submission_obj):
             submission_obj,
             validation_message=construct_validation_message(submission_obj))
 
+    finally:
+        # release excel file
+        reader.close()
+
     logger.info("Import from Template is complete")
 
     return True
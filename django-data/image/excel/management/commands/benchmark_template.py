@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 13 10:42:18 2020
+
+@author: Paolo Cozzi <cozzi@ibba.cnr.it>
+
+Read a synthetic template file and time ExcelTemplateReader methods
+
+"""
+
+import os
+import time
+import datetime
+import tempfile
+import tracemalloc
+
+import openpyxl
+
+from django.core.management import BaseCommand
+
+from excel.helpers import ExcelTemplateReader, TEMPLATE_COLUMNS
+
+
+def get_value(column, i):
+    """Return a fake value for a template column"""
+
+    if 'date' in column.lower():
+        return datetime.date(2019, 1, 1) + datetime.timedelta(days=i % 365)
+
+    elif column == 'Animal id in data source':
+        return "animal_%s" % (i)
+
+    elif column in ['Breed', 'Supplied breed']:
+        return "breed_%s" % (i % 10)
+
+    elif column == 'Species':
+        return "Sus scrofa"
+
+    elif 'accuracy' in column:
+        return "missing geographic information"
+
+    elif 'latitude' in column or 'longitude' in column:
+        return 45.0 + (i % 100) / 100
+
+    return " %s %s " % (column, i)
+
+
+def write_template(filename, nrows):
+    """Write a synthetic template with nrows animals and samples"""
+
+    book = openpyxl.Workbook(write_only=True)
+
+    for sheet_name, columns in TEMPLATE_COLUMNS.items():
+        sheet = book.create_sheet(sheet_name)
+        sheet.append(columns)
+
+        # ten breeds, one sample for each animal
+        n = 10 if sheet_name == 'breed' else nrows
+
+        for i in range(n):
+            sheet.append([get_value(column, i) for column in columns])
+
+    book.save(filename)
+
+
+class Command(BaseCommand):
+    help = """
+    Generate a synthetic template file and time ExcelTemplateReader while
+    reading records and joining samples with animals and breeds
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows',
+            type=int,
+            default=50000,
+            help='The number of animals and samples in template')
+
+    def timeit(self, label, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write("%s: %.3f s" % (label, elapsed))
+
+        return result
+
+    def handle(self, *args, **options):
+        nrows = options['rows']
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "template.xlsx")
+
+            self.stdout.write(
+                "Writing a template with %s records" % (nrows))
+            write_template(filename, nrows)
+
+            tracemalloc.start()
+
+            reader = ExcelTemplateReader()
+            self.timeit("read_file", reader.read_file, filename)
+            self.timeit("check_columns", reader.check_columns)
+
+            for sheet_name in TEMPLATE_COLUMNS.keys():
+                self.timeit(
+                    "get_sheet_records('%s')" % (sheet_name),
+                    lambda: list(reader.get_sheet_records(sheet_name)))
+
+            def join():
+                for sample in reader.get_sample_records():
+                    animal = reader.get_animal_from_sample(sample)
+                    reader.get_breed_from_animal(animal)
+
+            self.timeit("join samples, animals and breeds", join)
+
+            reader.close()
+
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            self.stdout.write("Peak memory: %.1f MB" % (peak / 1024 ** 2))
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 13 11:05:42 2020
+
+@author: Paolo Cozzi <cozzi@ibba.cnr.it>
+
+Testing management commands (https://stackoverflow.com/a/6513372)
+
+"""
+
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+
+class CommandsTestCase(TestCase):
+
+    def test_benchmark_template(self):
+        " Test benchmark_template command."
+
+        out = StringIO()
+
+        args = ["--rows", "10"]
+        opts = {'stdout': out}
+        call_command('benchmark_template', *args, **opts)
+
+        output = out.getvalue()
+        self.assertIn("get_sheet_records('sample')", output)
+        self.assertIn("Peak memory", output)
@@ -7,6 +7,9 @@ Created on Tue Jul  2 10:58:42 2019
 """
 
 import types
+import datetime
+import tempfile
+import openpyxl
 from collections import defaultdict, namedtuple
 from unittest.mock import patch, Mock
 
@@ -20,6 +23,8 @@ from uid.tests.mixins import (
 
 from ..helpers import (
     ExcelTemplateReader, upload_template, TEMPLATE_COLUMNS, ExcelImportError)
+from ..helpers.exceltemplate import clean_value
+from ..helpers.backends import XlrdBackend, OpenpyxlBackend
 from .common import BaseExcelMixin
 
 
@@ -56,6 +61,63 @@ class ExcelTemplateReaderTestCase(
         self.assertFalse(status)
         self.assertEqual(not_found, ['breed', 'animal', 'sample'])
 
+    def test_backend(self):
+        """xlsx files are read with openpyxl"""
+
+        self.assertIsInstance(self.reader.backend, OpenpyxlBackend)
+
+    def test_get_header(self):
+        """Read only sheet header"""
+
+        header = self.reader.get_header('breed')
+
+        for column in TEMPLATE_COLUMNS['breed']:
+            self.assertIn(column, header)
+
+    def test_xlrd_backend(self):
+        """Records are the same using xlrd"""
+
+        # read template with xlrd
+        reader = ExcelTemplateReader()
+
+        with patch(
+                'excel.helpers.exceltemplate.get_backend',
+                new=XlrdBackend):
+            reader.read_file(self.dst_path)
+
+        self.assertIsInstance(reader.backend, XlrdBackend)
+
+        for sheet_name in TEMPLATE_COLUMNS.keys():
+            self.assertEqual(
+                list(self.reader.get_sheet_records(sheet_name)),
+                list(reader.get_sheet_records(sheet_name)))
+
+        reader.close()
+
+    def test_empty_rows(self):
+        """Empty rows are skipped by both backends"""
+
+        # add empty rows in animal sheet
+        workbook = openpyxl.load_workbook(self.dst_path, data_only=True)
+        workbook['animal'].insert_rows(3, amount=2)
+
+        with tempfile.NamedTemporaryFile(suffix=".xlsx") as handle:
+            workbook.save(handle.name)
+
+            for backend in [OpenpyxlBackend, XlrdBackend]:
+                reader = ExcelTemplateReader()
+
+                with patch(
+                        'excel.helpers.exceltemplate.get_backend',
+                        new=backend):
+                    reader.read_file(handle.name)
+
+                self.assertEqual(
+                    list(reader.get_animal_records()),
+                    list(self.reader.get_animal_records()))
+
+                reader.close()
+
     def test_check_columns(self):
         # test check sheets method
         status, not_found = self.reader.check_columns()
@@ -165,6 +227,51 @@ class ExcelTemplateReaderTestCase(
                 self.reader.get_animal_from_sample,
                 sample)
 
+    def test_issue_in_get_breed_from_animal(self):
+        """Test a non unique mapping to breed"""
+
+        breeds = self.reader.get_breed_records()
+
+        # duplicate breeds
+        breeds = list(breeds) * 2
+
+        # now patching the previous function
+        with patch(
+                'excel.helpers.ExcelTemplateReader'
+                '.get_breed_records') as my_breed:
+
+            my_breed.return_value = breeds
+
+            # now get the first animal
+            animal = next(self.reader.get_animal_records())
+
+            # and get a breed from this animal and assert errors
+            self.assertRaisesRegex(
+                ExcelImportError,
+                "Can't determine a unique breed for",
+                self.reader.get_breed_from_animal,
+                animal)
+
+    def test_indexes_are_cached(self):
+        """Sheets are parsed once to get animals and breeds"""
+
+        with patch.object(
+                self.reader,
+                'get_sheet_records',
+                wraps=self.reader.get_sheet_records) as my_records:
+
+            for sample in self.reader.get_sample_records():
+                animal = self.reader.get_animal_from_sample(sample)
+                breed = self.reader.get_breed_from_animal(animal)
+
+                self.assertEqual(
+                    animal.animal_id_in_data_source,
+                    sample.animal_id_in_data_source)
+                self.assertEqual(breed.supplied_breed, animal.breed)
+
+            # one call for each sheet
+            self.assertEqual(my_records.call_count, 3)
+
     def test_check_accuracies(self):
         """Test check accuracies method"""
 
@@ -251,6 +358,50 @@ class ExcelTemplateReaderTestCase(
 
         self.assertEqual(reference, test)
 
+    def test_clean_value(self):
+        """Test excel values conversion"""
+
+        self.assertIsNone(clean_value(""))
+        self.assertEqual(clean_value(" Meow "), "Meow")
+        self.assertEqual(clean_value(1.0), 1)
+        self.assertIsInstance(clean_value(1.0), int)
+        self.assertEqual(clean_value(1.5), 1.5)
+
+    @patch('xlrd.open_workbook')
+    def test_date_columns(self, mock_open):
+        """Date columns are converted even if header order differs from
+        TEMPLATE_COLUMNS"""
+
+        # creating a mock excel book
+        mock_book = Mock()
+        mock_book.datemode = 0
+        mock_book.sheet_names.return_value = ['breed', 'animal', 'sample']
+
+        # a header in reversed order
+        header = list(reversed(TEMPLATE_COLUMNS['animal']))
+
+        # creating a fake row of data
+        fake_row = ["" for col in header]
+        fake_row[header.index("Birth date")] = 43467.0
+        fake_row[header.index("Birth location longitude")] = 9.0
+
+        animal_sheet = Mock()
+        animal_sheet.nrows = 2
+        animal_sheet.row_values.side_effect = [header, fake_row]
+
+        mock_book.sheet_by_name.return_value = animal_sheet
+        mock_open.return_value = mock_book
+
+        # now calling methods
+        reader = ExcelTemplateReader()
+        reader.read_file("fake file")
+
+        animal = next(reader.get_animal_records())
+
+        self.assertEqual(animal.birth_date, datetime.date(2019, 1, 2))
+        self.assertEqual(animal.birth_location_longitude, 9)
+        self.assertIsNone(animal.birth_location_latitude)
+
     @patch('excel.helpers.ExcelTemplateReader.get_animal_records')
     def test_species_in_animal_and_breeds_differ(self, my_animal):
         # creating a fake row of data
@@ -436,3 +436,15 @@ CHANNEL_LAYERS = {
 # just to be on the safe side.
 # https://simpleisbetterthancomplex.com/packages/2016/08/11/django-import-export.html
 IMPORT_EXPORT_USE_TRANSACTIONS = True
+
+
+# --- Validation settings
+
+
+# seconds after which the IMAGE ruleset cached by validation workers is read
+# again. An optional pickled snapshot of the ruleset could be used when OLS is
+# not reachable (set a path to enable it)
+VALIDATION_RULESET_TTL = config(
+    'VALIDATION_RULESET_TTL', cast=int, default=86400)
+VALIDATION_RULESET_SNAPSHOT = config(
+    'VALIDATION_RULESET_SNAPSHOT', default=None)
@@ -61,9 +61,10 @@ class BatchDeleteSamples(SubmissionTaskMixin, NotifyAdminTaskMixin, BaseTask):
             message = f"You've removed {len(success_ids)} " \
                 f"samples. Rerun validation please!"
 
+        # update validation summary relying on database
         summary_obj, created = ValidationSummary.objects.get_or_create(
             submission=submission_obj, type='sample')
-        summary_obj.reset_all_count()
+        summary_obj.recompute()
 
         # mark submission with NEED_REVISION and send message
         self.update_submission_status(
@@ -145,34 +145,46 @@ class SubmissionFormMixin(UniqueSubmissionMixin):
             msg = "The file you provided is not a Template file"
             raise forms.ValidationError(msg, code='invalid')
 
-        # xlrd can manage only files. Write a temporary file
+        # excel backends can manage only files. Write a temporary file
         with tempfile.NamedTemporaryFile(delete=True) as tmpfile:
             for chunk in uploaded_file.chunks():
                 tmpfile.write(chunk)
 
-            # open the file with proper model
+            # ensure data are written on disk before reading
+            tmpfile.flush()
+
+            # open the file with proper model. Only sheet names and headers
+            # will be read
             reader = ExcelTemplateReader()
             reader.read_file(tmpfile.name)
 
-            # check that template has at least breed, animal, sample sheets
-            check, not_found = reader.check_sheets()
+            try:
+                # check that template has at least breed, animal, sample
+                # sheets
+                check, not_found = reader.check_sheets()
+
+                if check is False:
+                    msg = (
+                        "Error: file lacks of Template mandatory "
+                        "sheets: %s" % (not_found))
 
-            if check is False:
-                msg = "Error: file lacks of Template mandatory sheets: %s" % (
-                    not_found)
+                    # raising an exception:
+                    raise forms.ValidationError(msg, code='invalid')
 
-                # raising an exception:
-                raise forms.ValidationError(msg, code='invalid')
+                # check that template has at least breed, animal, sample
+                # columns
+                check, not_found = reader.check_columns()
 
-            # check that template has at least breed, animal, sample sheets
-            check, not_found = reader.check_columns()
+                if check is False:
+                    msg = (
+                        "Error: file lacks of Template mandatory "
+                        "columns: %s" % (not_found))
 
-            if check is False:
-                msg = "Error: file lacks of Template mandatory columns: %s" % (
-                    not_found)
+                    # raising an exception:
+                    raise forms.ValidationError(msg, code='invalid')
 
-                # raising an exception:
-                raise forms.ValidationError(msg, code='invalid')
+            finally:
+                reader.close()
 
 
 class SubmissionForm(SubmissionFormMixin, RequestFormMixin, forms.ModelForm):
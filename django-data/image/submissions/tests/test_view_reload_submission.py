@@ -239,9 +239,12 @@ class ReloadValidationTest(TestBase):
         # check errors
         self.common_check(response, my_task)
 
-    @patch('xlrd.book.Book.sheet_names', return_value=['animal', 'sample'])
+    @patch('excel.helpers.exceltemplate.get_backend')
     @patch('submissions.views.ImportTemplateTask.delay')
     def test_template_issues_in_sheets(self, my_task, my_excel):
+        # a template without breed sheet
+        my_excel.return_value.sheet_names.return_value = ['animal', 'sample']
+
         # submit a template file
         response = self.client.post(
             self.url,
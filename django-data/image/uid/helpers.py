@@ -12,6 +12,8 @@ Common functions in uid
 import re
 import logging
 
+from django.db import models
+
 from language.helpers import check_species_synonyms
 
 from .models import Animal, Sample, DictSpecie
@@ -164,3 +166,169 @@ def update_or_create_obj(model, **kwargs):
         logger.debug("Updating '%s'" % instance)
 
     return instance
+
+
+def get_lookup_key(lookup):
+    """Return a hashable key from a lookup dictionary. Related objects are
+    replaced by their primary keys, lookup keys are sorted by name"""
+
+    return tuple(
+        value.pk if isinstance(value, models.Model) else value
+        for _, value in sorted(lookup.items()))
+
+
+def bulk_update_or_create_objs(model, records, submission, batch_size=None):
+    """Bulk version of :py:func:`update_or_create_obj`: create or update
+    a list of objects belonging to the same submission with a few queries.
+    As :py:func:`update_or_create_obj`, an object already in database with a
+    different submission is ignored
+
+    Args:
+        model (django.db.models.Model): the model class
+        records (list): a list of ``(lookup, defaults)`` tuples, where
+            ``lookup`` is a dictionary used to identify an object and
+            ``defaults`` is a dictionary with the values to update
+        submission (uid.models.Submission): the submission of new objects
+        batch_size (int): the number of objects written in each query
+
+    Returns:
+        dict: a dictionary of ``lookup key -> instance`` (see
+        :py:func:`get_lookup_key`)
+    """
+
+    # deal with duplicated lookups: the last record wins, like calling
+    # update_or_create_obj many times
+    unique_records = {}
+
+    for lookup, defaults in records:
+        unique_records[get_lookup_key(lookup)] = (lookup, defaults)
+
+    if not unique_records:
+        return {}
+
+    # all lookups need to have the same keys
+    lookup_fields = sorted(next(iter(unique_records.values()))[0].keys())
+    attnames = [model._meta.get_field(name).attname for name in lookup_fields]
+
+    # the fields to update for objects already in database
+    update_fields = set()
+
+    for _, defaults in unique_records.values():
+        update_fields.update(defaults.keys())
+
+    # get all objects already in database with a single query. Filter a
+    # superset of my objects, then match keys in memory
+    filters = {}
+
+    for name, attname in zip(lookup_fields, attnames):
+        filters["%s__in" % (attname)] = set(
+            key[lookup_fields.index(name)] for key in unique_records.keys())
+
+    logger.debug("Test if %s objects are already in database" % (
+        len(unique_records)))
+
+    in_database = {}
+
+    for instance in model.objects.filter(**filters):
+        key = tuple(getattr(instance, attname) for attname in attnames)
+        in_database[key] = instance
+
+    instances, to_create, to_update = {}, [], []
+
+    for key, (lookup, defaults) in unique_records.items():
+        instance = in_database.get(key)
+
+        if instance:
+            # test if instance is in a different submission
+            if submission.id != instance.submission_id:
+                message = (
+                    "Ignoring: %s - Already in database with submission %s"
+                    % (lookup, instance.submission_id)
+                )
+                logger.warning(message)
+
+            else:
+                for field, value in defaults.items():
+                    setattr(instance, field, value)
+
+                to_update.append(instance)
+
+        else:
+            instance = model(submission=submission, **lookup, **defaults)
+            to_create.append(instance)
+
+        instances[key] = instance
+
+    # postgres will set primary keys on created objects
+    model.objects.bulk_create(to_create, batch_size=batch_size)
+
+    if to_update and update_fields:
+        model.objects.bulk_update(
+            to_update, fields=sorted(update_fields), batch_size=batch_size)
+
+    logger.debug("Created %s %s, updated %s %s" % (
+        len(to_create),
+        model._meta.verbose_name_plural,
+        len(to_update),
+        model._meta.verbose_name_plural))
+
+    return instances
+
+
+def bulk_get_or_create_objs(model, lookups, batch_size=None):
+    """Bulk version of :py:func:`get_or_create_obj`: get all objects
+    identified by lookups with a single query, then create the missing ones
+    with :py:meth:`bulk_create`
+
+    Args:
+        model (django.db.models.Model): the model class
+        lookups (list): a list of dictionaries used to identify objects. All
+            lookups need to have the same keys
+        batch_size (int): the number of objects written in each query
+
+    Returns:
+        dict: a dictionary of ``lookup key -> instance`` (see
+        :py:func:`get_lookup_key`)
+    """
+
+    # remove duplicated lookups
+    unique_lookups = {}
+
+    for lookup in lookups:
+        unique_lookups[get_lookup_key(lookup)] = lookup
+
+    if not unique_lookups:
+        return {}
+
+    lookup_fields = sorted(next(iter(unique_lookups.values())).keys())
+    attnames = [model._meta.get_field(name).attname for name in lookup_fields]
+
+    # filter a superset of my objects, then match keys in memory
+    filters = {}
+
+    for idx, attname in enumerate(attnames):
+        filters["%s__in" % (attname)] = set(
+            key[idx] for key in unique_lookups.keys())
+
+    instances = {}
+
+    # like get_or_create, take the first object if there are more objects
+    # with the same lookup
+    for instance in model.objects.filter(**filters).order_by('-pk'):
+        key = tuple(getattr(instance, attname) for attname in attnames)
+        instances[key] = instance
+
+    to_create = []
+
+    for key, lookup in unique_lookups.items():
+        if key not in instances:
+            instance = model(**lookup)
+            instances[key] = instance
+            to_create.append(instance)
+
+    model.objects.bulk_create(to_create, batch_size=batch_size)
+
+    for instance in to_create:
+        logger.info("Created '%s'" % instance)
+
+    return instances
@@ -105,27 +105,33 @@ class BioSampleMixin(BaseMixin):
         raise NotImplementedError(
             "You need to define this method in your class")
 
-    def get_attributes(self):
-        """Common attribute definition required from Animal and samples. Need
-        to be called inside Animal/sample get_atribute method. Keys
-        is the name in metadata rules
+    # related objects needed by to_biosample. Could be extended in Animal
+    # and Sample classes
+    biosample_related = [
+        'submission__organization__country',
+        'submission__organization__role',
+        'submission__gene_bank_country',
+        'owner__person__affiliation',
+        'owner__person__role',
+        'publication',
+    ]
+
+    # submission attributes could be set by to_biosample_many
+    _submission_attributes = None
+
+    def get_submission_attributes(self):
+        """Attributes which depend only on submission and owner, and which
+        are the same for all the animals and samples of a submission
 
         Returns:
             dict: a dictionary object
         """
 
-        attributes = {}
-
-        attributes['Data source ID'] = format_attribute(
-            value=self.data_source_id)
-
-        attributes['Alternative id'] = format_attribute(
-            value=self.alternative_id)
+        # return attributes set by to_biosample_many (if any)
+        if self._submission_attributes is not None:
+            return self._submission_attributes
 
-        # HINT: this is a mandatory biosample field: could be removed from
-        # attributes?
-        attributes['Description'] = format_attribute(
-            value=self.description)
+        attributes = {}
 
         attributes["Project"] = format_attribute(
             value="IMAGE")
@@ -172,11 +178,6 @@ class BioSampleMixin(BaseMixin):
         attributes[
             'Organization role'] = self.organization.role.format_attribute()
 
-        # this could be present or not
-        if self.publication:
-            attributes['Publication DOI'] = format_attribute(
-                value=self.publication.doi)
-
         attributes['Gene bank name'] = format_attribute(
             value=self.gene_bank_name)
 
@@ -189,6 +190,38 @@ class BioSampleMixin(BaseMixin):
         attributes['Data source version'] = format_attribute(
             value=self.submission.datasource_version)
 
+        return attributes
+
+    def get_attributes(self):
+        """Common attribute definition required from Animal and samples. Need
+        to be called inside Animal/sample get_atribute method. Keys
+        is the name in metadata rules
+
+        Returns:
+            dict: a dictionary object
+        """
+
+        attributes = {}
+
+        attributes['Data source ID'] = format_attribute(
+            value=self.data_source_id)
+
+        attributes['Alternative id'] = format_attribute(
+            value=self.alternative_id)
+
+        # HINT: this is a mandatory biosample field: could be removed from
+        # attributes?
+        attributes['Description'] = format_attribute(
+            value=self.description)
+
+        # add submission and owner attributes
+        attributes.update(self.get_submission_attributes())
+
+        # this could be present or not
+        if self.publication:
+            attributes['Publication DOI'] = format_attribute(
+                value=self.publication.doi)
+
         attributes['Species'] = self.specie.format_attribute()
 
         return attributes
@@ -236,6 +269,47 @@ class BioSampleMixin(BaseMixin):
 
         return result
 
+    @classmethod
+    def to_biosample_many(cls, queryset, release_date=None, chunk_size=2000):
+        """
+        Generate biosample objects for many animals or samples. Related
+        objects are selected with the same query, while submission and
+        owner attributes are computed once for each submission. Objects
+        are read in chunks and are not cached by queryset::
+
+            from uid.models import Animal
+
+            queryset = Animal.objects.filter(submission=submission)
+
+            for animal, biosample_data in Animal.to_biosample_many(queryset):
+                pass
+
+        Args:
+            queryset (QuerySet): an Animal/Sample queryset
+            release_date (str): data will no be published before this day
+                (YYYY-MM-DD)
+            chunk_size (int): the number of objects read from database at
+                once
+
+        Yields:
+            tuple: an Animal/Sample object and its biosample dictionary
+        """
+
+        # submission attributes by submission and owner
+        submission_attributes = {}
+
+        queryset = queryset.select_related(*cls.biosample_related)
+
+        for obj in queryset.iterator(chunk_size=chunk_size):
+            key = (obj.submission_id, obj.owner_id)
+
+            if key not in submission_attributes:
+                submission_attributes[key] = obj.get_submission_attributes()
+
+            obj._submission_attributes = submission_attributes[key]
+
+            yield obj, obj.to_biosample(release_date)
+
     def __status_not_in(self, statuses):
         """
         Return True id self.status not in statuses
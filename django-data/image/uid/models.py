@@ -568,6 +568,15 @@ class Animal(BioSampleMixin, Name):
         blank=False,
         default=MISSING)
 
+    # related objects needed by to_biosample
+    biosample_related = BioSampleMixin.biosample_related + [
+        'breed__specie',
+        'breed__country',
+        'sex',
+        'father',
+        'mother',
+    ]
+
     class Meta:
         unique_together = (("name", "breed", "owner"),)
 
@@ -782,6 +791,14 @@ class Sample(BioSampleMixin, Name):
         null=True,
         blank=True)
 
+    # related objects needed by to_biosample
+    biosample_related = BioSampleMixin.biosample_related + [
+        'animal__breed__specie',
+        'organism_part',
+        'developmental_stage',
+        'physiological_stage',
+    ]
+
     class Meta:
         unique_together = (("name", "animal", "owner"),)
 
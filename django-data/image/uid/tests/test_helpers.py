@@ -8,11 +8,11 @@ Created on Wed Feb 14 10:34:44 2018
 
 from django.test import TestCase
 
-from uid.models import Animal, Sample, DictSex
+from uid.models import Animal, Sample, DictSex, Submission
 
 from ..helpers import (
     get_model_object, parse_image_alias, get_or_create_obj,
-    update_or_create_obj)
+    update_or_create_obj, bulk_update_or_create_objs)
 
 
 class GetModelObjectTestCase(TestCase):
@@ -118,3 +118,101 @@ class CreateOrGetTestCase(TestCase):
 
         sex = update_or_create_obj(DictSex, label="foo", term="bar")
         self.assertIsInstance(sex, DictSex)
+
+
+class BulkUpdateOrCreateTestCase(TestCase):
+    fixtures = [
+        'uid/animal',
+        'uid/dictbreed',
+        'uid/dictcountry',
+        'uid/dictrole',
+        'uid/dictsex',
+        'uid/dictspecie',
+        'uid/organization',
+        'uid/submission',
+        'uid/user',
+    ]
+
+    def setUp(self):
+        self.submission = Submission.objects.get(pk=1)
+        self.animal = Animal.objects.get(pk=1)
+
+    def get_record(self, name, description):
+        lookup = {
+            'name': name,
+            'breed': self.animal.breed,
+            'owner': self.animal.owner
+        }
+
+        defaults = {
+            'alternative_id': name,
+            'sex': self.animal.sex,
+            'description': description
+        }
+
+        return lookup, defaults
+
+    def test_bulk_update_or_create_objs(self):
+        records = [
+            self.get_record(self.animal.name, "updated"),
+            self.get_record("new animal", "created")
+        ]
+
+        instances = bulk_update_or_create_objs(
+            Animal, records, self.submission)
+
+        self.assertEqual(len(instances), 2)
+        self.assertEqual(Animal.objects.count(), 4)
+
+        # test updated object
+        self.animal.refresh_from_db()
+        self.assertEqual(self.animal.description, "updated")
+
+        # test created object
+        animal = Animal.objects.get(name="new animal")
+        self.assertEqual(animal.description, "created")
+        self.assertEqual(animal.submission, self.submission)
+        self.assertIsNotNone(animal.last_changed)
+
+    def test_duplicated_records(self):
+        """The last record wins, like calling update_or_create_obj"""
+
+        records = [
+            self.get_record("new animal", "first"),
+            self.get_record("new animal", "last")
+        ]
+
+        instances = bulk_update_or_create_objs(
+            Animal, records, self.submission)
+
+        self.assertEqual(len(instances), 1)
+
+        animal = Animal.objects.get(name="new animal")
+        self.assertEqual(animal.description, "last")
+
+    def test_different_submission(self):
+        """Objects in a different submission are ignored"""
+
+        # create a new submission from the old one
+        submission = Submission.objects.get(pk=1)
+        submission.pk = None
+        submission.title = "another submission"
+        submission.datasource_version = "another version"
+        submission.save()
+
+        records = [self.get_record(self.animal.name, "updated")]
+
+        with self.assertLogs('uid.helpers', level="WARNING") as cm:
+            instances = bulk_update_or_create_objs(
+                Animal, records, submission)
+
+        self.assertEqual(len(cm.output), 1)
+        self.assertIn("Already in database with submission", cm.output[0])
+
+        # the same animal is returned, without modifications
+        self.assertEqual(list(instances.values()), [self.animal])
+
+        self.animal.refresh_from_db()
+        self.assertEqual(
+            self.animal.description, "a 4-year old pig organic fed")
+        self.assertEqual(self.animal.submission, self.submission)
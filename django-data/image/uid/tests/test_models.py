@@ -9,6 +9,9 @@ Created on Tue Apr  3 12:16:55 2018
 import os
 import json
 
+from unittest.mock import patch, ANY
+
+from django.db.models import QuerySet
 from django.test import TestCase
 from django.utils import timezone
 
@@ -423,6 +426,40 @@ class AnimalTestCase(PersonMixinTestCase, TestCase):
         # asserting biosample_.id in response
         self.assertEqual(test["accession"], reference)
 
+    def test_to_biosample_many(self):
+        """Testing JSON conversion of many animals at once"""
+
+        queryset = Animal.objects.filter(
+            submission=self.submission).order_by('id')
+
+        test = list(Animal.to_biosample_many(queryset))
+
+        self.assertEqual(len(test), queryset.count())
+
+        for animal, data in test:
+            self.maxDiff = None
+            self.assertEqual(
+                data, Animal.objects.get(pk=animal.pk).to_biosample())
+
+    def test_to_biosample_many_chunks(self):
+        """Objects are read in chunks without caching queryset"""
+
+        queryset = Animal.objects.filter(
+            submission=self.submission).order_by('id')
+
+        reference = [
+            data for _, data in Animal.to_biosample_many(queryset)]
+
+        with patch.object(
+                QuerySet, 'iterator', autospec=True,
+                side_effect=QuerySet.iterator) as my_iterator:
+            test = [
+                data for _, data in Animal.to_biosample_many(
+                    queryset, chunk_size=1)]
+
+        self.assertEqual(test, reference)
+        my_iterator.assert_called_once_with(ANY, chunk_size=1)
+
     def test_relationship(self):
         """Testing an animal who has mother and father"""
 
@@ -617,6 +654,40 @@ class SampleTestCase(PersonMixinTestCase, TestCase):
         }]
         self.assertEqual(test['sampleRelationships'], reference)
 
+    def test_to_biosample_many(self):
+        """Testing JSON conversion of many samples at once"""
+
+        queryset = Sample.objects.filter(
+            submission=self.submission).order_by('id')
+
+        test = list(Sample.to_biosample_many(queryset))
+
+        self.assertEqual(len(test), queryset.count())
+
+        for sample, data in test:
+            self.maxDiff = None
+            self.assertEqual(
+                data, Sample.objects.get(pk=sample.pk).to_biosample())
+
+    def test_to_biosample_many_chunks(self):
+        """Objects are read in chunks without caching queryset"""
+
+        queryset = Sample.objects.filter(
+            submission=self.submission).order_by('id')
+
+        reference = [
+            data for _, data in Sample.to_biosample_many(queryset)]
+
+        with patch.object(
+                QuerySet, 'iterator', autospec=True,
+                side_effect=QuerySet.iterator) as my_iterator:
+            test = [
+                data for _, data in Sample.to_biosample_many(
+                    queryset, chunk_size=1)]
+
+        self.assertEqual(test, reference)
+        my_iterator.assert_called_once_with(ANY, chunk_size=1)
+
     def test_to_biosample_no_foreign(self):
         """Testing JSON conversion for biosample submission without
         foreign keys"""
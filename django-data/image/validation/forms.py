@@ -14,3 +14,7 @@ from django import forms
 class ValidateForm(forms.Form):
     submission_id = forms.IntegerField(
         required=True)
+
+    # validate only the records changed after the last validation
+    incremental = forms.BooleanField(
+        required=False)
@@ -6,10 +6,20 @@ Created on Tue Feb 19 16:15:35 2019
 @author: Paolo Cozzi <cozzi@ibba.cnr.it>
 """
 
+import os
+import re
+import copy
 import json
+import time
+import pickle
+import hashlib
 import logging
 import requests
+import threading
 
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 
 from image_validation import validation, ValidationResult
@@ -18,6 +28,7 @@ from image_validation.static_parameters import ruleset_filename as \
 
 from common.constants import BIOSAMPLE_URL
 from uid.helpers import parse_image_alias, get_model_object
+from uid.models import Animal, Sample
 from validation.models import ValidationSummary
 
 # Get an instance of a logger
@@ -36,12 +47,386 @@ class RulesetError(Exception):
     """Indentifies errors in ruleset"""
 
 
+class RulesetCache():
+    """
+    A process level cache for IMAGE rulesets. A ruleset is read (and
+    checked) once and then used by all the validation tasks running in the
+    same process, until it expires after ``ttl`` seconds. If a ruleset
+    can't be read again due to issues with EBI servers, the expired ruleset
+    (or the one saved in ``snapshot`` file, if any) is returned instead
+    of raising :py:exc:`OntologyCacheError`::
+
+        cache = RulesetCache(ttl=3600)
+        ruleset = cache.get(IMAGE_RULESET)
+
+    Each new ruleset read increments the ``version`` attribute
+    """
+
+    # snapshot format version: snapshots written with a different version
+    # are ignored
+    snapshot_version = 1
+
+    def __init__(self, ttl=None, snapshot=None):
+        self.ttl = ttl
+        self.snapshot = snapshot
+        self.version = 0
+
+        # ruleset_filename: (ruleset, loaded time)
+        self.rulesets = {}
+
+        # tasks could run in threads
+        self.lock = threading.Lock()
+
+    def get_ttl(self):
+        if self.ttl is not None:
+            return self.ttl
+
+        return settings.VALIDATION_RULESET_TTL
+
+    def get_snapshot(self):
+        if self.snapshot is not None:
+            return self.snapshot
+
+        return settings.VALIDATION_RULESET_SNAPSHOT
+
+    def clear(self):
+        """Remove all cached rulesets"""
+
+        with self.lock:
+            self.rulesets = {}
+
+    def is_expired(self, ruleset_filename):
+        loaded = self.rulesets[ruleset_filename][1]
+
+        return time.time() - loaded > self.get_ttl()
+
+    def get(self, ruleset_filename=IMAGE_RULESET):
+        """
+        Get a checked ruleset, reading it if not cached or expired
+
+        Args:
+            ruleset_filename (str): the ruleset to read
+
+        Returns:
+            image_validation.Ruleset: a ruleset object
+        """
+
+        with self.lock:
+            if (ruleset_filename in self.rulesets and
+                    not self.is_expired(ruleset_filename)):
+                return self.rulesets[ruleset_filename][0]
+
+            try:
+                ruleset = self.load(ruleset_filename)
+
+            except OntologyCacheError as exc:
+                ruleset = self.get_fallback(ruleset_filename)
+
+                if ruleset is None:
+                    raise exc
+
+                return ruleset
+
+            self.rulesets[ruleset_filename] = (ruleset, time.time())
+            self.version += 1
+
+            self.write_snapshot(ruleset_filename, ruleset)
+
+            return ruleset
+
+    def load(self, ruleset_filename):
+        """Read and check a ruleset without using cache"""
+
+        logger.info("Reading ruleset %s" % (ruleset_filename))
+
+        return MetaDataValidation(
+            ruleset_filename, use_cache=False).ruleset
+
+    def get_fallback(self, ruleset_filename):
+        """Return the expired ruleset or the one saved in snapshot file.
+        Return None if no ruleset could be found"""
+
+        if ruleset_filename in self.rulesets:
+            logger.warning(
+                "Can't read ruleset %s: using expired ruleset" % (
+                    ruleset_filename))
+
+            return self.rulesets[ruleset_filename][0]
+
+        ruleset = self.read_snapshot(ruleset_filename)
+
+        if ruleset is not None:
+            logger.warning(
+                "Can't read ruleset %s: using ruleset from %s" % (
+                    ruleset_filename, self.get_snapshot()))
+
+            # this ruleset will be read again at the next request
+            self.rulesets[ruleset_filename] = (ruleset, 0)
+
+        return ruleset
+
+    def read_snapshot(self, ruleset_filename):
+        snapshot = self.get_snapshot()
+
+        if not snapshot or not os.path.exists(snapshot):
+            return None
+
+        try:
+            with open(snapshot, "rb") as handle:
+                data = pickle.load(handle)
+
+        except Exception as exc:
+            logger.error("Can't read %s: %s" % (snapshot, exc))
+            return None
+
+        if (data.get('version') != self.snapshot_version or
+                data.get('ruleset_filename') != ruleset_filename):
+            logger.warning("Ignoring snapshot %s" % (snapshot))
+            return None
+
+        return data['ruleset']
+
+    def write_snapshot(self, ruleset_filename, ruleset):
+        snapshot = self.get_snapshot()
+
+        if not snapshot:
+            return
+
+        data = {
+            'version': self.snapshot_version,
+            'ruleset_filename': ruleset_filename,
+            'created': time.time(),
+            'ruleset': ruleset,
+        }
+
+        # write a temporary file, then replace snapshot
+        tmp_snapshot = "%s.%s.tmp" % (snapshot, os.getpid())
+
+        try:
+            with open(tmp_snapshot, "wb") as handle:
+                pickle.dump(data, handle)
+
+            os.replace(tmp_snapshot, snapshot)
+
+        except Exception as exc:
+            logger.error("Can't write %s: %s" % (snapshot, exc))
+
+            if os.path.exists(tmp_snapshot):
+                os.remove(tmp_snapshot)
+
+
+# the process level ruleset cache
+ruleset_cache = RulesetCache()
+
+
+# BioSamples requests timeout (seconds)
+BIOSAMPLE_TIMEOUT = 30
+
+# how many BioSamples requests are done concurrently
+BIOSAMPLE_WORKERS = 8
+
+# how many BioSamples ids are cached and for how long (seconds)
+BIOSAMPLE_CACHE_SIZE = 10000
+BIOSAMPLE_CACHE_TTL = 3600
+
+
+class LRUCache():
+    """
+    A LRU cache in which items expire after ``ttl`` seconds (if provided).
+    Used for example to track BioSamples ids existence::
+
+        cache = LRUCache(maxsize=10000, ttl=3600)
+        cache.set("SAMEA4450079", True)
+        cache.get("SAMEA4450079")  # True
+
+    :py:meth:`get` returns None for missing or expired keys
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        # key: (value, time)
+        self.items = OrderedDict()
+
+        # accessed by many threads while prefetching
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.items:
+                return None
+
+            value, added = self.items[key]
+
+            if self.ttl is not None and time.time() - added > self.ttl:
+                del(self.items[key])
+                return None
+
+            # mark item as recently used
+            self.items.move_to_end(key)
+
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = (value, time.time())
+            self.items.move_to_end(key)
+
+            # remove least recently used items
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+# the process level BioSamples ids cache
+biosample_id_cache = LRUCache(
+    maxsize=BIOSAMPLE_CACHE_SIZE, ttl=BIOSAMPLE_CACHE_TTL)
+
+# a session for each process (connections can't be shared after fork)
+_biosample_session = (None, None)
+
+
+def get_biosample_session():
+    """Return a requests session (with a connection pool) for BioSamples"""
+
+    global _biosample_session
+
+    pid, session = _biosample_session
+
+    if pid != os.getpid():
+        session = requests.Session()
+
+        # connections used by prefetch threads
+        adapter = requests.adapters.HTTPAdapter(
+            pool_maxsize=BIOSAMPLE_WORKERS)
+        session.mount("https://", adapter)
+
+        _biosample_session = (os.getpid(), session)
+
+    return session
+
+
+def biosample_id_exists(biosample_id):
+    """
+    Check if a biosample_id exists in BioSamples. Results are cached in
+    :py:data:`biosample_id_cache`
+
+    Args:
+        biosample_id (str): the desidered biosample id
+
+    Returns:
+        bool: True if biosample_id exists
+    """
+
+    exists = biosample_id_cache.get(biosample_id)
+
+    if exists is not None:
+        return exists
+
+    url = f"{BIOSAMPLE_URL}/{biosample_id}"
+    response = get_biosample_session().get(url, timeout=BIOSAMPLE_TIMEOUT)
+    status = response.status_code
+
+    exists = status == 200
+
+    # server errors are not cached: this id will be checked again
+    if status < 500:
+        biosample_id_cache.set(biosample_id, exists)
+
+    return exists
+
+
+def prefetch_biosample_ids(biosample_ids):
+    """
+    Check many biosample ids concurrently, in order to fill
+    :py:data:`biosample_id_cache`. Ids which can't be checked are
+    ignored (they will be checked again by :py:func:`biosample_id_exists`)
+
+    Args:
+        biosample_ids (iterable): a list of biosample ids
+    """
+
+    missing = set([
+        biosample_id for biosample_id in biosample_ids
+        if biosample_id not in biosample_id_cache])
+
+    if not missing:
+        return
+
+    logger.debug("Checking %s biosample ids" % (len(missing)))
+
+    with ThreadPoolExecutor(max_workers=BIOSAMPLE_WORKERS) as executor:
+        futures = {
+            executor.submit(biosample_id_exists, biosample_id): biosample_id
+            for biosample_id in missing}
+
+        for future in as_completed(futures):
+            try:
+                future.result()
+
+            except requests.exceptions.RequestException as exc:
+                logger.warning(
+                    "Can't check %s: %s" % (futures[future], exc))
+
+
+# how many validation results are cached (see MetaDataValidation.validate)
+VALIDATION_CACHE_SIZE = 10000
+
+# the process level validation results cache. Results include BioSamples
+# ids checks, so they expire like BioSamples ids
+validation_result_cache = LRUCache(
+    maxsize=VALIDATION_CACHE_SIZE, ttl=BIOSAMPLE_CACHE_TTL)
+
+# keys and attributes which identify a record: they are masked when
+# comparing records content
+IDENTITY_KEYS = ['alias', 'title', 'accession']
+IDENTITY_ATTRIBUTES = ['Data source ID', 'Alternative id']
+
+
+def get_attribute_value(record, name):
+    """Get the value of an attribute from a to_biosample() dictionary"""
+
+    values = record['attributes'].get(name)
+
+    if not values:
+        return None
+
+    return values[0]['value']
+
+
 class MetaDataValidation():
-    """A class to deal with IMAGE-ValidationTool ruleset objects"""
+    """A class to deal with IMAGE-ValidationTool ruleset objects. Rulesets
+    are read through :py:data:`ruleset_cache`, unless ``use_cache`` is
+    False"""
 
     ruleset = None
 
-    def __init__(self, ruleset_filename=IMAGE_RULESET):
+    def __init__(self, ruleset_filename=IMAGE_RULESET, use_cache=True):
+        # to_biosample() dictionaries of related objects by alias (see
+        # prefetch_relationships)
+        self.related = {}
+
+        # validation results are cached only with a cached ruleset, by
+        # ruleset version
+        self.ruleset_version = None
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        if use_cache:
+            self.ruleset = ruleset_cache.get(ruleset_filename)
+            self.ruleset_version = ruleset_cache.version
+            return
+
         self.read_in_ruleset(ruleset_filename)
 
         # check validation rules
@@ -99,10 +484,7 @@ class MetaDataValidation():
             image_validation object
         """
 
-        url = f"{BIOSAMPLE_URL}/{biosample_id}"
-        response = requests.get(url)
-        status = response.status_code
-        if status != 200:
+        if not biosample_id_exists(biosample_id):
             record_result.add_validation_result_column(
                 ValidationResult.ValidationResultColumn(
                     "Warning",
@@ -113,6 +495,74 @@ class MetaDataValidation():
 
         return record_result
 
+    def prefetch_relationships(self, records):
+        """
+        Check all the BioSamples targets of relationships at once, before
+        validating records. Related objects referenced by alias are
+        serialized with one query for each model and cached until the next
+        call of this method
+
+        Args:
+            records (list): a list of Animal/Sample.to_biosample()
+                dictionary objects
+        """
+
+        biosample_ids = []
+        aliases = set()
+
+        for record in records:
+            for relationship in record.get('sampleRelationships', []):
+                if 'accession' in relationship:
+                    biosample_ids.append(relationship['accession'])
+
+                else:
+                    aliases.add(relationship['alias'])
+
+        prefetch_biosample_ids(biosample_ids)
+
+        # keep only the related objects referenced by these records
+        related = {}
+
+        # pks to serialize, by table
+        missing = defaultdict(set)
+
+        for alias in aliases:
+            if alias in self.related:
+                related[alias] = self.related[alias]
+
+            else:
+                table, pk = parse_image_alias(alias)
+                missing[table].add(pk)
+
+        for model in [Animal, Sample]:
+            if model.__name__ not in missing:
+                continue
+
+            queryset = model.objects.filter(pk__in=missing[model.__name__])
+
+            for obj, data in model.to_biosample_many(queryset):
+                related[obj.biosample_alias] = data
+
+        self.related = related
+
+    def get_related(self, alias):
+        """
+        Get the to_biosample() dictionary of a related object. Objects not
+        cached by prefetch_relationships are read from database
+
+        Args:
+            alias (str): the alias of the related object
+
+        Returns:
+            dict: the to_biosample() dictionary of the related object
+        """
+
+        if alias not in self.related:
+            material_obj = get_model_object(*parse_image_alias(alias))
+            self.related[alias] = material_obj.to_biosample()
+
+        return self.related[alias]
+
     def check_relationship(self, record, record_result):
         """
         Check relationship for an Animal/Sample record and return a list
@@ -158,13 +608,10 @@ class MetaDataValidation():
                 # where this sample comes from
                 target = relationship['alias']
 
-                # test for object existence in db. Use biosample.helpers
-                # method to derive a model object from database, then get
-                # its related data
+                # test for object existence in db, then get its related
+                # data (which could be cached by prefetch_relationships)
                 try:
-                    material_obj = get_model_object(
-                        *parse_image_alias(target))
-                    related.append(material_obj.to_biosample())
+                    related.append(self.get_related(target))
 
                 except ObjectDoesNotExist:
                     record_result.add_validation_result_column(
@@ -175,9 +622,112 @@ class MetaDataValidation():
 
         return related, record_result
 
+    def get_record_key(self, record):
+        """
+        Get a hash of record content, in which the fields which identify
+        a record are masked. Relationships by alias are replaced by the
+        related objects, since they are used in context validation
+
+        Args:
+            record (dict): An Animal/Sample.to_biosample() dictionary object
+
+        Returns:
+            str: an hash of record content
+        """
+
+        masked = {
+            key: value for key, value in record.items()
+            if key not in IDENTITY_KEYS + ['sampleRelationships']}
+
+        masked['attributes'] = dict(record['attributes'])
+
+        for name in IDENTITY_ATTRIBUTES:
+            if name in masked['attributes']:
+                masked['attributes'][name] = "masked"
+
+        relationships = []
+
+        for relationship in record.get('sampleRelationships', []):
+            relationship = dict(relationship)
+
+            if 'alias' in relationship:
+                alias = relationship.pop('alias')
+
+                try:
+                    relationship['related'] = self.get_related(alias)
+
+                except ObjectDoesNotExist:
+                    # the missing alias will be in validation messages
+                    relationship['alias'] = alias
+
+            relationships.append(relationship)
+
+        masked['sampleRelationships'] = relationships
+
+        content = json.dumps(masked, sort_keys=True, default=str)
+
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    @staticmethod
+    def get_identities(record):
+        """Return the values which identify a record (and which could be
+        in validation messages)"""
+
+        return [
+            record.get('alias'),
+            record.get('title'),
+            get_attribute_value(record, 'Data source ID')]
+
+    def copy_result(self, cached, record):
+        """
+        Copy a cached validation result for another record, replacing
+        the values which identify the cached record with the ones of
+        this record
+
+        Args:
+            cached (tuple): the identities of the cached record and its
+                validation result
+            record (dict): An Animal/Sample.to_biosample() dictionary object
+
+        Returns:
+            ValidationResult.ValidationResultRecord: an image_validation
+            object
+        """
+
+        identities, result = cached
+        result = copy.deepcopy(result)
+
+        replacements = [
+            (old, new) for old, new in zip(
+                identities, self.get_identities(record))
+            if old and new and old != new]
+
+        def replace(text):
+            for old, new in replacements:
+                text = re.sub(r'\b%s\b' % re.escape(old), new, text)
+
+            return text
+
+        # image_validation objects track record_id and messages as
+        # attributes
+        if isinstance(getattr(result, 'record_id', None), str):
+            result.record_id = replace(result.record_id)
+
+        for column in result.result_set:
+            for attr in ['record_id', 'message']:
+                value = getattr(column, attr, None)
+
+                if isinstance(value, str):
+                    setattr(column, attr, replace(value))
+
+        return result
+
     def validate(self, record):
         """
-        Check attributes for record by calling image_validation methods
+        Check attributes for record by calling image_validation methods.
+        Results are cached by record content (see :py:meth:`get_record_key`)
+        and are reused for records with the same content validated with
+        the same ruleset
 
         Args:
             record (dict): An Animal/Sample.to_biosample() dictionary object
@@ -187,6 +737,29 @@ class MetaDataValidation():
             object
         """
 
+        key = None
+
+        if self.ruleset_version is not None:
+            key = (self.ruleset_version, self.get_record_key(record))
+            cached = validation_result_cache.get(key)
+
+            if cached is not None:
+                self.cache_hits += 1
+                return self.copy_result(cached, record)
+
+            self.cache_misses += 1
+
+        result = self.__validate(record)
+
+        if key is not None:
+            validation_result_cache.set(
+                key, (self.get_identities(record), copy.deepcopy(result)))
+
+        return result
+
+    def __validate(self, record):
+        """Validate a record without using cache"""
+
         # this validated in general way
         result = self.ruleset.validate(record)
 
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 26 15:12:41 2020
+
+@author: Paolo Cozzi <cozzi@ibba.cnr.it>
+
+Generate a synthetic submission and time ValidateSubmission while
+validating its records
+
+"""
+
+import time
+import tracemalloc
+
+from unittest.mock import Mock, patch
+
+from image_validation.ValidationResult import ValidationResultRecord
+
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import connection, transaction
+from django.db.backends.base.creation import TEST_DATABASE_PREFIX
+from django.test.utils import (
+    CaptureQueriesContext, setup_databases, teardown_databases)
+from django.utils import timezone
+
+from uid.models import Animal, Person, Sample, Submission
+from validation.helpers import (
+    MetaDataValidation, ruleset_cache, biosample_id_cache,
+    validation_result_cache)
+from validation.tasks import ValidateSubmission
+
+# the fixtures used to create the synthetic submission. Animals and
+# samples are copied from the ones defined in fixtures
+FIXTURES = [
+    'uid/dictbreed',
+    'uid/dictcountry',
+    'uid/dictrole',
+    'uid/dictsex',
+    'uid/dictspecie',
+    'uid/dictstage',
+    'uid/dictuberon',
+    'uid/organization',
+    'uid/publication',
+    'uid/submission',
+    'uid/user',
+    'uid/animal',
+    'uid/sample',
+]
+
+# DictSex primary keys, as defined in fixtures
+MALE, FEMALE = 1, 2
+
+
+class StubRuleset():
+    """A ruleset which pass every record (replaces the IMAGE ruleset, which
+    need to be read from EBI)"""
+
+    def validate(self, record):
+        return ValidationResultRecord(record['title'])
+
+
+class StubBioSamples():
+    """A BioSamples session which find every biosample id, after waiting
+    latency seconds"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.requests = 0
+
+    def get(self, url, **kwargs):
+        self.requests += 1
+        time.sleep(self.latency)
+
+        response = Mock()
+        response.status_code = 200
+
+        return response
+
+
+def get_values(obj):
+    """Return the field values of a model object, without primary key"""
+
+    return {
+        field.attname: getattr(obj, field.attname)
+        for field in obj._meta.concrete_fields if not field.primary_key}
+
+
+def create_submission(n_animals, n_samples, depth, fanout, accessions):
+    """
+    Create a submission with a pedigree of n_animals animals, split in
+    depth+1 generations. Each couple of animals has fanout children in the
+    next generation. Founders have a biosample id with an accessions
+    frequency
+
+    Args:
+        n_animals (int): the number of animals
+        n_samples (int): the number of samples for each animal
+        depth (int): the number of generations after founders
+        fanout (int): the number of children of each couple
+        accessions (float): the frequency of founders with a biosample id
+
+    Returns:
+        uid.models.Submission: the synthetic submission
+    """
+
+    # a new submission like the one in fixtures
+    submission = Submission.objects.get(pk=1)
+    submission.pk = None
+    submission.datasource_version = "benchmark %s" % (timezone.now())
+    submission.save()
+
+    animal_values = get_values(Animal.objects.get(pk=1))
+    sample_values = get_values(Sample.objects.get(pk=1))
+
+    # split animals by generations. Founders get the remaining animals
+    size = n_animals // (depth + 1)
+    sizes = [n_animals - size * depth] + [size] * depth
+
+    parents = []
+    count = 0
+
+    for generation, size in enumerate(sizes):
+        animals = []
+
+        for i in range(size):
+            animal = Animal(**animal_values)
+            animal.submission = submission
+            animal.name = "animal_%s" % (count)
+            animal.alternative_id = str(count)
+            animal.sex_id = MALE if i % 2 == 0 else FEMALE
+            animal.father, animal.mother = None, None
+            animal.biosample_id = None
+
+            if generation == 0:
+                # every 1/accessions founders has a biosample id
+                if accessions and count % round(1 / accessions) == 0:
+                    animal.biosample_id = "SAMEA%07d" % (count)
+
+            elif parents:
+                # fanout children for each couple of the previous generation
+                couple = (i // fanout) % len(parents)
+                animal.father, animal.mother = parents[couple]
+
+            animals.append(animal)
+            count += 1
+
+        animals = Animal.objects.bulk_create(animals)
+
+        # couples for the next generation
+        parents = list(zip(animals[0::2], animals[1::2]))
+
+    samples = []
+
+    for animal in Animal.objects.filter(submission=submission):
+        for i in range(n_samples):
+            sample = Sample(**sample_values)
+            sample.submission = submission
+            sample.animal = animal
+            sample.name = "sample_%s_%s" % (animal.alternative_id, i)
+            sample.alternative_id = sample.name
+            sample.biosample_id = None
+            samples.append(sample)
+
+    Sample.objects.bulk_create(samples)
+
+    return submission
+
+
+class Command(BaseCommand):
+    help = """
+    Generate a synthetic submission in a test database and time
+    ValidateSubmission while validating its records. The IMAGE ruleset and
+    BioSamples are replaced by stub objects
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--animals',
+            type=int,
+            default=5000,
+            help='The number of animals in submission')
+
+        parser.add_argument(
+            '--samples',
+            type=int,
+            default=1,
+            help='The number of samples for each animal')
+
+        parser.add_argument(
+            '--depth',
+            type=int,
+            default=3,
+            help='The number of generations after founders')
+
+        parser.add_argument(
+            '--fanout',
+            type=int,
+            default=2,
+            help='The number of children of each couple')
+
+        parser.add_argument(
+            '--accessions',
+            type=float,
+            default=0.5,
+            help='The frequency of founders with a biosample id')
+
+        parser.add_argument(
+            '--latency',
+            type=float,
+            default=0.0,
+            help='The time (in seconds) of each BioSamples request')
+
+        parser.add_argument(
+            '--no-validation-cache',
+            action='store_true',
+            help="Don't use cached validation results")
+
+        parser.add_argument(
+            '--keepdb',
+            action='store_true',
+            help="Preserve the test database between runs")
+
+        parser.add_argument(
+            '--no-testdb',
+            action='store_true',
+            help=(
+                "Use the current database, which need to be a test "
+                "database (data are removed at the end of benchmark)"))
+
+    def timeit(self, label, function, *args):
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            result = function(*args)
+            elapsed = time.perf_counter() - start
+
+        queries = len(context.captured_queries)
+
+        self.stdout.write("%s: %.3f s, %s queries" % (
+            label, elapsed, queries))
+
+        # django doesn't track more than queries_limit queries
+        if queries >= connection.queries_limit:
+            self.stderr.write(
+                "Can't track more than %s queries: query counts are "
+                "wrong" % (connection.queries_limit))
+
+        return result, elapsed, queries
+
+    def handle(self, *args, **options):
+        old_config = None
+
+        if options['no_testdb']:
+            # fixtures have fixed primary keys: don't load them in a real
+            # database
+            name = connection.settings_dict['NAME']
+
+            if not name.startswith(TEST_DATABASE_PREFIX):
+                raise CommandError(
+                    "%s is not a test database: can't run benchmark with "
+                    "--no-testdb" % (name))
+
+        else:
+            old_config = setup_databases(
+                verbosity=0, interactive=False, keepdb=options['keepdb'])
+
+        try:
+            # nothing will be written in database
+            with transaction.atomic():
+                self.benchmark(options)
+                transaction.set_rollback(True)
+
+        finally:
+            if old_config is not None:
+                teardown_databases(
+                    old_config, verbosity=0, keepdb=options['keepdb'])
+
+    def benchmark(self, options):
+        call_command('loaddata', *FIXTURES, verbosity=0)
+
+        # person is required by to_biosample()
+        person = Person.objects.get(user__username="test")
+        person.affiliation_id = 1
+        person.role_id = 1
+        person.initials = "T"
+        person.save()
+
+        self.stdout.write(
+            "Creating a submission with %s animals and %s samples" % (
+                options['animals'], options['animals'] * options['samples']))
+
+        submission, _, _ = self.timeit(
+            "create_submission",
+            create_submission,
+            options['animals'],
+            options['samples'],
+            options['depth'],
+            options['fanout'],
+            options['accessions'])
+
+        # don't use objects cached by other runs
+        ruleset_cache.clear()
+        biosample_id_cache.clear()
+        validation_result_cache.clear()
+
+        session = StubBioSamples(options['latency'])
+        read_in_ruleset = "validation.helpers.validation.read_in_ruleset"
+        check_ruleset = "validation.helpers.validation.check_ruleset"
+        get_session = "validation.helpers.get_biosample_session"
+
+        with patch(read_in_ruleset, return_value=StubRuleset()), \
+                patch(check_ruleset, return_value=ValidationResultRecord(
+                    "ruleset")), \
+                patch(get_session, return_value=session):
+
+            tracemalloc.start()
+
+            ruleset = MetaDataValidation()
+
+            if options['no_validation_cache']:
+                ruleset.ruleset_version = None
+
+            validate_submission = ValidateSubmission(submission, ruleset)
+
+            elapsed, queries = 0, 0
+
+            for model in [Animal, Sample]:
+                queryset = model.objects.filter(
+                    submission=submission).order_by('id')
+
+                _, model_elapsed, model_queries = self.timeit(
+                    "validate_models(%s)" % (model._meta.model_name),
+                    validate_submission.validate_models,
+                    model.to_biosample_many(queryset))
+
+                elapsed += model_elapsed
+                queries += model_queries
+
+            _, summary_elapsed, summary_queries = self.timeit(
+                "create_validation_summary",
+                validate_submission.create_validation_summary)
+
+            elapsed += summary_elapsed
+            queries += summary_queries
+
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        n_of_records = (
+            validate_submission.animals_statuses['Known'] +
+            validate_submission.samples_statuses['Known'])
+
+        self.stdout.write("Validated records: %s" % (n_of_records))
+        self.stdout.write(
+            "Records/s: %.1f" % (n_of_records / elapsed))
+        self.stdout.write(
+            "Queries per record: %.2f" % (queries / n_of_records))
+        self.stdout.write(
+            "BioSamples requests: %s" % (session.requests))
+        self.stdout.write(
+            "Validation cache: %s hits, %s misses" % (
+                ruleset.cache_hits, ruleset.cache_misses))
+        self.stdout.write("Peak memory: %.1f MB" % (peak / 1024 ** 2))
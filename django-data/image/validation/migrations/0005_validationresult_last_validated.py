@@ -0,0 +1,18 @@
+# Generated by Django 2.2.24 on 2020-10-15 10:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('validation', '0004_auto_20200225_1654'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='validationresult',
+            name='last_validated',
+            field=models.DateTimeField(auto_now=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.24 on 2020-10-19 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('validation', '0005_validationresult_last_validated'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='validationresult',
+            name='last_validated',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.24 on 2020-10-19 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('validation', '0006_auto_20201019_1012'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='validationresult',
+            name='payload_bytes',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
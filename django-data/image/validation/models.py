@@ -6,7 +6,10 @@ Created on Mon Jan 28 11:09:02 2019
 @author: Paolo Cozzi <cozzi@ibba.cnr.it>
 """
 
+from collections import Counter, OrderedDict
+
 from django.db import models
+from django.db.models import Count, F, Func
 from django.contrib.postgres.fields import ArrayField, JSONField
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
@@ -45,6 +48,17 @@ class ValidationResult(models.Model):
         blank=True
     )
 
+    # used to determine which objects changed after validation. Set by
+    # validation tasks (other updates, like messages pruning, don't count)
+    last_validated = models.DateTimeField(
+        null=True)
+
+    # the size of validated data, used to split submissions (see
+    # biosample.tasks.submission.SplitSubmissionHelper)
+    payload_bytes = models.PositiveIntegerField(
+        null=True,
+        blank=True)
+
     class Meta:
         unique_together = ('content_type', 'object_id')
 
@@ -100,22 +114,133 @@ class ValidationSummary(models.Model):
 
         return self.all_count - self.validation_known_count
 
-    def reset_all_count(self):
-        """Set all_count column according to Animal/Sample objects"""
+    def get_model(self):
+        """Return the Animal/Sample class of this summary"""
 
         if self.type == "animal":
-            self.all_count = Animal.objects.filter(
-                submission=self.submission).count()
+            return Animal
 
         elif self.type == "sample":
-            self.all_count = Sample.objects.filter(
-                submission=self.submission).count()
+            return Sample
 
         else:
             raise Exception("Unknown type '%s'" % (self.type))
 
+    def reset_all_count(self):
+        """Set all_count column according to Animal/Sample objects"""
+
+        self.all_count = self.get_model().objects.filter(
+            submission=self.submission).count()
+
         self.save()
 
+    def get_validationresults(self):
+        """Return the validation results of Animal/Sample objects"""
+
+        return ValidationResult.objects.filter(
+            submission=self.submission,
+            content_type=ContentType.objects.get_for_model(
+                self.get_model()))
+
+    def update_counts(self):
+        """Set validation counters relying on validation results (with a
+        single query). Need to call save() to store counters"""
+
+        counts = Counter(dict(
+            self.get_validationresults().filter(
+                status__isnull=False).values_list('status').annotate(
+                    count=Count('id')).order_by()))
+
+        self.pass_count = counts['Pass']
+        self.warning_count = counts['Warning']
+        self.error_count = counts['Error']
+        self.validation_known_count = sum(counts.values())
+
+        # issues are all the validation results which don't pass
+        self.issues_count = (
+            self.validation_known_count - self.pass_count -
+            self.warning_count)
+
+    def get_result_messages(self, status=None):
+        """
+        Get messages from validation results (with a single query), for
+        example::
+
+            [{
+                'message': 'message1',
+                'count': 1,
+                'ids': [1],
+                'offending_column': ''
+            }]
+
+        No offending column since is not always possible to determine a
+        column from validation results messages
+
+        Args:
+            status (str): consider only validation results with this status
+
+        Returns:
+            list: a list of messages
+        """
+
+        queryset = self.get_validationresults()
+
+        if status:
+            queryset = queryset.filter(status=status)
+
+        # one row for each message of each validation result
+        queryset = queryset.annotate(
+            message=Func(
+                F('messages'),
+                function='unnest',
+                output_field=models.TextField())
+        ).values_list('message', 'object_id').order_by('object_id')
+
+        messages_ids = OrderedDict()
+
+        for message, object_id in queryset:
+            messages_ids.setdefault(message, []).append(object_id)
+
+        return [{
+            'message': message,
+            'count': len(ids),
+            'ids': ids,
+            'offending_column': ''} for message, ids in messages_ids.items()]
+
+    def prune_messages(self):
+        """Remove deleted Animal/Sample objects from messages. Need to call
+        save() to store messages"""
+
+        ids = set(self.get_model().objects.filter(
+            submission=self.submission).values_list('id', flat=True))
+
+        messages = []
+
+        for message in self.messages:
+            # can't determine objects without ids
+            if 'ids' not in message:
+                messages.append(message)
+                continue
+
+            message_ids = [id_ for id_ in message['ids'] if id_ in ids]
+
+            if message_ids:
+                message['ids'] = message_ids
+                message['count'] = len(message_ids)
+                messages.append(message)
+
+        self.messages = messages
+
+    def recompute(self):
+        """Update counters and messages relying on database, for example
+        after deleting Animal/Sample objects"""
+
+        self.update_counts()
+        self.prune_messages()
+
+        # this will save object
+        self.reset_all_count()
+
     def reset(self):
         """Sets all counts and other counters to 0"""
 
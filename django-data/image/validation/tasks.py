@@ -13,12 +13,19 @@ import json
 import traceback
 
 from collections import Counter, defaultdict
+from celery import chord
+from celery.signals import worker_init
 from celery.utils.log import get_task_logger
 
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Q, F, Count
+from django.utils import timezone
+
 from common.constants import (
     READY, ERROR, LOADED, NEED_REVISION, COMPLETED, SUBMITTED, STATUSES,
     KNOWN_STATUSES)
-from common.helpers import send_mail_to_admins
+from common.helpers import send_mail_to_admins, chunks, get_payload_size
 from common.tasks import BaseTask, NotifyAdminTaskMixin
 from image.celery import app as celery_app
 from uid.models import Sample, Animal
@@ -26,7 +33,8 @@ from submissions.tasks import SubmissionTaskMixin
 from validation.models import ValidationSummary
 
 from .models import ValidationResult as ValidationResultModel
-from .helpers import MetaDataValidation, OntologyCacheError, RulesetError
+from .helpers import (
+    MetaDataValidation, OntologyCacheError, RulesetError, ruleset_cache)
 
 # Get an instance of a logger
 logger = get_task_logger(__name__)
@@ -34,25 +42,83 @@ logger = get_task_logger(__name__)
 # get a dictionary from status name (ie {0: 'Waiting'})
 key2status = dict([x.value for x in STATUSES])
 
+# submissions with more records than this are validated in chunks of this
+# size by different tasks
+VALIDATION_CHUNK_SIZE = 1000
+
+# validation results and statuses are written to database every
+# VALIDATION_BATCH_SIZE records
+VALIDATION_BATCH_SIZE = 500
+
 
 # A class to deal with validation errors
 class ValidationError(Exception):
     pass
 
 
+def get_changed_records(submission_obj):
+    """
+    Get the animals and samples which need to be validated again: records
+    changed after their last validation (or never validated), the children
+    and the samples of changed animals (which are validated relying on them)
+
+    Args:
+        submission_obj (uid.models.Submission): an UID submission object
+
+    Returns:
+        tuple: a set of animal ids and a set of sample ids
+    """
+
+    changed = (
+        Q(validationresults__isnull=True) |
+        Q(validationresults__last_validated__isnull=True) |
+        Q(last_changed__gt=F('validationresults__last_validated')))
+
+    animal_ids = set(
+        Animal.objects.filter(submission=submission_obj).filter(
+            changed).values_list('id', flat=True))
+
+    sample_ids = set(
+        Sample.objects.filter(submission=submission_obj).filter(
+            changed).values_list('id', flat=True))
+
+    if animal_ids:
+        sample_ids.update(
+            Sample.objects.filter(
+                submission=submission_obj,
+                animal__in=animal_ids).values_list('id', flat=True))
+
+        animal_ids.update(
+            Animal.objects.filter(submission=submission_obj).filter(
+                Q(father__in=animal_ids) | Q(mother__in=animal_ids)
+            ).values_list('id', flat=True))
+
+    return animal_ids, sample_ids
+
+
 class ValidateSubmission(object):
     """
     An helper class for submission task, useful to pass parameters like
     submission data between tasks"""
 
     # define my class attributes
-    def __init__(self, submission_obj, ruleset):
+    def __init__(self, submission_obj, ruleset,
+                 batch_size=VALIDATION_BATCH_SIZE):
         # track submission object
         self.submission_obj = submission_obj
 
         # track ruleset
         self.ruleset = ruleset
 
+        # validation results and models to be written (see flush)
+        self.batch_size = batch_size
+        self.pending_results = []
+        self.pending_models = defaultdict(dict)
+
+        # the size of validated data by (model class, pk). Tracked in
+        # validation results to split submissions
+        self.payload_sizes = {}
+
         # collect all unique messages for samples and animals
         self.animals_messages = defaultdict(list)
         self.samples_messages = defaultdict(list)
@@ -104,7 +170,50 @@ class ValidateSubmission(object):
 
         return self.__has_key_in_rules('Warning')
 
-    def validate_model(self, model):
+    def get_results(self):
+        """Return validation counters and messages as a JSON serializable
+        dictionary, in order to be merged with other results"""
+
+        return {
+            'animals_statuses': dict(self.animals_statuses),
+            'samples_statuses': dict(self.samples_statuses),
+            'animals_messages': dict(self.animals_messages),
+            'samples_messages': dict(self.samples_messages),
+            'animals_offending_columns': self.animals_offending_columns,
+            'samples_offending_columns': self.samples_offending_columns,
+        }
+
+    def merge_results(self, results):
+        """Merge results from another validation (see
+        :py:meth:`get_results`)
+
+        Args:
+            results (dict): a dictionary returned by get_results
+        """
+
+        self.animals_statuses.update(results['animals_statuses'])
+        self.samples_statuses.update(results['samples_statuses'])
+
+        for message, ids in results['animals_messages'].items():
+            self.animals_messages[message] += ids
+
+        for message, ids in results['samples_messages'].items():
+            self.samples_messages[message] += ids
+
+        self.animals_offending_columns.update(
+            results['animals_offending_columns'])
+        self.samples_offending_columns.update(
+            results['samples_offending_columns'])
+
+    def validate_model(self, model, data=None):
+        """Validate an animal or a sample
+
+        Args:
+            model (Sample/Animal): a Sample or Animal object
+            data (dict): the to_biosample() dictionary of model (if already
+                computed, see BioSampleMixin.to_biosample_many)
+        """
+
         logger.debug("Validating %s" % (model))
 
         # thsi could be animal or sample
@@ -115,7 +224,10 @@ class ValidateSubmission(object):
             model_statuses = self.animals_statuses
 
         # get data in biosample format
-        data = model.to_biosample()
+        if data is None:
+            data = model.to_biosample()
+
+        self.payload_sizes[(type(model), model.pk)] = get_payload_size(data)
 
         # TODO: remove this when IMAGE-metadata rules will support
         # IMAGE submission id
@@ -142,6 +254,38 @@ class ValidateSubmission(object):
         # update status and track data in a overall variable
         self.update_statuses(model_statuses, model, ruleset_result)
 
+    def validate_models(self, items):
+        """Validate many animals or samples. Records are validated in
+        chunks: relationships of each chunk are checked all at once before
+        validating records
+
+        Args:
+            items (iterable): (model, data) tuples, as returned by
+                BioSampleMixin.to_biosample_many
+        """
+
+        for chunk in chunks(items, VALIDATION_CHUNK_SIZE):
+            self.ruleset.prefetch_relationships([data for _, data in chunk])
+
+            for model, data in chunk:
+                self.validate_model(model, data)
+
+        # write the remaining results
+        self.flush()
+
+    def log_cache_stats(self):
+        """Log how many records were validated using validation cache"""
+
+        hits = self.ruleset.cache_hits
+        total = hits + self.ruleset.cache_misses
+
+        if total == 0:
+            return
+
+        logger.info(
+            "Validation cache for %s: %s hits on %s records (%.1f%%)" % (
+                self.submission_obj, hits, total, hits / total * 100))
+
     # inspired from validation.deal_with_validation_results
     def update_statuses(self, model_statuses, model, result):
         """
@@ -200,18 +344,8 @@ class ValidateSubmission(object):
                 self.animals_offending_columns[message['message']] = \
                     message['offending_column']
 
-        # get a validation result model or create a new one
-        if model.validationresult:
-            validationresult = model.validationresult
-
-        else:
-            validationresult = ValidationResultModel()
-            model.validationresult = validationresult
-
-        # setting valdiationtool results and save
-        validationresult.messages = messages
-        validationresult.status = overall_status
-        validationresult.save()
+        # track validationtool results. Will be written with flush
+        self.pending_results.append((model, messages, overall_status))
 
         # ok, don't update statuses for submitted objects which
         # already are in biosamples and pass validation
@@ -225,9 +359,157 @@ class ValidateSubmission(object):
                 "Marking %s with '%s' status (%s)" % (
                     model, key2status[status], messages))
 
-            # update model status and save
+            # update model status. Will be saved with flush
             model.status = status
-            model.save()
+            self.pending_models[type(model)][model.pk] = model
+
+        if len(self.pending_results) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write validation results and model statuses collected by
+        mark_model in database"""
+
+        if not self.pending_results:
+            return
+
+        logger.debug(
+            "Writing %s validation results" % (len(self.pending_results)))
+
+        # results by model class
+        results = defaultdict(list)
+
+        for model, messages, overall_status in self.pending_results:
+            results[type(model)].append((model, messages, overall_status))
+
+        with transaction.atomic():
+            for model_class, items in results.items():
+                self.save_validationresults(model_class, items)
+
+            for model_class, models in self.pending_models.items():
+                model_class.objects.bulk_update(models.values(), ['status'])
+
+        self.pending_results = []
+        self.pending_models = defaultdict(dict)
+
+    def save_validationresults(self, model_class, items):
+        """Update or create validation results for objects of the same
+        class
+
+        Args:
+            model_class (class): Animal or Sample class
+            items (list): (model, messages, status) tuples
+        """
+
+        content_type = ContentType.objects.get_for_model(model_class)
+        now = timezone.now()
+
+        # get existing validation results
+        validationresults = {
+            validationresult.object_id: validationresult
+            for validationresult in ValidationResultModel.objects.filter(
+                content_type=content_type,
+                object_id__in=[model.pk for model, _, _ in items])}
+
+        for model, messages, overall_status in items:
+            validationresult = validationresults.get(model.pk)
+
+            if validationresult is None:
+                validationresult = ValidationResultModel(
+                    submission_id=model.submission_id,
+                    content_type=content_type,
+                    object_id=model.pk)
+                validationresults[model.pk] = validationresult
+
+            # setting valdiationtool results
+            validationresult.messages = messages
+            validationresult.status = overall_status
+            validationresult.last_validated = now
+            validationresult.payload_bytes = self.payload_sizes.pop(
+                (model_class, model.pk), None)
+
+        # create missing objects and update the others
+        to_create = [
+            obj for obj in validationresults.values() if obj.pk is None]
+        to_update = [
+            obj for obj in validationresults.values() if obj.pk is not None]
+
+        ValidationResultModel.objects.bulk_update(
+            to_update,
+            ['messages', 'status', 'last_validated', 'payload_bytes'])
+        ValidationResultModel.objects.bulk_create(to_create)
+
+    def get_previous_results(self, animal_ids, sample_ids):
+        """
+        Get the validation results of the records which will not be
+        validated again, in order to be merged with the results of the
+        changed records (see :py:meth:`merge_results`). Statuses are read
+        from validation results, messages from validation summaries
+
+        Args:
+            animal_ids (list): the animals which will be validated again
+            sample_ids (list): the samples which will be validated again
+
+        Returns:
+            dict: a dictionary like the one returned by :py:meth:`get_results`
+            or None if submission has no validation summary
+        """
+
+        results = {}
+
+        for model_type, model, ids in [
+                ('animal', Animal, animal_ids),
+                ('sample', Sample, sample_ids)]:
+
+            try:
+                summary_obj = ValidationSummary.objects.get(
+                    submission=self.submission_obj, type=model_type)
+
+            except ValidationSummary.DoesNotExist:
+                return None
+
+            unchanged = model.objects.filter(
+                submission=self.submission_obj).exclude(id__in=ids)
+            unchanged_ids = set(unchanged.values_list('id', flat=True))
+
+            # count validation results by status
+            statuses = Counter()
+
+            queryset = ValidationResultModel.objects.filter(
+                content_type=ContentType.objects.get_for_model(model),
+                object_id__in=unchanged.values('id'),
+                status__isnull=False).values_list('status').annotate(
+                    count=Count('id')).order_by()
+
+            for status, count in queryset:
+                statuses[status] += count
+                statuses['Known'] += count
+
+                if status not in ["Pass", "Warning"]:
+                    statuses['Issues'] += count
+
+            # a summary which was reset has lost its messages
+            if statuses['Known'] and not summary_obj.validation_known_count:
+                return None
+
+            # remove changed (or deleted) records from messages
+            messages, offending_columns = {}, {}
+
+            for message in summary_obj.messages:
+                ids = [
+                    id_ for id_ in message.get('ids', [])
+                    if id_ in unchanged_ids]
+
+                if ids:
+                    messages[message['message']] = ids
+                    offending_columns[message['message']] = \
+                        message['offending_column']
+
+            results[model_type + 's_statuses'] = dict(statuses)
+            results[model_type + 's_messages'] = messages
+            results[model_type + 's_offending_columns'] = offending_columns
+
+        return results
 
     def create_validation_summary(self):
         """
@@ -320,7 +602,8 @@ class ValidateTask(SubmissionTaskMixin, NotifyAdminTaskMixin, BaseTask):
             submission_obj, status, message, construct_message)
 
     def __generic_error_report(
-            self, submission_obj, status, message, notify_admins=False):
+            self, submission_obj, status, message, notify_admins=False,
+            einfo=None):
         """
         Generic report for updating submission objects and send email after
         an exception is called
@@ -331,6 +614,8 @@ class ValidateTask(SubmissionTaskMixin, NotifyAdminTaskMixin, BaseTask):
             status (int): a :py:class:`common.constants.STATUSES` object
             message (str): a text object
             notify_admins (bool): send mail to the admins or not
+            einfo (str): the formatted stacktrace. If not provided, is
+                read from the exception being handled
         """
 
         # mark submission with its status
@@ -341,7 +626,8 @@ class ValidateTask(SubmissionTaskMixin, NotifyAdminTaskMixin, BaseTask):
         )
 
         # get exception info
-        einfo = traceback.format_exc()
+        if einfo is None:
+            einfo = traceback.format_exc()
 
         # send a mail to the user with the stacktrace (einfo)
         email_subject = "Error in IMAGE Validation: %s" % (message)
@@ -359,7 +645,7 @@ class ValidateTask(SubmissionTaskMixin, NotifyAdminTaskMixin, BaseTask):
     # TODO: define a method to inform user for error in validation (Task run
     # with success but errors in data)
 
-    def temporary_error_report(self, exc, submission_obj):
+    def temporary_error_report(self, exc, submission_obj, einfo=None):
         """
         Deal with known issues in validation task. Notify the user using
         email and set status as READY in order to recall this task
@@ -368,6 +654,8 @@ class ValidateTask(SubmissionTaskMixin, NotifyAdminTaskMixin, BaseTask):
             exc (Exception): an py:exc`Exception` object
             submission_obj (uid.models.Submission): an UID submission
             object
+            einfo (str): the formatted stacktrace of exc (if not raised
+                by this task)
 
         Return
             str: "success" since this task is correctly managed
@@ -379,11 +667,12 @@ class ValidateTask(SubmissionTaskMixin, NotifyAdminTaskMixin, BaseTask):
         logger.error(message)
 
         # call generic report which update submission and send email
-        self.__generic_error_report(submission_obj, LOADED, message)
+        self.__generic_error_report(
+            submission_obj, LOADED, message, einfo=einfo)
 
         return "success"
 
-    def ruleset_error_report(self, exc, submission_obj):
+    def ruleset_error_report(self, exc, submission_obj, einfo=None):
         """
         Deal with ruleset issue in validation task. Notify the user using
         email and set status as ERROR, since he can't do anything without
@@ -393,6 +682,8 @@ class ValidateTask(SubmissionTaskMixin, NotifyAdminTaskMixin, BaseTask):
             exc (Exception): an py:exc`Exception` object
             submission_obj (uid.models.Submission): an UID submission
             object
+            einfo (str): the formatted stacktrace of exc (if not raised
+                by this task)
 
         Return
             str: "success" since this task is correctly managed
@@ -406,12 +697,21 @@ class ValidateTask(SubmissionTaskMixin, NotifyAdminTaskMixin, BaseTask):
 
         # call generic report which update submission and send email
         self.__generic_error_report(
-            submission_obj, ERROR, message, notify_admins=True)
+            submission_obj, ERROR, message, notify_admins=True, einfo=einfo)
 
         return "success"
 
-    def run(self, submission_id):
-        """a function to perform validation steps"""
+    def run(self, submission_id, incremental=False):
+        """a function to perform validation steps
+
+        Args:
+            submission_id (int): the submission to validate
+            incremental (bool): validate only the records changed after
+                the last validation (see :py:func:`get_changed_records`).
+                Records are selected relying on ``last_changed``: data
+                reloaded from a datasource, changes in submission or owner
+                attributes and a new ruleset are not detected
+        """
 
         logger.info("Validate Submission started")
 
@@ -432,14 +732,38 @@ class ValidateTask(SubmissionTaskMixin, NotifyAdminTaskMixin, BaseTask):
         # get a submission data helper instance
         validate_submission = ValidateSubmission(submission_obj, self.ruleset)
 
+        animal_qs = Animal.objects.filter(submission=submission_obj)
+        sample_qs = Sample.objects.filter(submission=submission_obj)
+
+        # the results of the records which are not validated again
+        previous_results = None
+
+        if incremental:
+            animal_ids, sample_ids = get_changed_records(submission_obj)
+            previous_results = validate_submission.get_previous_results(
+                animal_ids, sample_ids)
+
+        if previous_results is not None:
+            logger.info(
+                "Validating %s animals and %s samples changed in %s" % (
+                    len(animal_ids), len(sample_ids), submission_obj))
+
+            animal_qs = animal_qs.filter(id__in=animal_ids)
+            sample_qs = sample_qs.filter(id__in=sample_ids)
+
+        # big submissions are validated in chunks by different tasks
+        n_of_records = animal_qs.count() + sample_qs.count()
+
+        if n_of_records > VALIDATION_CHUNK_SIZE:
+            return self.validate_in_chunks(
+                submission_obj, animal_qs, sample_qs, previous_results)
+
         try:
-            for animal in Animal.objects.filter(
-                    submission=submission_obj).order_by('id'):
-                validate_submission.validate_model(animal)
+            validate_submission.validate_models(
+                Animal.to_biosample_many(animal_qs.order_by('id')))
 
-            for sample in Sample.objects.filter(
-                    submission=submission_obj).order_by('id'):
-                validate_submission.validate_model(sample)
+            validate_submission.validate_models(
+                Sample.to_biosample_many(sample_qs.order_by('id')))
 
         # TODO: errors in validation should raise custom exception
         except json.decoder.JSONDecodeError as exc:
@@ -448,6 +772,85 @@ class ValidateTask(SubmissionTaskMixin, NotifyAdminTaskMixin, BaseTask):
         except Exception as exc:
             raise self.retry(exc=exc)
 
+        validate_submission.log_cache_stats()
+
+        if previous_results is not None:
+            validate_submission.merge_results(previous_results)
+
+        return self.complete_validation(submission_obj, validate_submission)
+
+    def validate_in_chunks(
+            self, submission_obj, animal_qs, sample_qs,
+            previous_results=None):
+        """Validate submission data using a chord of
+        :py:class:`ValidateChunkTask`: each task validate a range of
+        animals or samples. Results are merged by
+        :py:class:`ValidateCompleteTask`
+
+        Args:
+            submission_obj (uid.models.Submission): an UID submission
+            object
+            animal_qs (QuerySet): the animals to validate
+            sample_qs (QuerySet): the samples to validate
+            previous_results (dict): the results of the records which are
+                not validated again (only changed records are validated).
+                They are read again by :py:class:`ValidateCompleteTask`
+
+        Return
+            str: "success" since validation is now managed by chord
+        """
+
+        validate_chunk = ValidateChunkTask()
+        header = []
+
+        for model_type, queryset in [
+                ('animal', animal_qs), ('sample', sample_qs)]:
+            ids = queryset.order_by('id').values_list('id', flat=True)
+
+            # each task validate a range of ids. When validating changed
+            # records, ids are passed explicitly
+            for chunk in chunks(ids.iterator(), VALIDATION_CHUNK_SIZE):
+                kwargs = {}
+
+                if previous_results is not None:
+                    kwargs['ids'] = chunk
+
+                header.append(validate_chunk.s(
+                    submission_obj.id, model_type, chunk[0], chunk[-1],
+                    **kwargs))
+
+        # assign kwargs to chord
+        validate_complete = ValidateCompleteTask()
+        callback = validate_complete.s(
+            uid_submission_id=submission_obj.id,
+            incremental=previous_results is not None)
+
+        logger.debug("Preparing chord for %s tasks" % len(header))
+
+        # call chord task. Chord will be called only after all tasks
+        res = chord(header)(callback)
+
+        logger.info(
+            "Start validation chord process for %s with task %s" % (
+                submission_obj,
+                res.task_id))
+
+        return "success"
+
+    def complete_validation(self, submission_obj, validate_submission):
+        """Create validation summary and set submission status relying on
+        validation results
+
+        Args:
+            submission_obj (uid.models.Submission): an UID submission
+            object
+            validate_submission (ValidateSubmission): a ValidateSubmission
+                object with validation results
+
+        Return
+            str: "success" if validation completes
+        """
+
         # if error messages changes in IMAGE-ValidationTool, all this
         # stuff isn't valid and I throw an exception
 
@@ -527,6 +930,162 @@ class ValidateTask(SubmissionTaskMixin, NotifyAdminTaskMixin, BaseTask):
         self.update_submission_status(submission_obj, READY, message)
 
 
+class ValidateChunkTask(ValidateTask):
+    name = "Validate Submission Chunk"
+    description = """Validate a range of submission data against IMAGE
+    rules"""
+
+    def run(self, submission_id, model_type, first_id, last_id, ids=None):
+        """Validate animals or samples of a submission with ids between
+        first_id and last_id
+
+        Args:
+            submission_id (int): the UID submission id
+            model_type (str): 'animal' or 'sample'
+            first_id (int): the first object id to validate
+            last_id (int): the last object id to validate
+            ids (list): validate only those ids in range (if provided)
+
+        Returns:
+            dict: a dictionary with a status ('success', 'temporary_error'
+            or 'ruleset_error'), a message and the validation results
+            (see :py:meth:`ValidateSubmission.get_results`). Errors have
+            the formatted stacktrace, while results have the model type and
+            the validated ids (if provided)
+        """
+
+        logger.info(
+            "Validate %s %s-%s for submission %s" % (
+                model_type, first_id, last_id, submission_id))
+
+        submission_obj = self.get_uid_submission(submission_id)
+
+        # errors are reported once by ValidateCompleteTask
+        try:
+            ruleset = MetaDataValidation()
+
+        except OntologyCacheError as exc:
+            return {
+                'status': 'temporary_error',
+                'message': str(exc),
+                'traceback': traceback.format_exc()}
+
+        except RulesetError as exc:
+            return {
+                'status': 'ruleset_error',
+                'message': str(exc),
+                'traceback': traceback.format_exc()}
+
+        validate_submission = ValidateSubmission(submission_obj, ruleset)
+
+        model = Animal if model_type == 'animal' else Sample
+
+        try:
+            queryset = model.objects.filter(
+                submission=submission_obj,
+                id__gte=first_id,
+                id__lte=last_id).order_by('id')
+
+            if ids is not None:
+                queryset = queryset.filter(id__in=ids)
+
+            validate_submission.validate_models(
+                model.to_biosample_many(queryset))
+
+        except json.decoder.JSONDecodeError as exc:
+            return {
+                'status': 'temporary_error',
+                'message': str(exc),
+                'traceback': traceback.format_exc()}
+
+        except Exception as exc:
+            raise self.retry(exc=exc)
+
+        validate_submission.log_cache_stats()
+
+        return {
+            'status': 'success',
+            'message': None,
+            'model_type': model_type,
+            'ids': ids,
+            'results': validate_submission.get_results()}
+
+
+class ValidateCompleteTask(ValidateTask):
+    name = "Complete Validation"
+    description = """Merge validation results and update submission"""
+
+    def run(self, *args, **kwargs):
+        """Merge the results of :py:class:`ValidateChunkTask` and then
+        update submission status. When only changed records were
+        validated (``incremental=True``), the results of the other records
+        are read from database (see
+        :py:meth:`ValidateSubmission.get_previous_results`)"""
+
+        # those are the output of ValidateChunkTask
+        chunk_results = args[0]
+
+        submission_obj = self.get_uid_submission(kwargs['uid_submission_id'])
+
+        # a ValidateSubmission object to merge results
+        validate_submission = ValidateSubmission(submission_obj, ruleset=None)
+
+        # the ids validated again, by model type
+        validated = {'animal': set(), 'sample': set()}
+
+        for chunk_result in chunk_results:
+            if chunk_result['status'] == 'temporary_error':
+                return self.temporary_error_report(
+                    chunk_result['message'],
+                    submission_obj,
+                    einfo=chunk_result.get('traceback'))
+
+            elif chunk_result['status'] == 'ruleset_error':
+                return self.ruleset_error_report(
+                    chunk_result['message'],
+                    submission_obj,
+                    einfo=chunk_result.get('traceback'))
+
+            validate_submission.merge_results(chunk_result['results'])
+
+            if chunk_result.get('ids'):
+                validated[chunk_result['model_type']].update(
+                    chunk_result['ids'])
+
+        # merge the results of the records which were not validated again
+        if kwargs.get('incremental'):
+            previous_results = validate_submission.get_previous_results(
+                validated['animal'], validated['sample'])
+
+            # validation summary was reset while validating
+            if previous_results is None:
+                logger.warning(
+                    "Can't read previous results for %s: validating the "
+                    "whole submission" % (submission_obj))
+
+                return self.validate_in_chunks(
+                    submission_obj,
+                    Animal.objects.filter(submission=submission_obj),
+                    Sample.objects.filter(submission=submission_obj))
+
+            validate_submission.merge_results(previous_results)
+
+        return self.complete_validation(submission_obj, validate_submission)
+
+
 # register explicitly tasks
 # https://github.com/celery/celery/issues/3744#issuecomment-271366923
 celery_app.tasks.register(ValidateTask)
+celery_app.tasks.register(ValidateChunkTask)
+celery_app.tasks.register(ValidateCompleteTask)
+
+
+# read ruleset when worker starts (before pool processes are created), so
+# validation tasks don't need to wait for it
+@worker_init.connect
+def warm_up_ruleset(sender=None, **kwargs):
+    try:
+        ruleset_cache.get()
+
+    except (OntologyCacheError, RulesetError) as exc:
+        logger.error("Can't read ruleset at worker startup: %s" % (exc))
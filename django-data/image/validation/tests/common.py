@@ -8,6 +8,9 @@ Created on Thu Jun 27 14:01:21 2019
 
 from unittest.mock import Mock, patch
 
+from validation.helpers import (
+    ruleset_cache, biosample_id_cache, validation_result_cache)
+
 
 # https://github.com/testing-cabal/mock/issues/139#issuecomment-122128815
 class PickableMock(Mock):
@@ -24,6 +27,11 @@ class MetaDataValidationTestMixin(object):
         # call base instance
         super().setUp()
 
+        # don't use objects cached by other tests
+        ruleset_cache.clear()
+        biosample_id_cache.clear()
+        validation_result_cache.clear()
+
         # mocking up image_validation methods
         self.read_in_ruleset_patcher = patch(
             "validation.helpers.validation.read_in_ruleset")
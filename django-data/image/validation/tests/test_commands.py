@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 26 16:40:05 2020
+
+@author: Paolo Cozzi <cozzi@ibba.cnr.it>
+
+Testing management commands (https://stackoverflow.com/a/6513372)
+
+"""
+
+from io import StringIO
+
+from unittest.mock import patch
+
+from django.core.management import call_command, CommandError
+from django.db import connection
+from django.test import TestCase
+
+from uid.models import Animal, Submission
+
+
+class CommandsTestCase(TestCase):
+
+    def test_benchmark_validation(self):
+        " Test benchmark_validation command."
+
+        out = StringIO()
+
+        # already in a test database
+        args = ["--animals", "10", "--samples", "2", "--no-testdb"]
+        opts = {'stdout': out}
+        call_command('benchmark_validation', *args, **opts)
+
+        output = out.getvalue()
+        self.assertIn("validate_models(animal)", output)
+        self.assertIn("Validated records: 30", output)
+        self.assertIn("Peak memory", output)
+
+        # synthetic data are removed
+        self.assertEqual(Submission.objects.count(), 0)
+        self.assertEqual(Animal.objects.count(), 0)
+
+    def test_benchmark_validation_no_testdb(self):
+        " benchmark_validation don't use a real database"
+
+        with patch.dict(connection.settings_dict, {'NAME': "image"}):
+            with self.assertRaisesRegex(CommandError, "not a test database"):
+                call_command(
+                    'benchmark_validation', "--no-testdb", stdout=StringIO())
+
+        self.assertEqual(Submission.objects.count(), 0)
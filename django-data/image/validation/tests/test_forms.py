@@ -14,6 +14,6 @@ from ..forms import ValidateForm
 class ValidateFormTest(TestCase):
     def test_form_has_fields(self):
         form = ValidateForm()
-        expected = ['submission_id']
+        expected = ['submission_id', 'incremental']
         actual = list(field.name for field in form)
         self.assertSequenceEqual(expected, actual)
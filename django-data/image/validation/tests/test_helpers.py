@@ -6,13 +6,17 @@ Created on Tue Jan 22 14:28:16 2019
 @author: Paolo Cozzi <cozzi@ibba.cnr.it>
 """
 
+import os
 import json
+import time
 import redis
+import tempfile
 import requests_cache
 
 from datetime import timedelta
 
-from image_validation.ValidationResult import ValidationResultRecord
+from image_validation.ValidationResult import (
+    ValidationResultRecord, ValidationResultColumn)
 from unittest.mock import patch, Mock
 
 from django.test import TestCase
@@ -23,8 +27,9 @@ from uid.models import Animal, Sample, Submission
 from uid.tests import PersonMixinTestCase
 
 from ..helpers import (
-    MetaDataValidation, OntologyCacheError, RulesetError,
-    construct_validation_message)
+    MetaDataValidation, OntologyCacheError, RulesetError, RulesetCache,
+    construct_validation_message, validation_result_cache,
+    BIOSAMPLE_CACHE_TTL)
 from ..models import ValidationResult, ValidationSummary
 from .common import PickableMock, MetaDataValidationTestMixin
 
@@ -87,13 +92,72 @@ class MetaDataValidationTestCase(MetaDataValidationTestMixin, TestCase):
         # test mocked function called
         self.assertTrue(self.check_ruleset.called)
 
-    @patch("requests.get")
-    def check_biosample_id(self, mock_get, status_code):
+    def test_ruleset_cached(self):
+        """Test that ruleset is read once"""
+
+        metadata1 = MetaDataValidation()
+        metadata2 = MetaDataValidation()
+
+        self.assertEqual(metadata1.ruleset, metadata2.ruleset)
+        self.assertEqual(self.read_in_ruleset.call_count, 1)
+        self.assertEqual(self.check_ruleset.call_count, 1)
+
+    def test_ruleset_expired(self):
+        """Test an expired ruleset is used when EBI is unreachable"""
+
+        cache = RulesetCache(ttl=-1)
+
+        ruleset = cache.get()
+        self.assertEqual(cache.version, 1)
+
+        # ruleset is expired and read again
+        self.assertEqual(cache.get(), ruleset)
+        self.assertEqual(self.read_in_ruleset.call_count, 2)
+        self.assertEqual(cache.version, 2)
+
+        # issues with EBI: the expired ruleset is returned
+        self.read_in_ruleset.side_effect = json.JSONDecodeError(
+            "meow", "woof", 42)
+
+        self.assertEqual(cache.get(), ruleset)
+        self.assertEqual(self.read_in_ruleset.call_count, 3)
+        self.assertEqual(cache.version, 2)
+
+    def test_ruleset_snapshot(self):
+        """Test reading ruleset from a snapshot file"""
+
+        # a pickable ruleset
+        self.read_in_ruleset.return_value = {'ruleset': 'test'}
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            snapshot = os.path.join(tmpdir, "ruleset.pkl")
+
+            cache = RulesetCache(snapshot=snapshot)
+            cache.get()
+
+            self.assertTrue(os.path.exists(snapshot))
+
+            # issues with EBI: read ruleset from snapshot
+            self.read_in_ruleset.side_effect = json.JSONDecodeError(
+                "meow", "woof", 42)
+
+            cache = RulesetCache(snapshot=snapshot)
+            self.assertEqual(cache.get(), {'ruleset': 'test'})
+
+            # a snapshot for a different ruleset is ignored
+            self.assertRaises(
+                OntologyCacheError,
+                cache.get,
+                "another_ruleset.json")
+
+    @patch("validation.helpers.get_biosample_session")
+    def check_biosample_id(self, mock_session, status_code):
         """Base method for checking biosample id"""
 
         # paching response
         response = Mock()
         response.status_code = status_code
+        mock_get = mock_session.return_value.get
         mock_get.return_value = response
 
         # create a fake ValidationResultRecord
@@ -133,6 +197,194 @@ class MetaDataValidationTestCase(MetaDataValidationTestMixin, TestCase):
         self.assertEqual(record_result.get_overall_status(), 'Warning')
         self.assertEqual(len(record_result.get_messages()), 1)
 
+    @patch("validation.helpers.get_biosample_session")
+    def test_check_biosample_id_cached(self, mock_session):
+        """Test biosample ids are checked once"""
+
+        response = Mock()
+        response.status_code = 200
+        mock_get = mock_session.return_value.get
+        mock_get.return_value = response
+
+        metadata = MetaDataValidation()
+
+        for i in range(2):
+            record_result = ValidationResultRecord(record_id="test")
+            record_result = metadata.check_biosample_id_target(
+                "FAKEA123456", "test", record_result)
+            self.assertEqual(record_result.get_overall_status(), 'Pass')
+
+        self.assertEqual(mock_get.call_count, 1)
+
+        # server errors are not cached
+        response.status_code = 500
+
+        for i in range(2):
+            record_result = ValidationResultRecord(record_id="test")
+            record_result = metadata.check_biosample_id_target(
+                "FAKEA654321", "test", record_result)
+            self.assertEqual(record_result.get_overall_status(), 'Warning')
+
+        self.assertEqual(mock_get.call_count, 3)
+
+    @patch("validation.helpers.get_biosample_session")
+    def test_prefetch_relationships(self, mock_session):
+        """Test checking all relationships at once"""
+
+        response = Mock()
+        response.status_code = 200
+        mock_get = mock_session.return_value.get
+        mock_get.return_value = response
+
+        records = [
+            {'sampleRelationships': [
+                {'accession': 'FAKEA123456', 'relationshipNature': 'child of'},
+                {'alias': 'IMAGEA000000001', 'relationshipNature': 'child of'},
+            ]},
+            {'sampleRelationships': [
+                {'accession': 'FAKEA123456', 'relationshipNature': 'child of'},
+                {'accession': 'FAKEA654321', 'relationshipNature': 'child of'},
+            ]},
+            {},
+        ]
+
+        metadata = MetaDataValidation()
+        metadata.prefetch_relationships(records)
+
+        # each accession is checked once
+        self.assertEqual(mock_get.call_count, 2)
+
+        # no more requests when checking a record
+        record_result = ValidationResultRecord(record_id="test")
+        metadata.check_biosample_id_target(
+            "FAKEA654321", "test", record_result)
+
+        self.assertEqual(mock_get.call_count, 2)
+
+
+class ValidationCacheTestCase(MetaDataValidationTestMixin, TestCase):
+    """Test validation results cached by record content"""
+
+    def get_record(self, name, specie="Sus scrofa"):
+        return {
+            'alias': 'IMAGEA00000000%s' % name[-1],
+            'title': name,
+            'attributes': {
+                'Data source ID': [{'value': name}],
+                'Species': [{'value': specie}],
+            },
+        }
+
+    def setUp(self):
+        # calling my base class setup
+        super().setUp()
+
+        self.metadata = MetaDataValidation()
+
+        # an error result (no context validation)
+        result = ValidationResultRecord("animal_1")
+        result.add_validation_result_column(
+            ValidationResultColumn(
+                "Error",
+                "Wrong value for record animal_1",
+                "animal_1",
+                "Species"))
+
+        self.my_validate = self.metadata.ruleset.validate
+        self.my_validate.return_value = result
+
+    def test_record_key(self):
+        """Identity fields are not considered"""
+
+        self.assertEqual(
+            self.metadata.get_record_key(self.get_record("animal_1")),
+            self.metadata.get_record_key(self.get_record("animal_2")))
+
+        self.assertNotEqual(
+            self.metadata.get_record_key(self.get_record("animal_1")),
+            self.metadata.get_record_key(
+                self.get_record("animal_1", specie="Bos taurus")))
+
+    def test_record_key_content(self):
+        """Release date and description are record content"""
+
+        record1 = self.get_record("animal_1")
+        record1['releaseDate'] = "2020-10-19"
+        record1['attributes']['Description'] = [{'value': "a description"}]
+
+        record2 = self.get_record("animal_2")
+        record2['releaseDate'] = "2020-10-19"
+        record2['attributes']['Description'] = [{'value': "a description"}]
+
+        self.assertEqual(
+            self.metadata.get_record_key(record1),
+            self.metadata.get_record_key(record2))
+
+        record2['releaseDate'] = "2020-19-10"
+
+        self.assertNotEqual(
+            self.metadata.get_record_key(record1),
+            self.metadata.get_record_key(record2))
+
+        record2['releaseDate'] = "2020-10-19"
+        record2['attributes']['Description'] = [{'value': "another one"}]
+
+        self.assertNotEqual(
+            self.metadata.get_record_key(record1),
+            self.metadata.get_record_key(record2))
+
+    def test_validate_cached(self):
+        """Records with the same content are validated once"""
+
+        result1 = self.metadata.validate(self.get_record("animal_1"))
+        result2 = self.metadata.validate(self.get_record("animal_2"))
+
+        self.assertEqual(self.my_validate.call_count, 1)
+        self.assertEqual(self.metadata.cache_hits, 1)
+        self.assertEqual(self.metadata.cache_misses, 1)
+
+        # messages are referred to the validated record
+        self.assertEqual(
+            result2.get_overall_status(), result1.get_overall_status())
+        self.assertEqual(
+            len(result2.get_messages()), len(result1.get_messages()))
+        self.assertNotIn("animal_1", " ".join(result2.get_messages()))
+        self.assertIn("animal_2", " ".join(result2.get_messages()))
+
+        # a record with a different content is validated
+        self.metadata.validate(
+            self.get_record("animal_3", specie="Bos taurus"))
+
+        self.assertEqual(self.my_validate.call_count, 2)
+        self.assertEqual(self.metadata.cache_misses, 2)
+
+    def test_validate_cache_expired(self):
+        """Cached results expire like BioSamples ids"""
+
+        now = time.time()
+
+        with patch("validation.helpers.time.time", return_value=now):
+            self.metadata.validate(self.get_record("animal_1"))
+
+        expired = now + BIOSAMPLE_CACHE_TTL + 1
+
+        with patch("validation.helpers.time.time", return_value=expired):
+            self.metadata.validate(self.get_record("animal_2"))
+
+        self.assertEqual(self.my_validate.call_count, 2)
+        self.assertEqual(self.metadata.cache_hits, 0)
+
+    def test_validate_not_cached(self):
+        """Results are cached only using a cached ruleset"""
+
+        metadata = MetaDataValidation(use_cache=False)
+
+        for name in ["animal_1", "animal_2"]:
+            metadata.validate(self.get_record(name))
+
+        self.assertEqual(metadata.ruleset.validate.call_count, 2)
+        self.assertEqual(metadata.cache_hits, 0)
+
 
 class SubmissionMixin(PersonMixinTestCase):
 
@@ -167,6 +419,9 @@ class SubmissionMixin(PersonMixinTestCase):
         # calling my base class setup
         super().setUp()
 
+        # don't use results cached by other tests
+        validation_result_cache.clear()
+
         self.metadata = MetaDataValidation()
 
 
@@ -297,6 +552,33 @@ class SubmissionTestCase(SubmissionMixin, TestCase):
             "Could not locate the referenced record",
             result.get_messages()[0])
 
+    @patch("validation.helpers.get_model_object")
+    def test_prefetch_relationships(self, my_get):
+        """Testing related objects serialized once"""
+
+        # the alias of the animal of this sample
+        alias = self.sample.animal.biosample_alias
+
+        self.metadata.prefetch_relationships([self.sample_record])
+        self.assertEqual(list(self.metadata.related.keys()), [alias])
+
+        # check relationship method
+        record_result = ValidationResultRecord(
+            record_id=self.sample_record['title'])
+
+        related, result = self.metadata.check_relationship(
+            self.sample_record, record_result)
+
+        self.assertEqual(related, [self.sample.animal.to_biosample()])
+        self.assertEqual(result.get_overall_status(), 'Pass')
+
+        # animal was read by prefetch_relationships
+        self.assertFalse(my_get.called)
+
+        # related objects not referenced are removed
+        self.metadata.prefetch_relationships([self.animal_record])
+        self.assertEqual(self.metadata.related, {})
+
     def test_sample_issue_organism_part(self):
         """Testing a problem in metadata: organism_part lacks of term"""
 
@@ -493,6 +775,96 @@ class ValidationSummaryTestCase(TestCase):
         self.assertEqual(self.validationsummary_sample.all_count, 0)
         self.assertEqual(self.validationsummary_sample.issues_count, 0)
 
+    def test_update_counts(self):
+        """Test counters calculated from validation results"""
+
+        # add an error for animal 2
+        ValidationResult.objects.create(
+            submission=self.submission,
+            content_object=Animal.objects.get(pk=2),
+            status="Error",
+            messages=["test message"])
+
+        self.validationsummary_animal.update_counts()
+
+        self.assertEqual(self.validationsummary_animal.pass_count, 1)
+        self.assertEqual(self.validationsummary_animal.warning_count, 0)
+        self.assertEqual(self.validationsummary_animal.error_count, 1)
+        self.assertEqual(
+            self.validationsummary_animal.validation_known_count, 2)
+        self.assertEqual(self.validationsummary_animal.issues_count, 1)
+
+        # sample has no validation results
+        self.validationsummary_sample.update_counts()
+
+        self.assertEqual(
+            self.validationsummary_sample.validation_known_count, 0)
+        self.assertEqual(self.validationsummary_sample.issues_count, 0)
+
+    def test_get_result_messages(self):
+        """Test messages calculated from validation results"""
+
+        for pk in [3, 2]:
+            ValidationResult.objects.create(
+                submission=self.submission,
+                content_object=Animal.objects.get(pk=pk),
+                status="Error",
+                messages=["test message", "message %s" % (pk)])
+
+        reference = [{
+            'message': 'test message',
+            'count': 2,
+            'ids': [2, 3],
+            'offending_column': ''
+        }, {
+            'message': 'message 2',
+            'count': 1,
+            'ids': [2],
+            'offending_column': ''
+        }, {
+            'message': 'message 3',
+            'count': 1,
+            'ids': [3],
+            'offending_column': ''
+        }]
+
+        test = self.validationsummary_animal.get_result_messages(
+            status="Error")
+
+        self.assertEqual(
+            sorted(test, key=lambda message: message['message']),
+            sorted(reference, key=lambda message: message['message']))
+
+        # no messages for passed results
+        self.assertEqual(
+            self.validationsummary_animal.get_result_messages(
+                status="Pass"),
+            [])
+
+    def test_recompute(self):
+        """Test summary update after data deletion"""
+
+        # delete the animal referenced by summary messages
+        Animal.objects.filter(pk__in=[1, 3]).delete()
+        Sample.objects.get(pk=1).delete()
+
+        self.validationsummary_animal.recompute()
+        self.validationsummary_sample.recompute()
+
+        # reload objects
+        self.validationsummary_animal.refresh_from_db()
+        self.validationsummary_sample.refresh_from_db()
+
+        self.assertEqual(self.validationsummary_animal.all_count, 1)
+        self.assertEqual(
+            self.validationsummary_animal.validation_known_count, 0)
+        self.assertEqual(self.validationsummary_animal.warning_count, 0)
+        self.assertEqual(self.validationsummary_animal.messages, [])
+
+        # messages without ids are preserved
+        self.assertEqual(self.validationsummary_sample.all_count, 0)
+        self.assertEqual(len(self.validationsummary_sample.messages), 1)
+
     def test_construct_validation_message(self):
         """Testing validation message creation"""
 
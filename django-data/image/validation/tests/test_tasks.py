@@ -18,16 +18,20 @@ from image_validation.ValidationResult import (
 
 from django.core import mail
 from django.test import TestCase
+from django.utils import timezone
 
 from common.constants import (
     LOADED, ERROR, READY, NEED_REVISION, COMPLETED, SUBMITTED)
+from common.helpers import get_payload_size
 from common.tests import WebSocketMixin
 from uid.models import Submission, Animal, Sample
 from uid.tests import PersonMixinTestCase
 
-from ..tasks import ValidateTask, ValidationError, ValidateSubmission
+from ..tasks import (
+    ValidateTask, ValidationError, ValidateSubmission, ValidateChunkTask,
+    ValidateCompleteTask, get_changed_records)
 from ..helpers import OntologyCacheError, RulesetError
-from ..models import ValidationSummary
+from ..models import ValidationSummary, ValidationResult
 from .common import PickableMock, MetaDataValidationTestMixin
 
 
@@ -190,6 +194,39 @@ class ValidateSubmissionTest(ValidateSubmissionMixin, TestCase):
         sample_summary = summary_qs.get(type="sample")
         self.assertEqual(sample_summary.all_count, self.n_samples)
 
+    def test_merge_results(self):
+        """Merge results from another validation"""
+
+        # set up messages
+        self.submission_data.animals_statuses['Pass'] = 1
+        self.submission_data.animals_messages['test error'] = [1]
+        self.submission_data.animals_offending_columns['test error'] = \
+            'test_error'
+
+        # get results from another validation
+        other = ValidateSubmission(self.submission, ruleset=None)
+        other.animals_statuses['Pass'] = 1
+        other.animals_statuses['Error'] = 1
+        other.animals_messages['test error'] = [2]
+        other.samples_messages['test warning'] = [1]
+        other.samples_offending_columns['test warning'] = 'test_warning'
+
+        # results need to be JSON serializable
+        results = json.loads(json.dumps(other.get_results()))
+
+        self.submission_data.merge_results(results)
+
+        self.assertEqual(
+            self.submission_data.animals_statuses,
+            Counter({'Pass': 2, 'Error': 1}))
+        self.assertEqual(
+            self.submission_data.animals_messages['test error'], [1, 2])
+        self.assertEqual(
+            self.submission_data.samples_messages['test warning'], [1])
+        self.assertEqual(
+            self.submission_data.samples_offending_columns,
+            {'test warning': 'test_warning'})
+
 
 class ValidateTaskTest(
         CustomWebSocketMixin, ValidateSubmissionMixin, TestCase):
@@ -831,6 +868,347 @@ class ValidateTaskTest(
             pk=1)
 
 
+class ValidateChunkTaskTest(
+        CustomWebSocketMixin, ValidateSubmissionMixin, TestCase):
+
+    def get_validation_result(self):
+        validation_result = Mock()
+        validation_result.get_overall_status.return_value = "Pass"
+        validation_result.get_messages.return_value = ["A message"]
+
+        result_set = Mock()
+        result_set.get_comparable_str.return_value = "A message"
+        result_set.get_field_name.return_value = "Offended Column"
+        validation_result.result_set = [result_set]
+
+        return validation_result
+
+    @patch("validation.tasks.chord")
+    @patch("validation.tasks.VALIDATION_CHUNK_SIZE", 1)
+    def test_validate_in_chunks(self, my_chord):
+        """Big submission are validated by a chord of tasks"""
+
+        res = self.my_task.run(submission_id=self.submission_id)
+
+        # assert a success with validation taks
+        self.assertEqual(res, "success")
+
+        # a task for each animal and sample
+        self.assertTrue(my_chord.called)
+        header = my_chord.call_args[0][0]
+        self.assertEqual(len(header), self.n_animals + self.n_samples)
+
+        # each task has submission_id, model type and a range of ids
+        animal = self.animal_qs.first()
+        self.assertEqual(
+            tuple(header[0].args),
+            (self.submission_id, 'animal', animal.id, animal.id))
+
+        # no messages until chord completes
+        self.check_message_not_called()
+
+    @patch("validation.tasks.MetaDataValidation.check_usi_structure")
+    @patch("validation.tasks.MetaDataValidation.validate")
+    def test_validate_chunks(self, my_validate, my_check):
+        """Validate submission in chunks, then merge results"""
+
+        # setting check_usi_structure result
+        result = PickableMock()
+        result.get_overall_status.return_value = "Pass"
+        result.get_messages.return_value = []
+        my_check.return_value = result
+
+        my_validate.return_value = self.get_validation_result()
+
+        validate_chunk = ValidateChunkTask()
+        chunk_results = []
+
+        for model_type, queryset in [
+                ('animal', self.animal_qs), ('sample', self.sample_qs)]:
+            chunk_results.append(validate_chunk.run(
+                self.submission_id,
+                model_type,
+                queryset.first().id,
+                queryset.last().id))
+
+        # check chunk results
+        self.assertEqual(chunk_results[0]['status'], 'success')
+        self.assertEqual(
+            chunk_results[0]['results']['animals_statuses'],
+            {'Pass': self.n_animals, 'Known': self.n_animals})
+        self.assertEqual(
+            chunk_results[1]['results']['samples_messages']['A message'],
+            list(self.sample_qs.values_list('id', flat=True)))
+
+        # no messages until chord completes
+        self.check_message_not_called()
+
+        # merge results
+        validate_complete = ValidateCompleteTask()
+        res = validate_complete.run(
+            chunk_results, uid_submission_id=self.submission_id)
+
+        # assert a success with validation taks
+        self.assertEqual(res, "success")
+
+        # check submission status and message
+        self.submission.refresh_from_db()
+
+        self.assertEqual(self.submission.status, READY)
+        self.assertEqual(
+            self.submission.message,
+            "Submission validated with success")
+
+        # check validation summary
+        summary = ValidationSummary.objects.get(
+            submission=self.submission, type="sample")
+        self.assertEqual(summary.pass_count, self.n_samples)
+        self.assertEqual(summary.messages[0]['count'], self.n_samples)
+
+        validation_message = {
+            'animals': self.n_animals,
+            'samples': self.n_samples,
+            'animal_unkn': 0, 'sample_unkn': 0,
+            'animal_issues': 0, 'sample_issues': 0}
+
+        self.check_message(
+            'Ready',
+            'Submission validated with success',
+            validation_message=validation_message
+        )
+
+    def test_validate_chunks_with_errors(self):
+        """A temporary error in a chunk is reported once"""
+
+        chunk_results = [
+            {'status': 'temporary_error', 'message': 'test',
+             'traceback': 'Traceback: test error'},
+            {'status': 'temporary_error', 'message': 'test',
+             'traceback': 'Traceback: test error'}]
+
+        validate_complete = ValidateCompleteTask()
+        res = validate_complete.run(
+            chunk_results, uid_submission_id=self.submission_id)
+
+        self.assertEqual(res, "success")
+
+        # check submission status and message
+        self.submission.refresh_from_db()
+
+        self.assertEqual(self.submission.status, LOADED)
+        self.assertEqual(len(mail.outbox), 1)
+
+        # the stacktrace of chunk task is in email
+        self.assertIn("Traceback: test error", mail.outbox[0].body)
+        self.assertNotIn("NoneType: None", mail.outbox[0].body)
+
+    @patch("validation.tasks.MetaDataValidation",
+           side_effect=RulesetError("test ruleset"))
+    def test_validate_chunk_errors(self, my_ruleset):
+        """A chunk task returns errors with their stacktrace"""
+
+        animal = self.animal_qs.first()
+
+        validate_chunk = ValidateChunkTask()
+        res = validate_chunk.run(
+            self.submission_id, 'animal', animal.id, animal.id)
+
+        self.assertEqual(res['status'], 'ruleset_error')
+        self.assertEqual(res['message'], 'test ruleset')
+        self.assertIn("RulesetError: test ruleset", res['traceback'])
+
+        self.check_message(
+            'Loaded',
+            'Errors in EBI API endpoints. Please try again later')
+
+
+class ValidateIncrementalTest(
+        CustomWebSocketMixin, ValidateSubmissionMixin, TestCase):
+    """Validate only the records changed after the last validation"""
+
+    def get_validation_result(self, status, message):
+        validation_result = Mock()
+        validation_result.get_overall_status.return_value = status
+        validation_result.get_messages.return_value = [message]
+
+        result_set = Mock()
+        result_set.get_comparable_str.return_value = message
+        result_set.get_field_name.return_value = "Offended Column"
+        validation_result.result_set = [result_set]
+
+        return validation_result
+
+    def setUp(self):
+        # calling base methods
+        super().setUp()
+
+        # setting check_usi_structure result
+        result = PickableMock()
+        result.get_overall_status.return_value = "Pass"
+        result.get_messages.return_value = []
+
+        self.check_patcher = patch(
+            "validation.tasks.MetaDataValidation.check_usi_structure")
+        self.my_check = self.check_patcher.start()
+        self.my_check.return_value = result
+
+        self.validate_patcher = patch(
+            "validation.tasks.MetaDataValidation.validate")
+        self.my_validate = self.validate_patcher.start()
+        self.my_validate.return_value = self.get_validation_result(
+            "Pass", "A message")
+
+        # validate the whole submission
+        self.my_task.run(submission_id=self.submission_id)
+
+        # change an animal (father of animal 3 and animal of sample 1)
+        Animal.objects.filter(pk=1).update(last_changed=timezone.now())
+
+    def tearDown(self):
+        self.check_patcher.stop()
+        self.validate_patcher.stop()
+
+        super().tearDown()
+
+    def test_get_changed_records(self):
+        animal_ids, sample_ids = get_changed_records(self.submission)
+
+        self.assertEqual(animal_ids, {1, 3})
+        self.assertEqual(sample_ids, {1})
+
+    def test_save_validationresult(self):
+        """Saving a validation result doesn't mark it as validated"""
+
+        validationresult = Animal.objects.get(pk=2).validationresults.get()
+        last_validated = validationresult.last_validated
+
+        validationresult.messages = []
+        validationresult.save()
+
+        validationresult.refresh_from_db()
+        self.assertEqual(validationresult.last_validated, last_validated)
+
+    def test_payload_bytes(self):
+        """The size of validated data is tracked in validation results"""
+
+        for animal in self.animal_qs:
+            validationresult = animal.validationresults.get()
+            self.assertEqual(
+                validationresult.payload_bytes,
+                get_payload_size(animal.to_biosample()))
+
+    def test_validate_incremental(self):
+        self.my_validate.reset_mock()
+        self.my_validate.return_value = self.get_validation_result(
+            "Error", "An error")
+
+        res = self.my_task.run(
+            submission_id=self.submission_id, incremental=True)
+
+        # assert a success with validation taks
+        self.assertEqual(res, "success")
+
+        # only changed records are validated
+        self.assertEqual(self.my_validate.call_count, 3)
+
+        # check submission status
+        self.submission.refresh_from_db()
+        self.assertEqual(self.submission.status, NEED_REVISION)
+
+        # check validation summary
+        summary = ValidationSummary.objects.get(
+            submission=self.submission, type="animal")
+
+        self.assertEqual(summary.validation_known_count, self.n_animals)
+        self.assertEqual(summary.pass_count, self.n_animals - 2)
+        self.assertEqual(summary.error_count, 2)
+        self.assertEqual(summary.issues_count, 2)
+
+        messages = {
+            message['message']: sorted(message['ids'])
+            for message in summary.messages}
+
+        self.assertEqual(messages, {'A message': [2], 'An error': [1, 3]})
+
+        summary = ValidationSummary.objects.get(
+            submission=self.submission, type="sample")
+
+        self.assertEqual(summary.validation_known_count, self.n_samples)
+        self.assertEqual(summary.error_count, 1)
+
+    @patch("validation.tasks.chord")
+    @patch("validation.tasks.VALIDATION_CHUNK_SIZE", 1)
+    def test_validate_incremental_in_chunks(self, my_chord):
+        """Only changed records are validated in chunks"""
+
+        self.my_validate.reset_mock()
+        self.my_validate.return_value = self.get_validation_result(
+            "Error", "An error")
+
+        res = self.my_task.run(
+            submission_id=self.submission_id, incremental=True)
+
+        self.assertEqual(res, "success")
+
+        # a task for each changed record, with explicit ids
+        header = my_chord.call_args[0][0]
+        self.assertEqual(len(header), 3)
+        self.assertEqual(
+            [(task.args[1], task.kwargs['ids']) for task in header],
+            [('animal', [1]), ('animal', [3]), ('sample', [1])])
+
+        # previous results are read by callback
+        callback = my_chord.return_value.call_args[0][0]
+        self.assertEqual(
+            callback.kwargs,
+            {'uid_submission_id': self.submission_id, 'incremental': True})
+
+        # run chunks and merge results
+        validate_chunk = ValidateChunkTask()
+        chunk_results = [
+            validate_chunk.run(*task.args, **task.kwargs) for task in header]
+
+        self.assertEqual(self.my_validate.call_count, 3)
+
+        validate_complete = ValidateCompleteTask()
+        res = validate_complete.run(chunk_results, **callback.kwargs)
+
+        self.assertEqual(res, "success")
+
+        summary = ValidationSummary.objects.get(
+            submission=self.submission, type="animal")
+
+        self.assertEqual(summary.validation_known_count, self.n_animals)
+        self.assertEqual(summary.error_count, 2)
+
+        messages = {
+            message['message']: sorted(message['ids'])
+            for message in summary.messages}
+
+        self.assertEqual(messages, {'A message': [2], 'An error': [1, 3]})
+
+    def test_validate_nothing_changed(self):
+        # validate again the whole submission
+        self.my_task.run(submission_id=self.submission_id)
+        self.my_validate.reset_mock()
+
+        res = self.my_task.run(
+            submission_id=self.submission_id, incremental=True)
+
+        self.assertEqual(res, "success")
+        self.assertFalse(self.my_validate.called)
+
+        # statuses are read from previous validation
+        self.submission.refresh_from_db()
+        self.assertEqual(self.submission.status, READY)
+
+        summary = ValidationSummary.objects.get(
+            submission=self.submission, type="animal")
+
+        self.assertEqual(summary.pass_count, self.n_animals)
+        self.assertEqual(summary.messages[0]['count'], self.n_animals)
+
+
 class ValidateSubmissionStatusTest(ValidateSubmissionMixin, TestCase):
     """Check database statuses after calling validation"""
 
@@ -861,9 +1239,10 @@ class ValidateSubmissionStatusTest(ValidateSubmissionMixin, TestCase):
              'Error': 0,
              'JSON': 0})
 
-        # calling update statuses
+        # calling update statuses and write them into database
         self.submission_data.update_statuses(
             submission_statuses, self.animal, result)
+        self.submission_data.flush()
 
         # Test for animal status
         self.animal.refresh_from_db()
@@ -898,6 +1277,39 @@ class ValidateSubmissionStatusTest(ValidateSubmissionMixin, TestCase):
 
         self.check_status(status, messages, animal_status)
 
+    def test_update_status_batch(self):
+        """Test validation results are written in batches"""
+
+        result = PickableMock()
+        result.get_overall_status.return_value = 'Error'
+        result.get_messages.return_value = ['issued an error']
+        result.result_set = []
+
+        submission_data = ValidateSubmission(
+            self.submission, ruleset=None, batch_size=2)
+
+        animals = list(Animal.objects.filter(pk__in=[1, 2]).order_by('pk'))
+
+        # validate the same animal twice: nothing is written
+        for i in range(2):
+            submission_data.update_statuses(Counter(), animals[0], result)
+
+        self.animal.refresh_from_db()
+        self.assertNotEqual(self.animal.status, NEED_REVISION)
+        self.assertEqual(self.animal.validationresult.status, 'Pass')
+
+        # batch is full: results are updated (animal 1) or created
+        submission_data.update_statuses(Counter(), animals[1], result)
+
+        for animal in animals:
+            animal.refresh_from_db()
+            self.assertEqual(animal.status, NEED_REVISION)
+            self.assertEqual(animal.validationresult.status, 'Error')
+
+        self.assertEqual(
+            ValidationResult.objects.filter(
+                object_id__in=[1, 2]).count(), 2)
+
 
 class ValidateUpdatedSubmissionStatusTest(ValidateSubmissionMixin, TestCase):
     """Check database statuses after calling validation for an updated
@@ -959,6 +1371,9 @@ class ValidateUpdatedSubmissionStatusTest(ValidateSubmissionMixin, TestCase):
                 sample,
                 result)
 
+        # write statuses into database
+        self.submission_data.flush()
+
         # refreshing data from db
         self.animal.refresh_from_db()
 
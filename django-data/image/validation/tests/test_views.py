@@ -73,11 +73,11 @@ class ValidateViewTest(TestMixin, TestCase):
 
     def test_form_inputs(self):
         '''
-        The view two inputs: csrf, submission_id"
+        The view three inputs: csrf, submission_id, incremental"
         '''
 
         # total input is n of form fields + (CSRF)
-        self.assertContains(self.response, '<input', 2)
+        self.assertContains(self.response, '<input', 3)
 
 
 class SuccessfulValidateViewTest(TestMixin, TestCase):
@@ -116,8 +116,9 @@ class SuccessfulValidateViewTest(TestMixin, TestCase):
     def test_validation_status(self):
         """check validation started and submission.state"""
 
-        # check validation started
-        self.assertTrue(self.my_validation.called)
+        # check validation started (validating all records)
+        self.my_validation.assert_called_once_with(
+            self.submission_id, incremental=False)
 
         # get submission object
         submission = Submission.objects.get(pk=self.submission_id)
@@ -128,6 +129,24 @@ class SuccessfulValidateViewTest(TestMixin, TestCase):
             submission.message,
             "waiting for data validation")
 
+    @patch('validation.views.ValidateTask.delay')
+    def test_incremental_validation(self, my_validation):
+        """validate only changed records if requested"""
+
+        submission = Submission.objects.get(pk=self.submission_id)
+        submission.status = LOADED
+        submission.save()
+
+        self.client.post(
+            self.url, {
+                'submission_id': self.submission_id,
+                'incremental': True
+            }
+        )
+
+        my_validation.assert_called_once_with(
+            self.submission_id, incremental=True)
+
 
 class NoValidateViewTest(TestMixin, TestCase):
     @patch('validation.views.ValidateTask.delay')
@@ -56,9 +56,11 @@ class ValidateView(LoginRequiredMixin, FormView):
         submission.status = WAITING
         submission.save()
 
-        # a valid submission start a task
+        # a valid submission start a task. If requested, only records
+        # changed after the last validation will be validated
         my_task = ValidateTask()
-        res = my_task.delay(submission_id)
+        res = my_task.delay(
+            submission_id, incremental=form.cleaned_data['incremental'])
         logger.info(
             "Start validation process for %s with task %s" % (
                 submission,
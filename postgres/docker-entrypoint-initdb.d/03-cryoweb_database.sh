@@ -17,4 +17,8 @@ psql -v ON_ERROR_STOP=1 --username "$POSTGRES_USER" <<-EOSQL
 
   -- Creating cryoweb database
   CREATE DATABASE cryoweb TEMPLATE template_cryoweb;
+
+  -- Database privileges are not copied from template. Allow the creation
+  -- of staging schemas in cryoweb database
+  GRANT CREATE ON DATABASE cryoweb TO $IMAGE_USER;
 EOSQL